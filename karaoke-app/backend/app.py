@@ -1,49 +1,48 @@
 # app.py
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, current_app, g, request, jsonify
 from flask_cors import CORS
-from services.recommendation import RecommendationService
+from services.service_state import ServiceState
+from services.recommendation import (
+    RANKING_SIZE,
+    InvalidSeedError,
+    RankingCursorError,
+    make_rng,
+    new_seed,
+    parse_seed,
+)
+from services.request_log import RequestLog
+from services.session import SessionNotFoundError
+from services.metrics import HTTP_REQUEST_SECONDS, REGISTRY, cache_gauges
 from pathlib import Path
+import hmac
 import os
-import pandas as pd
+import time
 
-app = Flask(__name__)
+api = Blueprint("api", __name__)
 
-# =========================================
-# CORS設定 - フロントエンドとの通信を許可
-# =========================================
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:3000", "http://localhost:3001"],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
-    }
-})
+# バッチ推薦1回あたりの最大件数
+MAX_BATCH_SIZE = 500
 
-# =========================================
-# グローバル変数（実際の運用では適切な初期化処理を）
-# =========================================
-song_catalog = None
-recommendation_service = None
 
-def initialize_services():
-    """サービスを初期化"""
-    global song_catalog, recommendation_service
-    try:
-        csv_path = Path(__file__).parent / "data" / "songs.csv"
-        print(f"CSVファイル読み込み開始: {csv_path}")
-        song_catalog = pd.read_csv(csv_path)
-        print(f"CSV読み込み成功: {song_catalog.shape}")
-        recommendation_service = RecommendationService(song_catalog)
-        print("サービス初期化完了")
-    except Exception as e:
-        print(f"初期化エラー: {e}")
-        import traceback
-        traceback.print_exc()
+def get_state() -> ServiceState:
+    return current_app.extensions["karaoke"]
+
+
+def request_seed(data: dict) -> int:
+    """
+    リクエストの seed（省略時は新しく作る）。
+    確定した seed を含めたリクエストをリクエストログ（REQUEST_LOG）に記録する。
+    """
+    seed = parse_seed(data.get("seed"))
+    seed = new_seed() if seed is None else seed
+    g.logged_request = {**data, "seed": seed}
+    return seed
+
 
 # =========================================
 # APIエンドポイント
 # =========================================
-@app.route("/api/recommend-songs", methods=["POST"])
+@api.route("/api/recommend-songs", methods=["POST"])
 def api_recommend_songs():
     """
     フロントエンドからのリクエスト形式:
@@ -53,9 +52,10 @@ def api_recommend_songs():
         ],
         "settings": {
             "mood": "upbeat",
-            "situation": "party", 
+            "situation": "party",
             "micCount": 2
-        }
+        },
+        "seed": 123  # 任意。同じ seed・同じカタログなら同じ結果
     }
     """
     try:
@@ -63,21 +63,26 @@ def api_recommend_songs():
         if not data:
             return jsonify({"error": "Invalid request"}), 400
 
+        seed = request_seed(data)
         members = data.get("members", [])
         settings = data.get("settings", {})
 
         if not members:
             return jsonify({"error": "Members are required"}), 400
 
-        # サービスが初期化されていない場合は初期化
-        if not recommendation_service:
-            initialize_services()
+        # ウォームアップが終わっていなければ受け付けない
+        # （サービスは1回だけ取得し、再読み込み中でもこのリクエストは同じ版で処理する）
+        service = get_state().recommendation_service
+        if service is None:
+            return jsonify({"error": "Service is not ready"}), 503
 
         # 推薦を実行
-        result = recommendation_service.recommend_songs(members, settings)
+        result = service.recommend_songs(members, settings, rng=make_rng(seed))
 
         return jsonify(result), 200
 
+    except InvalidSeedError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         # エラーハンドリング
         import traceback
@@ -86,8 +91,266 @@ def api_recommend_songs():
         return jsonify({"error": str(e), "details": error_details}), 500
 
 
+@api.route("/api/recommend-songs/batch", methods=["POST"])
+def api_recommend_songs_batch():
+    """
+    複数グループの推薦をまとめて行う。
+    リクエスト形式: {"requests": [{"members": [...], "settings": {...}, "seed": 任意}, ...], "seed": 任意}
+    （要素に seed がなければ、全体の seed から要素ごとのシードを作る）
+    レスポンス形式: {"results": [{"selectedSong": {...}, "selectedSingers": [...]} または {"error": "..."}, ...]}
+    """
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get("requests"), list):
+            return jsonify({"error": "Invalid request"}), 400
+
+        seed = request_seed(data)
+
+        requests = data["requests"]
+        if len(requests) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Too many requests in batch (max {MAX_BATCH_SIZE})"}), 400
+
+        service = get_state().recommendation_service
+        if service is None:
+            return jsonify({"error": "Service is not ready"}), 503
+
+        results = service.recommend_batch(requests, seed=seed)
+        return jsonify({"results": results}), 200
+
+    except InvalidSeedError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"エラー詳細: {error_details}")
+        return jsonify({"error": str(e), "details": error_details}), 500
+
+
+@api.route("/api/recommend-songs/ranking", methods=["POST"])
+def api_recommend_songs_ranking():
+    """
+    スコア順の上位曲をページ単位で返す。
+    初回: {"members": [...], "settings": {...}, "limit": 10, "seed": 任意}
+    続き / 別の曲: {"cursor": "<前回の nextCursor>", "limit": 1}
+    レスポンス形式: {"songs": [...], "selectedSingers": [...], "nextCursor": "..." | null}
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Invalid request"}), 400
+
+        seed = request_seed(data)
+
+        cursor = data.get("cursor")
+        members = data.get("members", [])
+        if not cursor and not members:
+            return jsonify({"error": "Members are required"}), 400
+
+        limit = data.get("limit", 10)
+        if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= RANKING_SIZE:
+            return jsonify({"error": f"limit must be between 1 and {RANKING_SIZE}"}), 400
+
+        service = get_state().recommendation_service
+        if service is None:
+            return jsonify({"error": "Service is not ready"}), 503
+
+        result = service.recommend_ranking(
+            members, data.get("settings", {}), limit=limit, cursor=cursor, rng=make_rng(seed)
+        )
+        return jsonify(result), 200
+
+    except RankingCursorError as e:
+        return jsonify({"error": str(e)}), 404
+    except InvalidSeedError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"エラー詳細: {error_details}")
+        return jsonify({"error": str(e), "details": error_details}), 500
+
+
+@api.route("/api/sessions", methods=["POST"])
+def api_create_session():
+    """
+    セッションを作成し、最初の1曲を返す。以降は /api/sessions/<sessionId>/next で次の曲を取得する
+    （メンバー・設定を送り直さず、再生済みの曲と直前に歌った人を避ける）。
+    リクエスト形式: {"members": [...], "settings": {...}, "seed": 任意}（/api/recommend-songs と同じ）
+    レスポンス形式: {"sessionId": "...", "selectedSong": {...}, "selectedSingers": [...], "playedCount": 1}
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Invalid request"}), 400
+
+        seed = request_seed(data)
+
+        members = data.get("members", [])
+        if not members:
+            return jsonify({"error": "Members are required"}), 400
+
+        service = get_state().recommendation_service
+        if service is None:
+            return jsonify({"error": "Service is not ready"}), 503
+
+        result = get_state().sessions.create(service, members, data.get("settings") or {}, seed=seed)
+        return jsonify(result), 201
+
+    except InvalidSeedError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"エラー詳細: {error_details}")
+        return jsonify({"error": str(e), "details": error_details}), 500
+
+
+@api.route("/api/sessions/<session_id>/next", methods=["POST"])
+def api_session_next(session_id: str):
+    """セッションの次の曲と歌う人を返す（レスポンス形式は作成時と同じ）。"""
+    g.logged_request = {}
+    try:
+        service = get_state().recommendation_service
+        if service is None:
+            return jsonify({"error": "Service is not ready"}), 503
+
+        result = get_state().sessions.next(service, session_id)
+        return jsonify(result), 200
+
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"エラー詳細: {error_details}")
+        return jsonify({"error": str(e), "details": error_details}), 500
+
+
+@api.route("/api/sessions/<session_id>", methods=["DELETE"])
+def api_delete_session(session_id: str):
+    """セッションを終了する。"""
+    g.logged_request = {}
+    if not get_state().sessions.delete(session_id):
+        return jsonify({"error": f"unknown or expired session: {session_id}"}), 404
+    return "", 204
+
+
+@api.route("/api/health/ready", methods=["GET"])
+def api_ready():
+    """ウォームアップ完了（カタログ読み込み・モデル学習済み）なら200、未完了なら503。"""
+    status = get_state().status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@api.route("/api/admin/reload", methods=["POST"])
+def api_admin_reload():
+    """
+    カタログの再読み込みを開始する（裏で構築し、完了後に差し替え）。
+    ヘッダ X-Admin-Token が環境変数 ADMIN_TOKEN と一致する必要がある。
+    {"force": true} ならソースが変わっていなくても再構築する。
+    pre-fork 構成ではリクエストを受けたワーカーのみが対象
+    （全ワーカーに反映するには CATALOG_WATCH_INTERVAL による監視を使う）。
+    """
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        return jsonify({"error": "Admin endpoint is disabled"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode("utf-8"), token.encode("utf-8")):
+        return jsonify({"error": "Forbidden"}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    state = get_state()
+    started = state.reload(background=True, force=bool(data.get("force")))
+    return jsonify({"started": started, **state.status()}), 202 if started else 409
+
+
+@api.route("/metrics", methods=["GET"])
+def metrics():
+    """ステージ別の所要時間・HTTPレイテンシ・キャッシュ統計（Prometheus テキスト形式）。"""
+    caches = get_state().status()["caches"]
+    return Response(REGISTRY.render(cache_gauges(caches)), mimetype="text/plain; version=0.0.4")
+
+
+@api.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@api.after_app_request
+def record_latency(response):
+    start = g.pop("request_start", None)
+    if start is not None and request.url_rule is not None:
+        seconds = time.perf_counter() - start
+        HTTP_REQUEST_SECONDS.observe(seconds, endpoint=request.url_rule.rule, status=response.status_code)
+
+        # 推薦 API はリクエストログに記録する（benchmarks/replay.py で再実行できる）
+        request_log = current_app.extensions.get("karaoke_request_log")
+        logged_request = g.pop("logged_request", None)
+        if request_log is not None and logged_request is not None:
+            request_log.record({
+                "time": time.time(),
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.url_rule.rule,
+                "request": logged_request,
+                "status": response.status_code,
+                "seconds": seconds,
+                "response": response.get_json(silent=True),
+            })
+    return response
+
+
+# =========================================
+# アプリケーションファクトリ
+# =========================================
+def create_app(warmup: bool = True, csv_path: Path | None = None) -> Flask:
+    """
+    Flaskアプリを生成する。
+    warmup=True ならリクエストを受け付ける前にカタログ読み込みとモデル学習を済ませる。
+    gunicorn の preload_app と組み合わせると、親プロセスで1回だけウォームアップし
+    ワーカーは読み取り専用のカタログ・モデルを copy-on-write で共有する。
+    """
+    app = Flask(__name__)
+
+    # =========================================
+    # CORS設定 - フロントエンドとの通信を許可
+    # =========================================
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": ["http://localhost:3000", "http://localhost:3001"],
+            "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+            "allow_headers": ["Content-Type"]
+        }
+    })
+
+    csv_path = Path(csv_path or os.environ.get("SONGS_CSV", Path(__file__).parent / "data" / "songs.csv"))
+    state = ServiceState(csv_path, csv_path.with_suffix(".snapshot"))
+    app.extensions["karaoke"] = state
+    app.register_blueprint(api)
+
+    # REQUEST_LOG（ファイルパス）が設定されていれば推薦 API のリクエストを記録する
+    request_log_path = os.environ.get("REQUEST_LOG")
+    if request_log_path:
+        app.extensions["karaoke_request_log"] = RequestLog(request_log_path)
+
+    if warmup:
+        state.warmup()
+
+    # CATALOG_WATCH_INTERVAL（秒）が設定されていればソースCSVの更新を監視して自動で再読み込み。
+    # gunicorn では監視スレッドを post_fork で各ワーカーに起動する（gunicorn.conf.py が
+    # CATALOG_WATCH_POST_FORK=1 にする）。preload_app の親プロセスで起動すると、どのワーカーも
+    # 使わないカタログを再読み込みし続け、fork の瞬間に構築中のロック・状態がワーカーに残る。
+    watch_interval = os.environ.get("CATALOG_WATCH_INTERVAL")
+    if watch_interval and os.environ.get("CATALOG_WATCH_POST_FORK") != "1":
+        state.start_watcher(float(watch_interval))
+    return app
+
+
 # =========================================
 # Flaskアプリ起動
 # =========================================
+# import しただけではアプリを作らない（カタログ読み込み・モデル学習・スナップショット書き出しを
+# 行うのは create_app を呼んだときだけ）。本番のエントリポイントは wsgi.py / asgi.py。
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5001)
+    create_app().run(debug=True, host="0.0.0.0", port=5001)
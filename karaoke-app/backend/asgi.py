@@ -0,0 +1,196 @@
+# asgi.py
+# 非同期サーバ用エントリポイント（本番用）:
+#   uvicorn --factory asgi:create_asgi_app --host 0.0.0.0 --port 5001
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker 'asgi:create_asgi_app()'
+# import しただけではアプリを作らない（create_asgi_app を呼んだときに create_app する）。
+#
+# API の仕様は app.py（Flask）と同じ。イベントループはリクエストの受け付けだけを行い、
+# 推薦処理（CPU 処理）は上限付きのスレッドプールで実行する。
+# ・同時実行数: RECOMMEND_WORKERS（既定 8）
+# ・待ち行列:   RECOMMEND_QUEUE_SIZE（既定 64）。実行中 + 待ちが上限に達したら 429
+# ・タイムアウト: RECOMMEND_TIMEOUT 秒（既定 10）。超えたら 504
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import io
+import json
+import os
+import sys
+
+from flask import Flask
+
+from app import create_app
+from services.metrics import HTTP_REJECTED
+
+# リクエストボディの上限（バイト）
+MAX_BODY_BYTES = 1024 * 1024
+
+# (ステータスコード, ヘッダ, ボディ)
+Response = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+
+class ClientDisconnected(Exception):
+    """ボディを受け取り終える前にクライアントが切断した。"""
+
+
+class AsyncServingApp:
+    """
+    Flask アプリ（WSGI）を、上限付きスレッドプールで実行する ASGI アプリ。
+    タイムアウトしたリクエストの処理はスレッド上で最後まで実行されるため、
+    その間は枠を占有したまま数える（過負荷時に実行中の処理が積み上がらないようにする）。
+    """
+
+    def __init__(
+        self,
+        wsgi_app: Flask,
+        max_workers: int = 8,
+        max_pending: int = 64,
+        timeout: Optional[float] = 10.0,
+    ):
+        self.flask_app = wsgi_app
+        self.max_workers = max_workers
+        self.max_in_flight = max_workers + max_pending
+        self.timeout = timeout
+        self.in_flight = 0  # イベントループのスレッドからのみ更新する
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recommend")
+
+    async def __call__(self, scope: Dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        try:
+            body = await self._read_body(receive)
+        except ClientDisconnected:
+            # 途中までのボディで処理しない（応答の送り先もない）
+            HTTP_REJECTED.inc(reason="disconnected")
+            return
+        if body is None:
+            HTTP_REJECTED.inc(reason="too_large")
+            await self._send(send, self._error(413, "Request body is too large"))
+            return
+
+        # バックプレッシャー: 枠がなければスレッドプールに積まずに即座に断る
+        if self.in_flight >= self.max_in_flight:
+            HTTP_REJECTED.inc(reason="busy")
+            await self._send(send, self._error(429, "Server is busy", [(b"retry-after", b"1")]))
+            return
+
+        self.in_flight += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, self._call_wsgi, self._environ(scope, body)
+        )
+        future.add_done_callback(self._release)
+        try:
+            response = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            HTTP_REJECTED.inc(reason="timeout")
+            response = self._error(504, "Request timed out")
+        await self._send(send, response)
+
+    def _release(self, _future) -> None:
+        self.in_flight -= 1
+
+    # ---- ASGI ----
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        """ボディを読み込む。MAX_BODY_BYTES を超えたら None。途中で切断されたら ClientDisconnected。"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _send(send, response: Response) -> None:
+        status, headers, body = response
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    def _error(status: int, message: str, headers: Optional[List[Tuple[bytes, bytes]]] = None) -> Response:
+        body = json.dumps({"error": message}).encode("utf-8")
+        return status, [(b"content-type", b"application/json"), *(headers or [])], body
+
+    # ---- WSGI ----
+    @staticmethod
+    def _environ(scope: Dict, body: bytes) -> Dict:
+        """ASGI の scope から WSGI の environ を作る。"""
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            key = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if key == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+                continue
+            if key == "CONTENT_LENGTH":
+                continue
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _call_wsgi(self, environ: Dict) -> Response:
+        """Flask アプリを実行する（スレッドプール上）。"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        result = self.flask_app(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return started["status"], started["headers"], body
+
+
+def create_asgi_app(flask_app: Optional[Flask] = None) -> AsyncServingApp:
+    """環境変数の設定で AsyncServingApp を作る（flask_app を省略すると create_app() で作る）。"""
+    return AsyncServingApp(
+        flask_app if flask_app is not None else create_app(),
+        max_workers=int(os.environ.get("RECOMMEND_WORKERS", "8")),
+        max_pending=int(os.environ.get("RECOMMEND_QUEUE_SIZE", "64")),
+        timeout=float(os.environ.get("RECOMMEND_TIMEOUT", "10")),
+    )
@@ -0,0 +1,422 @@
+"""
+推薦処理のベンチマーク。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.bench_recommendation --sizes 1000,10000,100000 --output result.json
+    python -m benchmarks.bench_recommendation --compare before.json after.json
+
+・合成カタログ（data/songs.csv と同じ列）を生成し、サイズごとに別プロセスで計測する
+・計測項目: コールドスタート、各ステージ（load / encode / cluster / score / sample / table）の
+  所要時間とピークRSS、リクエスト単位のレイテンシ分位点（事前計算表を使う場合も）、
+  事前計算表の大きさ、並行実行時のスループット、
+  サービング時の起動コスト（新しいプロセスでスナップショットから Flask アプリを作り、
+  最初のリクエストを処理するまでの時間・RSS と、読み込まれた重いライブラリ）
+・結果は JSON で出力し、--compare でコミット間の比較ができる
+"""
+from typing import Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+# ========= 合成データ =========
+
+GENDERS = ["男性", "女性", "混合"]
+GENRES = ["ポップス", "J-POP", "アニソン", "ボカロ", "演歌", "ロック"]
+MOODS = ["リラックス", "盛り上がる", "しっとり", "懐かしい", "元気"]
+SITUATIONS = ["会社飲み会", "家族と", "友人と", "学生飲み会", "恋人と"]
+GENERATIONS = ["演歌・昭和歌謡", "定番曲・懐メロ", "最新ヒット"]
+REQUEST_SITUATIONS = ["友人と", "会社の人と", "恋人と", "家族と"]
+
+
+def generate_catalog_csv(path: Path, n_songs: int, seed: int = 0) -> None:
+    """data/songs.csv と同じスキーマの合成カタログを書き出す。"""
+    rng = random.Random(seed)
+    years = list(range(1970, 2025))
+    # 実データと同様に近年の曲ほど多くする
+    year_weights = [1 + (y - 1970) ** 1.5 for y in years]
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["title", "artist", "gender", "year", "genre", "mood_tags", "situation_tags"])
+        for i in range(n_songs):
+            writer.writerow([
+                f"曲{i}",
+                f"アーティスト{rng.randrange(max(1, n_songs // 5))}",
+                rng.choices(GENDERS, weights=[44, 23, 33])[0],
+                rng.choices(years, weights=year_weights)[0],
+                rng.choice(GENRES),
+                rng.choice(MOODS),
+                rng.choice(SITUATIONS),
+            ])
+
+
+def generate_requests(n: int, seed: int = 0) -> List[Dict]:
+    """現実的なメンバー構成・設定の組み合わせを生成する。"""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n):
+        members = [
+            {
+                "id": str(j),
+                "nickname": f"メンバー{j}",
+                "gender": rng.choices(["male", "female", "others"], weights=[45, 45, 10])[0],
+                "age": rng.randint(18, 70),
+            }
+            for j in range(rng.randint(1, 8))
+        ]
+        settings = {
+            "mood": rng.choice(GENERATIONS),
+            "situation": rng.choice(REQUEST_SITUATIONS),
+            "micCount": rng.randint(1, 3),
+        }
+        requests.append({"members": members, "settings": settings})
+    return requests
+
+
+# ========= 計測ユーティリティ =========
+
+def _reset_peak_rss() -> bool:
+    """Linux ではピークRSS（VmHWM）をリセットできる。成功したら True。"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _status_mb(field: str) -> Optional[float]:
+    """/proc/self/status のメモリ項目（MB）。/proc がない環境では None。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb() -> float:
+    peak = _status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    # /proc がない環境ではプロセス全体のピーク
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _rss_mb() -> float:
+    """現在のRSS（/proc がない環境ではピーク）。"""
+    rss = _status_mb("VmRSS")
+    return _peak_rss_mb() if rss is None else rss
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "meanMs": sum(ordered) / len(ordered) * 1000,
+        "p50Ms": pct(50),
+        "p90Ms": pct(90),
+        "p99Ms": pct(99),
+        "maxMs": ordered[-1] * 1000,
+    }
+
+
+def _stage(results: Dict, name: str, fn: Callable):
+    """fn を1回実行し、所要時間とステージ中のピークRSSを記録する。"""
+    peak_supported = _reset_peak_rss()
+    start = time.perf_counter()
+    value = fn()
+    results[name] = {
+        "seconds": time.perf_counter() - start,
+        "peakRssMb": _peak_rss_mb(),
+        "peakRssIsPerStage": peak_supported,
+    }
+    return value
+
+
+def _timed_loop(fn: Callable, items: List) -> Dict[str, float]:
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return _percentiles(samples)
+
+
+# ========= サービング時の起動コスト（子プロセス） =========
+
+# 推薦リクエストの処理に不要なはずの重いライブラリ（読み込まれていれば結果に出す）
+HEAVY_MODULES = ("pandas", "sklearn", "scipy")
+
+
+def serving_probe(csv_path: Path) -> Dict:
+    """
+    1ワーカー分の起動コスト。起動直後のプロセスで呼ぶ（preload しない場合のワーカーと同じ状態）。
+    スナップショット（csv_path と同じ場所の .snapshot）から Flask アプリを作り、
+    最初のリクエストを処理するまでの時間・RSS と、読み込まれた重いライブラリを返す。
+    """
+    os.environ["SONGS_CSV"] = str(csv_path)
+    os.environ.pop("REQUEST_LOG", None)
+    os.environ.pop("CATALOG_WATCH_INTERVAL", None)
+    start = time.perf_counter()
+    import flask  # noqa: F401
+    import services.service_state  # noqa: F401
+    imported = time.perf_counter()
+    from app import create_app
+    app = create_app()
+    created = time.perf_counter()
+    response = app.test_client().post("/api/recommend-songs", json={**generate_requests(1)[0], "seed": 0})
+    done = time.perf_counter()
+    return {
+        "ok": response.status_code == 200,
+        "importSeconds": imported - start,
+        "appSeconds": created - imported,
+        "firstRequestMs": (done - created) * 1000,
+        "rssMb": _rss_mb(),
+        "peakRssMb": _peak_rss_mb(),
+        "heavyModules": sorted(name for name in HEAVY_MODULES if name in sys.modules),
+    }
+
+
+def _serving_footprint(csv_path: Path) -> Dict:
+    """serving_probe を新しいプロセスで実行する（processSeconds はインタプリタの起動・終了を含む）。"""
+    start = time.perf_counter()
+    out = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.bench_recommendation", "--serving", str(csv_path)],
+        cwd=BACKEND_DIR, text=True,
+    )
+    result = json.loads(out.strip().splitlines()[-1])
+    result["processSeconds"] = time.perf_counter() - start
+    return result
+
+
+# ========= 1サイズ分の計測（子プロセス） =========
+
+def run_size(n_songs: int, n_requests: int, concurrency: List[int], workdir: Path) -> Dict:
+    csv_path = workdir / f"songs_{n_songs}.csv"
+    snapshot_path = csv_path.with_suffix(".snapshot")
+    generate_catalog_csv(csv_path, n_songs)
+    requests = generate_requests(n_requests)
+    result: Dict = {"songs": n_songs, "requests": n_requests}
+
+    # サービスの debug 出力は計測から除外する
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # --- インポート ---
+        stages: Dict = {}
+        _stage(stages, "import", lambda: __import__("services.catalog_loader"))
+        from models.song import SongCatalog
+        from models.snapshot import load_snapshot
+        from services.catalog_loader import load_recommendation_service
+        from services.cluster_model import ModelStore
+        from services.recommendation import RecommendationService, make_rng
+
+        # --- ステージ別 ---
+        catalog = _stage(stages, "load", lambda: SongCatalog.from_csv(csv_path))
+        _stage(stages, "encode", lambda: catalog.arrays)
+        _stage(stages, "cluster", lambda: ModelStore(catalog))
+        service = RecommendationService(catalog, pool_cache_size=0)
+
+        # 乱数は固定シードにして、実行ごと・コミット間で同じプロファイル・抽選になるようにする
+        rng = make_rng(0)
+        profiles = [service.session_profile(r["members"], r["settings"], rng) for r in requests]
+        pools = _stage(stages, "score", lambda: [service._build_candidate_pool(*p) for p in profiles])
+        _stage(stages, "sample", lambda: [service._draw(pool, rng) for pool in pools])
+        for name in ("score", "sample"):
+            stages[name]["perRequestMs"] = stages[name]["seconds"] / n_requests * 1000
+        result["stages"] = stages
+
+        # --- SongCatalog.filter ---
+        filter_args = [
+            {"decade": "2010s"},
+            {"mood": MOODS[0], "situation": SITUATIONS[1]},
+            {"decade": "2020s", "gender": GENDERS[1], "genre": GENRES[1]},
+        ]
+        result["filter"] = _timed_loop(lambda a: catalog.filter(**a), filter_args * max(1, n_requests // 30))
+
+        # --- コールドスタート（CSV から / スナップショットから） ---
+        start = time.perf_counter()
+        load_recommendation_service(csv_path, snapshot_path)
+        cold_csv = time.perf_counter() - start
+        start = time.perf_counter()
+        load_recommendation_service(csv_path, snapshot_path)
+        cold_snapshot = time.perf_counter() - start
+        start = time.perf_counter()
+        load_snapshot(snapshot_path, csv_path)
+        snapshot_only = time.perf_counter() - start
+        result["coldStart"] = {
+            "csvSeconds": cold_csv,
+            "snapshotSeconds": cold_snapshot,
+            "snapshotMmapSeconds": snapshot_only,
+        }
+
+        # --- サービング時の起動コスト（上で書き出したスナップショットから起動） ---
+        result["serving"] = _serving_footprint(csv_path)
+
+        # --- リクエスト単位のレイテンシ ---
+        service = RecommendationService(catalog, use_table=False)
+        # 候補プールのキャッシュなし（毎回プールを計算する）
+        uncached = RecommendationService(catalog, model_store=service.model_store, pool_cache_size=0, use_table=False)
+        seeded = [dict(r, seed=i) for i, r in enumerate(requests)]
+
+        def recommend(r, service=service):
+            return service.recommend_songs(r["members"], r["settings"], rng=make_rng(r["seed"]))
+
+        result["latency"] = {
+            "recommendSongs": _timed_loop(recommend, seeded),
+            "recommendSongsUncached": _timed_loop(lambda r: recommend(r, uncached), seeded),
+        }
+        start = time.perf_counter()
+        service.recommend_batch(seeded)
+        result["latency"]["recommendBatchPerItemMs"] = (time.perf_counter() - start) / n_requests * 1000
+
+        # --- 事前計算表（全プロファイルの候補プール）を使う場合 ---
+        table_service = _stage(
+            stages, "table", lambda: RecommendationService(catalog, model_store=service.model_store, use_table=True)
+        )
+        table = table_service.table
+        result["table"] = {
+            "profiles": table.entries,
+            "rows": len(table.rows),
+            "bytes": table.rows.nbytes + sum(slots.nbytes for slots in table.slots.values()),
+        }
+        result["latency"]["recommendSongsTable"] = _timed_loop(
+            lambda r: table_service.recommend_songs(r["members"], r["settings"], rng=make_rng(r["seed"])), seeded
+        )
+
+        # --- 並行実行時のスループット ---
+        throughput = {}
+        for workers in concurrency:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                start = time.perf_counter()
+                list(pool.map(recommend, seeded))
+                elapsed = time.perf_counter() - start
+            throughput[str(workers)] = {"requestsPerSecond": n_requests / elapsed}
+        result["throughput"] = throughput
+        result["peakRssMb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+# ========= 比較 =========
+
+def _flatten(prefix: str, value, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+def compare(before_path: Path, after_path: Path) -> None:
+    """2つの結果ファイルの数値項目を並べ、変化率を表示する。"""
+    before = json.loads(before_path.read_text())
+    after = json.loads(after_path.read_text())
+    print(f"before: {before['meta'].get('commit')}  after: {after['meta'].get('commit')}")
+    after_by_size = {r["songs"]: r for r in after["results"]}
+    for b in before["results"]:
+        a = after_by_size.get(b["songs"])
+        if a is None:
+            continue
+        fb, fa = {}, {}
+        _flatten("", b, fb)
+        _flatten("", a, fa)
+        print(f"\n== {b['songs']} songs ==")
+        for key in sorted(fb):
+            if key in fa and fb[key]:
+                change = (fa[key] - fb[key]) / fb[key] * 100
+                print(f"  {key:55s} {fb[key]:12.4f} -> {fa[key]:12.4f} ({change:+.1f}%)")
+
+
+# ========= エントリポイント =========
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="推薦処理のベンチマーク")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="カタログの曲数（カンマ区切り。最大 1000000 程度）")
+    parser.add_argument("--requests", type=int, default=500, help="計測に使うリクエスト数")
+    parser.add_argument("--concurrency", default="1,4,8", help="スループット計測のスレッド数（カンマ区切り）")
+    parser.add_argument("--output", type=Path, help="結果 JSON の出力先（省略時は標準出力）")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BEFORE", "AFTER"), help="2つの結果を比較")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--serving", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.serving:
+        # 子プロセス: サービング時の起動コストを計測して JSON を標準出力へ
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = serving_probe(args.serving)
+        print(json.dumps(result))
+        return
+
+    concurrency = [int(c) for c in args.concurrency.split(",") if c]
+
+    if args.child:
+        # 子プロセス: 1サイズ分を計測して JSON を標準出力へ
+        with tempfile.TemporaryDirectory() as tmp:
+            result = run_size(args.child, args.requests, concurrency, Path(tmp))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        print(f"benchmark: {size} songs ...", file=sys.stderr)
+        out = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.bench_recommendation", "--child", str(size),
+             "--requests", str(args.requests), "--concurrency", args.concurrency],
+            cwd=BACKEND_DIR, text=True,
+        )
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text)
+        print(f"written: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+リクエストログの再実行。
+
+使い方（backend ディレクトリで実行）:
+    REQUEST_LOG=requests.log gunicorn -c gunicorn.conf.py wsgi:app   # 記録
+    python -m benchmarks.replay requests.log --csv data/songs.csv --output replay.json
+
+・REQUEST_LOG に記録されたリクエストを同じ順に Flask のテストクライアントで再実行する
+・記録時の seed を使うので、同じカタログならレスポンスは記録と一致する
+  （セッション ID・ランキングのカーソルは再実行時のものに読み替えて比較する）
+・エンドポイントごとのレイテンシ分位点を記録時・再実行時で並べて出力する
+  （--repeat で複数回再実行すると計測が安定する）
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.bench_recommendation import _git_commit, _percentiles
+from services.request_log import RequestLog
+
+# 比較で表示する不一致の最大件数
+MAX_REPORTED_MISMATCHES = 10
+
+
+class _IdMap:
+    """記録時のセッション ID・ランキングのトークン → 再実行時のもの。"""
+
+    def __init__(self):
+        self.ids: Dict[str, str] = {}
+
+    def rewrite(self, text: str) -> str:
+        for old, new in self.ids.items():
+            if old in text:
+                text = text.replace(old, new)
+        return text
+
+    def request(self, entry: Dict) -> Dict:
+        """記録時のリクエスト（パス・ボディ）を再実行用に読み替える。"""
+        path = self.rewrite(entry["path"])
+        body = dict(entry.get("request") or {})
+        cursor = body.get("cursor")
+        if isinstance(cursor, str):
+            token, sep, offset = cursor.rpartition(":")
+            body["cursor"] = f"{self.ids.get(token, token)}{sep}{offset}"
+        return {"method": entry["method"], "path": path, "body": body}
+
+    def learn(self, recorded: Optional[Dict], replayed: Optional[Dict]) -> None:
+        """レスポンスに含まれる ID の対応を覚える。"""
+        if not isinstance(recorded, dict) or not isinstance(replayed, dict):
+            return
+        if recorded.get("sessionId") and replayed.get("sessionId"):
+            self.ids[recorded["sessionId"]] = replayed["sessionId"]
+        if recorded.get("nextCursor") and replayed.get("nextCursor"):
+            self.ids[recorded["nextCursor"].rpartition(":")[0]] = replayed["nextCursor"].rpartition(":")[0]
+
+
+def _comparable(response):
+    """実行ごとに変わる値（セッション ID・カーソルのトークン・スタックトレース）を除いたレスポンス。"""
+    if not isinstance(response, dict):
+        return response
+    response = {k: v for k, v in response.items() if k not in ("sessionId", "details")}
+    if isinstance(response.get("nextCursor"), str):
+        response["nextCursor"] = response["nextCursor"].rpartition(":")[2]
+    return response
+
+
+def replay(entries: List[Dict], client) -> Dict:
+    """1回分の再実行。エンドポイントごとの所要時間と不一致を返す。"""
+    ids = _IdMap()
+    seconds: Dict[str, List[float]] = {}
+    mismatches = []
+    for i, entry in enumerate(entries):
+        req = ids.request(entry)
+        start = time.perf_counter()
+        if req["method"] == "DELETE":
+            response = client.delete(req["path"])
+        else:
+            response = client.open(req["path"], method=req["method"], json=req["body"])
+        seconds.setdefault(entry["endpoint"], []).append(time.perf_counter() - start)
+
+        body = response.get_json(silent=True)
+        recorded = entry.get("response")
+        ids.learn(recorded, body)
+        if isinstance(recorded, dict) and isinstance(recorded.get("error"), str):
+            recorded = {**recorded, "error": ids.rewrite(recorded["error"])}
+        expected = (entry["status"], _comparable(recorded))
+        actual = (response.status_code, _comparable(body))
+        if expected != actual:
+            mismatches.append({"index": i, "path": entry["path"], "expected": expected, "actual": actual})
+    return {"seconds": seconds, "mismatches": mismatches}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="リクエストログの再実行")
+    parser.add_argument("log", type=Path, help="REQUEST_LOG で記録したファイル")
+    parser.add_argument("--csv", type=Path, help="カタログ（省略時は SONGS_CSV または data/songs.csv。記録時と同じもの）")
+    parser.add_argument("--repeat", type=int, default=1, help="再実行の回数")
+    parser.add_argument("--output", type=Path, help="結果 JSON の出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    entries = list(RequestLog.read(args.log))
+    if args.csv:
+        os.environ["SONGS_CSV"] = str(args.csv)
+    # 再実行中は記録・カタログ監視をしない
+    os.environ.pop("REQUEST_LOG", None)
+    os.environ.pop("CATALOG_WATCH_INTERVAL", None)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from app import create_app
+        client = create_app().test_client()
+        runs = [replay(entries, client) for _ in range(max(1, args.repeat))]
+
+    endpoints = {}
+    for endpoint in sorted({e["endpoint"] for e in entries}):
+        replayed = [s for run in runs for s in run["seconds"].get(endpoint, [])]
+        endpoints[endpoint] = {
+            "recorded": _percentiles([e["seconds"] for e in entries if e["endpoint"] == endpoint]),
+            "replayed": _percentiles(replayed),
+        }
+    mismatches = [m for run in runs for m in run["mismatches"]]
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+            "log": str(args.log),
+        },
+        "requests": len(entries),
+        "repeat": len(runs),
+        "identical": not mismatches,
+        "mismatchCount": len(mismatches),
+        "mismatches": mismatches[:MAX_REPORTED_MISMATCHES],
+        "endpoints": endpoints,
+    }
+
+    for endpoint, stats in endpoints.items():
+        rec, rep = stats["recorded"], stats["replayed"]
+        print(
+            f"{endpoint:40s} recorded p50 {rec['p50Ms']:8.3f}ms p99 {rec['p99Ms']:8.3f}ms"
+            f" | replayed p50 {rep['p50Ms']:8.3f}ms p99 {rep['p99Ms']:8.3f}ms",
+            file=sys.stderr,
+        )
+    print(f"{len(entries)} requests x {len(runs)}: {'identical' if not mismatches else f'{len(mismatches)} mismatches'}",
+          file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text)
+        print(f"written: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# gunicorn.conf.py
+# 使い方: gunicorn -c gunicorn.conf.py wsgi:app
+#   非同期サーバ: gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker 'asgi:create_asgi_app()'
+import gc
+import os
+import random
+
+import numpy as np
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+# セッション（/api/sessions）はワーカーのプロセス内に保存するので、既定は1ワーカー
+# （複数ワーカーだと「次の曲」のリクエストが別のワーカーに届き、セッションが見つからず 404 になる）。
+# 同時実行はワーカー内のスレッドで行う（同期ワーカーなら gthread になる。ASGI ワーカーでは使わない）。
+# WEB_CONCURRENCY を増やすのは、セッションを使わない場合か、ロードバランサでセッション ID ごとに
+# 同じワーカーへ振り分ける（sticky）場合、または共有のセッションストアを使う場合だけにする。
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# 親プロセスでアプリを読み込み（= カタログ読み込み・モデル学習）してから fork する。
+# 事前に python -m services.catalog_loader でスナップショットを作っておけば学習は行わない。
+# ワーカーは読み取り専用のカタログ・モデルを copy-on-write で共有する。
+preload_app = True
+
+# カタログ監視スレッドは親プロセスでは起動せず、post_fork で各ワーカーに起動する
+# （create_app はこれが "1" なら監視を始めない。このファイルはアプリの読み込み前に実行される）
+os.environ["CATALOG_WATCH_POST_FORK"] = "1"
+
+
+def when_ready(server):
+    # ウォームアップ済みのオブジェクトを GC 追跡から外し、
+    # ワーカーでの GC 走査による共有ページへの書き込み（コピー発生）を防ぐ
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # fork 直後は乱数状態が親と同一なので、ワーカーごとに再シードする
+    random.seed()
+    np.random.seed()
+
+    # カタログ監視スレッドはワーカーごとに起動する（親プロセスでは起動していない）
+    interval = os.environ.get("CATALOG_WATCH_INTERVAL")
+    if interval:
+        # asgi:create_asgi_app() の場合は内側の Flask アプリから取得する
+        app = server.app.wsgi()
+        getattr(app, "flask_app", app).extensions["karaoke"].start_watcher(float(interval))
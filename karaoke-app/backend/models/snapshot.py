@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from models.song import SongCatalog, StringTable, _CatalogColumns
+
+
+# ========= フォーマット =========
+#
+# [magic 4B][version u32][header_len u32][header JSON][pad][data...]
+# ・header JSON に各列のオフセット（データ領域先頭からのバイト位置）と形式を記録
+# ・データ領域の各ブロックは8バイト境界に揃え、mmap 上でそのまま cast して参照する
+
+MAGIC = b"KSNP"
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct("<4sII")
+_ALIGN = 8
+
+_COLUMNS = ("title", "artist", "genre", "gender", "year", "decade", "mood_mask", "situation_mask")
+_INDEX_FIELDS = ("decade", "mood", "situation", "genre", "gender")
+_HEADER_KEYS = ("source_sha256", "count", "strings", "mood_vocab", "situation_vocab", "columns", "index", "extras")
+
+
+class SnapshotError(Exception):
+    """スナップショットの書き出し・読み込みに失敗した。"""
+
+
+def file_sha256(path: Path | str) -> str:
+    """ソースファイルの SHA-256（スナップショットの無効化判定に使用）。"""
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ========= mmap 上の文字列表 =========
+
+class MappedStringTable:
+    """
+    mmap 上の UTF-8 連結バイト列＋オフセット配列による文字列表。
+    StringTable と同じ読み取りインターフェースを持ち、参照時にデコードする。
+    """
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+        self._decoded: Dict[int, str] = {}
+        self._ids: Optional[Dict[str, int]] = None
+
+    def __getitem__(self, sid: int) -> str:
+        s = self._decoded.get(sid)
+        if s is None:
+            s = str(self._blob[self._offsets[sid]:self._offsets[sid + 1]], "utf-8")
+            self._decoded[sid] = s
+        return s
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def id_of(self, value: str) -> Optional[int]:
+        if self._ids is None:
+            self._ids = {s: i for i, s in enumerate(self)}
+        return self._ids.get(value)
+
+
+# ========= 書き出し =========
+
+class _Writer:
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._size = 0
+
+    def add(self, data: bytes | memoryview, fmt: str, shape: Tuple[int, ...]) -> Dict:
+        pad = -self._size % _ALIGN
+        if pad:
+            self._chunks.append(b"\0" * pad)
+            self._size += pad
+        block = {"format": fmt, "offset": self._size, "nbytes": len(data), "shape": list(shape)}
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return block
+
+    def add_array(self, values) -> Dict:
+        m = memoryview(values)
+        if not m.c_contiguous:
+            raise SnapshotError("array must be C-contiguous")
+        return self.add(m.tobytes(), m.format, m.shape)
+
+
+def write_snapshot(
+    catalog: SongCatalog,
+    path: Path | str,
+    source_sha256: str,
+    extras: Optional[Dict[str, object]] = None,
+) -> None:
+    """
+    カタログ（列・文字列表・転置インデックス）と任意の追加配列をスナップショットへ書き出す。
+    extras はバッファプロトコルを持つ C 連続配列（NumPy 配列など）。
+    書き込みは一時ファイル経由で置き換えるため、読み込み中のプロセスに影響しない。
+    """
+    path = Path(path)
+    w = _Writer()
+
+    # 文字列表
+    encoded = [s.encode("utf-8") for s in catalog._strings]
+    offsets = array("Q", [0])
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+    strings = {"offsets": w.add_array(offsets), "blob": w.add(b"".join(encoded), "B", (offsets[-1],))}
+
+    # 列
+    columns = {}
+    for name in _COLUMNS:
+        col = getattr(catalog, "_" + name)
+        if isinstance(col, list):
+            raise SnapshotError(f"column {name} is not fixed-width (tag vocabulary > 64?)")
+        columns[name] = w.add_array(col)
+
+    # 転置インデックス: フィールドごとにポスティングリストを連結し [start, stop) を記録
+    index = {}
+    for field_name in _INDEX_FIELDS:
+        joined = array("I")
+        keys = {}
+        for key, postings in catalog._index[field_name].items():
+            keys[key] = [len(joined), len(joined) + len(postings)]
+            joined.extend(postings)
+        index[field_name] = {"postings": w.add_array(joined), "keys": keys}
+
+    header = {
+        "source_sha256": source_sha256,
+        "count": len(catalog),
+        "strings": strings,
+        "mood_vocab": list(catalog._mood_vocab),
+        "situation_vocab": list(catalog._situation_vocab),
+        "columns": columns,
+        "index": index,
+        "extras": {name: w.add_array(values) for name, values in (extras or {}).items()},
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix = _PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes))
+    pad = -(len(prefix) + len(header_bytes)) % _ALIGN
+
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(prefix)
+        f.write(header_bytes)
+        f.write(b"\0" * pad)
+        for chunk in w._chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+def compile_snapshot(
+    csv_path: Path | str,
+    snapshot_path: Path | str,
+    extras: Optional[Dict[str, object]] = None,
+) -> SongCatalog:
+    """CSV を検証付きで読み込み、スナップショットへ変換する。読み込んだカタログを返す。"""
+    catalog = SongCatalog.from_csv(csv_path)
+    write_snapshot(catalog, snapshot_path, file_sha256(csv_path), extras)
+    return catalog
+
+
+# ========= 読み込み =========
+
+@dataclass(frozen=True)
+class Snapshot:
+    """読み込んだスナップショット。列・extras は mmap 上のビュー。"""
+    catalog: SongCatalog
+    extras: Dict[str, memoryview]
+    source_sha256: str
+
+
+def load_snapshot(path: Path | str, source_path: Path | str | None = None) -> Optional[Snapshot]:
+    """
+    スナップショットを mmap で読み込む。
+    ファイルがない・形式/バージョンが異なる・ソースのハッシュが一致しない場合は None。
+    途中で切れた・壊れたファイル（ヘッダの項目がない、ブロックがファイルの外を指す、
+    列の長さが曲数と合わない）も None を返し、呼び出し側は CSV から読み込み直す。
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    with path.open("rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None  # 空ファイル
+
+    try:
+        magic, version, header_len = _PREFIX.unpack_from(mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        header_end = _PREFIX.size + header_len
+        header = json.loads(mm[_PREFIX.size:header_end].decode("utf-8"))
+    except (struct.error, ValueError):
+        return None
+    if not isinstance(header, dict) or any(key not in header for key in _HEADER_KEYS):
+        return None
+
+    if source_path is not None and header["source_sha256"] != file_sha256(source_path):
+        return None
+
+    try:
+        return _read_snapshot(mm, header, header_end)
+    except (SnapshotError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _read_snapshot(mm: mmap.mmap, header: Dict, header_end: int) -> Snapshot:
+    """ヘッダの各ブロックを mmap 上のビューとして組み立てる。範囲外・形の不整合は SnapshotError。"""
+    data = memoryview(mm)[header_end + (-header_end % _ALIGN):]
+
+    def view(block: Dict) -> memoryview:
+        offset, nbytes = block["offset"], block["nbytes"]
+        if not (isinstance(offset, int) and isinstance(nbytes, int) and 0 <= offset and offset + nbytes <= len(data)):
+            raise SnapshotError(f"block out of range: offset={offset} nbytes={nbytes} size={len(data)}")
+        raw = data[offset:offset + nbytes]
+        if block["format"] == "B":
+            return raw
+        if 0 in block["shape"]:
+            # memoryview は要素数0への cast ができないため空配列で代替
+            return memoryview(array(block["format"]))
+        return raw.cast(block["format"], block["shape"])
+
+    cols = _CatalogColumns()
+    cols.strings = MappedStringTable(view(header["strings"]["offsets"]), view(header["strings"]["blob"]))
+    cols.mood_vocab = StringTable(header["mood_vocab"])
+    cols.situation_vocab = StringTable(header["situation_vocab"])
+    columns = {name: view(block) for name, block in header["columns"].items()}
+    if any(len(columns[name]) != header["count"] for name in _COLUMNS):
+        raise SnapshotError("column length does not match the song count")
+    for name in ("title", "artist", "genre", "gender", "year", "mood_mask", "situation_mask"):
+        setattr(cols, name, columns[name])
+
+    index = {}
+    for field_name, entry in header["index"].items():
+        postings = view(entry["postings"])
+        index[field_name] = {key: postings[a:b] for key, (a, b) in entry["keys"].items()}
+
+    catalog = SongCatalog._from_columns(cols, decade=columns["decade"], index=index)
+    extras = {name: view(block) for name, block in header["extras"].items()}
+    return Snapshot(catalog=catalog, extras=extras, source_sha256=header["source_sha256"])
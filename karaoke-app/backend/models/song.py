@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import Iterable, List, Set, Tuple, Dict, Optional
+from typing import FrozenSet, Iterable, Iterator, List, Set, Tuple, Dict, Optional
 from pathlib import Path
+from array import array
 import csv
+import gzip
+import multiprocessing
+import os
+import sys
 import unicodedata
 import re
 import itertools
+import functools
+
+import numpy as np
 
 
 # ========= 例外 =========
@@ -20,48 +30,101 @@ class SongValidationError(Exception):
 
 
 class BulkLoadError(Exception):
-    """CSV一括読み込み時の複数エラー集約。"""
-    def __init__(self, errors: List[SongValidationError]):
+    """
+    CSV一括読み込み時の複数エラー集約。
+    errors は保持した分（先頭から上限まで）、error_count は全件数。
+    """
+    def __init__(self, errors: List[SongValidationError], error_count: Optional[int] = None):
         self.errors = errors
+        self.error_count = len(errors) if error_count is None else error_count
         msgs = "\n".join(
             f"[row {e.row_index}] {e}" if e.row_index is not None else str(e) for e in errors
         )
-        super().__init__(f"{len(errors)} error(s) while loading CSV:\n{msgs}")
+        shown = f" (first {len(errors)} shown)" if self.error_count > len(errors) else ""
+        super().__init__(f"{self.error_count} error(s) while loading CSV{shown}:\n{msgs}")
 
 
 # ========= 正規化ユーティリティ =========
 
 _TAG_SPLIT_RE = re.compile(r"[,\u3001;\s/｜|]+")
 
+# 正規化結果のキャッシュ上限（タグ・ジャンル・アーティスト名の語彙は行数に比べて小さい）
+NORMALIZE_CACHE_SIZE = 1 << 16
+
 def normalize_text(s: str) -> str:
     """日本語を含む文字列をNFKC正規化＋前後空白除去。"""
     return unicodedata.normalize("NFKC", s).strip()
 
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_name(s: str) -> str:
+    """
+    アーティスト名・ジャンル・性別など、何度も現れる値の normalize_text。
+    結果はメモ化し、インターンして同じ値は同じオブジェクトを共有する。
+    """
+    return sys.intern(normalize_text(s))
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize_tag(tag: str) -> str:
-    """タグを検索しやすいように小文字化＋正規化。"""
-    return normalize_text(tag).lower()
+    """タグを検索しやすいように小文字化＋正規化（メモ化・インターン済み）。"""
+    return sys.intern(normalize_text(tag).lower())
 
 def parse_tags(raw: str) -> Set[str]:
     """
     タグ文字列を集合へ変換。
     区切りは , / ; スペース | 全角読点 などを許容。
     """
+    return set(_parse_tags(raw))
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _parse_tags(raw: str) -> FrozenSet[str]:
+    """parse_tags のメモ化版。キャッシュを共有するので変更できない frozenset を返す（カタログ構築用）。"""
     if raw is None:
-        return set()
+        return frozenset()
     raw = normalize_text(raw)
     tokens = [t for t in _TAG_SPLIT_RE.split(raw) if t]
-    return {normalize_tag(t) for t in tokens}
-
-
+    return frozenset(normalize_tag(t) for t in tokens)
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_tag_set(tags: FrozenSet[str]) -> FrozenSet[str]:
+    """タグ集合の各要素を normalize_tag する（_parse_tags の結果は同じ集合が繰り返し来るのでメモ化）。"""
+    return frozenset(normalize_tag(t) for t in tags if t)
+
+def normalization_cache_stats() -> Dict[str, Dict]:
+    """正規化キャッシュの統計（services.cache.LRUCache.stats と同じキー）。"""
+    stats = {}
+    caches = (
+        ("normalizeName", normalize_name),
+        ("normalizeTag", normalize_tag),
+        ("parseTags", _parse_tags),
+        ("normalizeTagSet", _normalize_tag_set),
+    )
+    for name, fn in caches:
+        info = fn.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+            "ttl": None,
+            "hits": info.hits,
+            "misses": info.misses,
+            "hitRate": info.hits / lookups if lookups else 0.0,
+            # 取りこぼし1回につき1件追加され、上限に達した後は1件ずつ追い出される
+            "evictions": info.misses - info.currsize,
+            "expirations": 0,
+        }
+    return stats
+
+
+@functools.lru_cache(maxsize=None)
 def decade_from_year(year: int) -> str:
-    """例: 1999 -> '1990s'"""
+    """例: 1999 -> '1990s'（値域が狭いのでメモ化）"""
     d = (year // 10) * 10
     return f"{d}s"
 
 
 # ========= モデル =========
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Song:
     title: str
     artist: str
@@ -69,6 +132,7 @@ class Song:
     genre: str
     mood_tags: frozenset[str] = field(default_factory=frozenset)
     situation_tags: frozenset[str] = field(default_factory=frozenset)
+    gender: str = ""
 
     # 派生プロパティ
     @property
@@ -79,8 +143,9 @@ class Song:
     def __post_init__(self):
         # 基本フィールドの正規化
         object.__setattr__(self, "title", normalize_text(self.title))
-        object.__setattr__(self, "artist", normalize_text(self.artist))
-        object.__setattr__(self, "genre", normalize_text(self.genre))
+        object.__setattr__(self, "artist", normalize_name(self.artist))
+        object.__setattr__(self, "genre", normalize_name(self.genre))
+        object.__setattr__(self, "gender", normalize_name(self.gender or ""))
 
         # 年の検証（必要に応じて境界は調整）
         if not (1900 <= int(self.year) <= 2100):
@@ -93,8 +158,8 @@ class Song:
             raise SongValidationError("artist is required")
 
         # タグは正規化済みの小文字集合へ
-        mt = frozenset(normalize_tag(t) for t in self.mood_tags if t)
-        st = frozenset(normalize_tag(t) for t in self.situation_tags if t)
+        mt = _normalize_tag_set(frozenset(self.mood_tags))
+        st = _normalize_tag_set(frozenset(self.situation_tags))
         object.__setattr__(self, "mood_tags", mt)
         object.__setattr__(self, "situation_tags", st)
 
@@ -103,31 +168,305 @@ class Song:
     def from_row(row: Dict[str, str]) -> "Song":
         """
         CSV 1行を Song へ変換。
-        期待ヘッダ: title, artist, year, genre, mood_tags, situation_tags
+        期待ヘッダ: title, artist, year, genre, mood_tags, situation_tags（gender は任意）
         """
         try:
             title = row.get("title", "")
             artist = row.get("artist", "")
             year_str = row.get("year", "")
             genre = row.get("genre", "")
+            gender = row.get("gender", "") or ""
             mood_raw = row.get("mood_tags", "") or ""
             situation_raw = row.get("situation_tags", "") or ""
 
             year = int(str(year_str).strip())
-            mood = parse_tags(mood_raw)
-            situation = parse_tags(situation_raw)
+            mood = _parse_tags(mood_raw)
+            situation = _parse_tags(situation_raw)
 
             return Song(
                 title=title,
                 artist=artist,
                 year=year,
                 genre=genre,
-                mood_tags=frozenset(mood),
-                situation_tags=frozenset(situation),
+                mood_tags=mood,
+                situation_tags=situation,
+                gender=gender,
             )
         except ValueError as ve:
             raise SongValidationError(f"year must be integer: {row.get('year')}") from ve
 
+    @classmethod
+    def _view(
+        cls,
+        title: str,
+        artist: str,
+        year: int,
+        genre: str,
+        mood_tags: frozenset,
+        situation_tags: frozenset,
+        gender: str,
+    ) -> "Song":
+        """正規化・検証済みの値から Song を組み立てる（__post_init__ を通さない）。"""
+        song = object.__new__(cls)
+        object.__setattr__(song, "title", title)
+        object.__setattr__(song, "artist", artist)
+        object.__setattr__(song, "year", year)
+        object.__setattr__(song, "genre", genre)
+        object.__setattr__(song, "mood_tags", mood_tags)
+        object.__setattr__(song, "situation_tags", situation_tags)
+        object.__setattr__(song, "gender", gender)
+        return song
+
+
+# ========= 列指向ストレージ =========
+
+class StringTable:
+    """文字列 ⇔ 整数ID の相互変換表（同じ文字列は1つのオブジェクトを共有）。"""
+    def __init__(self, strings: Iterable[str] = ()):
+        self._strings: List[str] = []
+        self._ids: Dict[str, int] = {}
+        for v in strings:
+            self.intern(v)
+
+    def intern(self, value: str) -> int:
+        sid = self._ids.get(value)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings.append(value)
+            self._ids[value] = sid
+        return sid
+
+    def id_of(self, value: str) -> Optional[int]:
+        return self._ids.get(value)
+
+    def __getitem__(self, sid: int) -> str:
+        return self._strings[sid]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __iter__(self):
+        return iter(self._strings)
+
+
+def _mask_column(masks):
+    """タグ数が64以下なら array('Q')、超える場合は Python int のリストで保持。"""
+    if not isinstance(masks, list):
+        return masks  # 構築済みの列（array / memoryview）はそのまま
+    if all(m < (1 << 64) for m in masks):
+        return array("Q", masks)
+    return masks
+
+
+class _CatalogColumns:
+    """Song を1件ずつ受け取り、列（整数配列）へ書き込むビルダ。"""
+    def __init__(self):
+        self.strings = StringTable()
+        self.mood_vocab = StringTable()
+        self.situation_vocab = StringTable()
+        self.title = array("I")
+        self.artist = array("I")
+        self.genre = array("I")
+        self.gender = array("I")
+        self.year = array("H")
+        self.mood_mask: List[int] = []
+        self.situation_mask: List[int] = []
+
+    @staticmethod
+    def _mask(vocab: StringTable, tags: Iterable[str]) -> int:
+        mask = 0
+        for t in tags:
+            mask |= 1 << vocab.intern(t)
+        return mask
+
+    def append(self, song: Song) -> None:
+        self.append_record(_song_record(song))
+
+    def append_record(self, record: Tuple) -> None:
+        """_song_record 形式（正規化・検証済み）の1件を書き込む。"""
+        title, artist, year, genre, gender, mood_tags, situation_tags = record
+        self.title.append(self.strings.intern(title))
+        self.artist.append(self.strings.intern(artist))
+        self.genre.append(self.strings.intern(genre))
+        self.gender.append(self.strings.intern(gender))
+        self.year.append(year)
+        self.mood_mask.append(self._mask(self.mood_vocab, mood_tags))
+        self.situation_mask.append(self._mask(self.situation_vocab, situation_tags))
+
+
+# ========= CSV 読み込み（チャンク単位・並列） =========
+
+# 必須の列
+CSV_COLUMNS = {"title", "artist", "year", "genre", "mood_tags", "situation_tags"}
+# 1チャンクの行数
+CSV_CHUNK_ROWS = 10000
+# BulkLoadError に保持するエラーの上限（件数は全件数える）
+MAX_RETAINED_ERRORS = 100
+# 正規化・検証に使うプロセス数（1 ならこのプロセスで順に処理）
+CSV_LOAD_WORKERS = int(os.environ.get("CATALOG_LOAD_WORKERS", "1"))
+
+
+def _song_record(song: Song) -> Tuple:
+    """列ストレージへ書き込む値の組（タグはソート済みで、語彙の登録順を決定的にする）。"""
+    return (
+        song.title,
+        song.artist,
+        song.year,
+        song.genre,
+        song.gender,
+        tuple(sorted(song.mood_tags)),
+        tuple(sorted(song.situation_tags)),
+    )
+
+
+def _open_csv(path: Path, encoding: str):
+    """テキストとして開く。gzip 圧縮（先頭がマジックナンバー）なら展開しながら読む。"""
+    with path.open("rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    if compressed:
+        return gzip.open(path, "rt", encoding=encoding, newline="")
+    return path.open("r", encoding=encoding, newline="")
+
+
+def _read_chunks(reader: Iterator[List[str]], chunk_rows: int) -> Iterator[List[Tuple[int, List[str]]]]:
+    """(行番号, 値のリスト) を chunk_rows 件ずつ返す。空行は飛ばす。"""
+    numbered = ((idx, values) for idx, values in enumerate(
+        (values for values in reader if values), start=2  # 1行目はヘッダ、2行目をrow index=2とする
+    ))
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_rows))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _normalize_chunk(header: List[str], rows: List[Tuple[int, List[str]]]) -> Tuple[List[Tuple], List[Tuple]]:
+    """
+    1チャンク分を正規化・検証する（ワーカープロセスで実行される）。
+    Returns: (書き込む値の組のリスト, (行番号, メッセージ, 行) のエラーリスト)
+    """
+    records = []
+    errors = []
+    for idx, values in rows:
+        row = dict(zip(header, values))
+        try:
+            records.append(_song_record(Song.from_row(row)))
+        except SongValidationError as e:
+            errors.append((idx, str(e), row))
+    return records, errors
+
+
+def _map_chunks(
+    header: List[str],
+    chunks: Iterator[List[Tuple[int, List[str]]]],
+    workers: int,
+) -> Iterator[Tuple[List[Tuple], List[Tuple]]]:
+    """
+    チャンクを workers 個のプロセスで並列に処理し、読み込み順に結果を返す。
+    処理中・処理待ちのチャンクは workers * 2 個までにして、メモリ使用量を抑える。
+    """
+    # プールの子プロセス内（spawn で main モジュールが再実行された場合など）では並列化しない
+    if workers <= 1 or multiprocessing.parent_process() is not None:
+        for chunk in chunks:
+            yield _normalize_chunk(header, chunk)
+        return
+
+    # 再読み込みのスレッドから呼ばれても安全なように fork ではなく spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_normalize_chunk, header, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ========= 数値列（推薦・学習用） =========
+
+def _frozen(values: np.ndarray) -> np.ndarray:
+    """書き込み不可にした配列を返す（カタログの版ごとに作り、リクエスト間で共有するため）。"""
+    values.setflags(write=False)
+    return values
+
+
+def _sorted_codes(ids, key) -> Tuple[List, np.ndarray]:
+    """
+    ID 列（文字列表のID・タグのビットマスク）を、key(ID) の昇順に振り直した番号の列にする。
+    Returns: (番号順の ID のリスト, 各曲の番号 (n,))
+    """
+    uniq, inverse = np.unique(np.asarray(ids), return_inverse=True)
+    uniq = uniq.tolist()
+    order = sorted(range(len(uniq)), key=lambda i: key(uniq[i]))
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return [uniq[i] for i in order], _frozen(rank[inverse])
+
+
+def tag_key(tags: Iterable[str]) -> str:
+    """タグの組み合わせを表す文字列（ソートして ',' で連結）。"""
+    return ",".join(sorted(tags))
+
+
+@dataclass(frozen=True)
+class CatalogArrays:
+    """
+    推薦・モデル学習で使う数値列（NumPy 配列、書き込み不可。添字は曲ID = カタログ上の行位置）。
+    カテゴリ値は語彙の番号で持つ。語彙は文字列の昇順なので、番号の大小は文字列の大小と一致する
+    （LabelEncoder で数値化した場合と同じ順序）。
+    ・year: 年 (n,) int64
+    ・gender / genre: genders / genres（object 配列）の添字
+    ・mood / situation: タグの組み合わせ mood_sets / situation_sets の添字
+      （組み合わせは tag_key の昇順。mood_keys / situation_keys がその文字列）
+    """
+    year: np.ndarray
+    gender: np.ndarray
+    genre: np.ndarray
+    mood: np.ndarray
+    situation: np.ndarray
+    genders: np.ndarray
+    genres: np.ndarray
+    mood_keys: np.ndarray
+    situation_keys: np.ndarray
+    mood_sets: Tuple[FrozenSet[str], ...]
+    situation_sets: Tuple[FrozenSet[str], ...]
+
+    @classmethod
+    def build(cls, catalog: "SongCatalog") -> "CatalogArrays":
+        """カタログの列から作る（計算量は曲数に比例し、文字列の比較は値の種類ごとに行う）。"""
+        strings = catalog.strings
+
+        def vocabulary(name):
+            ids, codes = _sorted_codes(catalog.column(name), lambda sid: strings[sid])
+            return _frozen(np.array([strings[sid] for sid in ids], dtype=object)), codes
+
+        def tag_sets(kind):
+            masks, codes = _sorted_codes(
+                catalog.column(f"{kind}_mask"), lambda mask: tag_key(catalog.tags_of_mask(kind, mask))
+            )
+            sets = tuple(catalog.tags_of_mask(kind, mask) for mask in masks)
+            keys = np.array([tag_key(tags) for tags in sets], dtype=object)
+            return sets, _frozen(keys), codes
+
+        genders, gender = vocabulary("gender")
+        genres, genre = vocabulary("genre")
+        mood_sets, mood_keys, mood = tag_sets("mood")
+        situation_sets, situation_keys, situation = tag_sets("situation")
+        return cls(
+            year=_frozen(np.asarray(catalog.column("year"), dtype=np.int64)),
+            gender=gender,
+            genre=genre,
+            mood=mood,
+            situation=situation,
+            genders=genders,
+            genres=genres,
+            mood_keys=mood_keys,
+            situation_keys=situation_keys,
+            mood_sets=mood_sets,
+            situation_sets=situation_sets,
+        )
+
 
 # ========= カタログ（検索・読み込み） =========
 
@@ -135,78 +474,278 @@ class SongCatalog:
     """
     不変の曲カタログ。
     ・CSVロード
-    ・年代/ムード/シチュエーションでのフィルタ
+    ・年代/ムード/シチュエーション/ジャンル/性別でのフィルタ
     将来的にDBへ差し替えるときもインターフェースを維持しやすい。
+
+    曲は列指向で保持する（文字列は StringTable のID、タグは語彙のビットマスク、
+    年・年代は整数配列）。Song は参照時にその場で組み立てるビュー。
+    ロード時に転置インデックス（キー → 曲IDの昇順配列）を構築し、
+    フィルタはインデックスの積集合で求める。
     """
     def __init__(self, songs: Iterable[Song]):
-        self._songs: Tuple[Song, ...] = tuple(songs)
+        cols = _CatalogColumns()
+        for s in songs:
+            cols.append(s)
+        self._init_columns(cols)
+
+    @classmethod
+    def _from_columns(
+        cls,
+        cols: _CatalogColumns,
+        decade=None,
+        index: Optional[Dict[str, Dict[str, array]]] = None,
+    ) -> "SongCatalog":
+        """
+        列から直接カタログを作る。decade 列・転置インデックスが
+        構築済み（スナップショット等）なら再計算しない。
+        """
+        catalog = cls.__new__(cls)
+        catalog._init_columns(cols, decade, index)
+        return catalog
+
+    def _init_columns(self, cols: _CatalogColumns, decade=None, index=None) -> None:
+        self._strings = cols.strings
+        self._mood_vocab = cols.mood_vocab
+        self._situation_vocab = cols.situation_vocab
+        self._title = cols.title
+        self._artist = cols.artist
+        self._genre = cols.genre
+        self._gender = cols.gender
+        self._year = cols.year
+        if decade is None:
+            decade = array("H", ((y // 10) * 10 for y in cols.year))
+        self._decade = decade
+        self._mood_mask = _mask_column(cols.mood_mask)
+        self._situation_mask = _mask_column(cols.situation_mask)
+        # ビットマスク → frozenset のキャッシュ（同じ組み合わせは同じオブジェクト）
+        self._tag_sets: Dict[Tuple[str, int], frozenset] = {}
+        self._index: Dict[str, Dict[str, array]] = index if index is not None else self._build_index()
+
+    def _build_index(self) -> Dict[str, Dict[str, array]]:
+        """decade / mood / situation / genre / gender の転置インデックスを構築。"""
+        index: Dict[str, Dict[str, array]] = {
+            "decade": {}, "mood": {}, "situation": {}, "genre": {}, "gender": {},
+        }
+
+        def add(field_name: str, key: str, song_id: int) -> None:
+            postings = index[field_name].get(key)
+            if postings is None:
+                postings = index[field_name][key] = array("I")
+            postings.append(song_id)
+
+        def bits(mask: int) -> Iterable[int]:
+            while mask:
+                low = mask & -mask
+                yield low.bit_length() - 1
+                mask ^= low
+
+        # 整数ID → キー文字列は値の種類ごとに一度だけ計算
+        genre_keys: Dict[int, str] = {}
+        decade_keys: Dict[int, str] = {}
+
+        # 曲IDの昇順に走査するので各ポスティングリストは自然にソート済み
+        for song_id in range(len(self._year)):
+            d = self._decade[song_id]
+            if d not in decade_keys:
+                decade_keys[d] = decade_from_year(d)
+            add("decade", decade_keys[d], song_id)
+
+            g = self._genre[song_id]
+            if g not in genre_keys:
+                genre_keys[g] = normalize_tag(self._strings[g])
+            add("genre", genre_keys[g], song_id)
+
+            gender = self._strings[self._gender[song_id]]
+            if gender:
+                add("gender", gender, song_id)
+            for b in bits(self._mood_mask[song_id]):
+                add("mood", self._mood_vocab[b], song_id)
+            for b in bits(self._situation_mask[song_id]):
+                add("situation", self._situation_vocab[b], song_id)
+        return index
+
+    def _tags(self, kind: str, vocab: StringTable, mask: int) -> frozenset:
+        key = (kind, mask)
+        tags = self._tag_sets.get(key)
+        if tags is None:
+            tags = frozenset(vocab[b] for b in range(mask.bit_length()) if mask >> b & 1)
+            self._tag_sets[key] = tags
+        return tags
+
+    # ---- 列アクセス ----
+    @property
+    def strings(self):
+        """title/artist/genre/gender 列のIDが指す文字列表。"""
+        return self._strings
+
+    def column(self, name: str):
+        """
+        整数列を返す。
+        name: title / artist / genre / gender / year / decade / mood_mask / situation_mask
+        """
+        if name not in ("title", "artist", "genre", "gender", "year", "decade", "mood_mask", "situation_mask"):
+            raise KeyError(name)
+        return getattr(self, "_" + name)
+
+    def tags_of_mask(self, kind: str, mask: int) -> frozenset:
+        """タグのビットマスクを frozenset に戻す。kind: 'mood' / 'situation'"""
+        vocab = self._mood_vocab if kind == "mood" else self._situation_vocab
+        return self._tags(kind, vocab, int(mask))
+
+    @functools.cached_property
+    def arrays(self) -> CatalogArrays:
+        """推薦・学習用の数値列（初回参照時に列から作り、以降は同じものを返す）。"""
+        return CatalogArrays.build(self)
+
+    def song(self, song_id: int) -> Song:
+        """曲IDに対応する Song ビューを返す。"""
+        strings = self._strings
+        return Song._view(
+            title=strings[self._title[song_id]],
+            artist=strings[self._artist[song_id]],
+            year=self._year[song_id],
+            genre=strings[self._genre[song_id]],
+            mood_tags=self._tags("mood", self._mood_vocab, self._mood_mask[song_id]),
+            situation_tags=self._tags("situation", self._situation_vocab, self._situation_mask[song_id]),
+            gender=strings[self._gender[song_id]],
+        )
 
     @classmethod
-    def from_csv(cls, path: Path | str, encoding: str = "utf-8-sig") -> "SongCatalog":
+    def from_csv(
+        cls,
+        path: Path | str,
+        encoding: str = "utf-8-sig",
+        workers: Optional[int] = None,
+        chunk_rows: int = CSV_CHUNK_ROWS,
+        max_errors: int = MAX_RETAINED_ERRORS,
+    ) -> "SongCatalog":
         """
-        CSV を読み込み、検証エラーがあれば BulkLoadError に集約。
+        CSV（gzip 圧縮も可）をチャンク単位で読み込み、列ストレージへ直接書き込む。
+        正規化・検証はチャンクごとに workers 個のプロセスで並列に行う（既定は CATALOG_LOAD_WORKERS）。
+        検証エラーがあれば BulkLoadError に集約（保持するのは先頭 max_errors 件、件数は全件）。
         """
         path = Path(path)
+        workers = CSV_LOAD_WORKERS if workers is None else workers
         errors: List[SongValidationError] = []
-        songs: List[Song] = []
+        error_count = 0
+        cols = _CatalogColumns()
 
-        with path.open("r", encoding=encoding, newline="") as f:
-            reader = csv.DictReader(f)
-            expected = {"title", "artist", "year", "genre", "mood_tags", "situation_tags"}
-            missing = expected - set(reader.fieldnames or [])
+        with _open_csv(path, encoding) as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            missing = CSV_COLUMNS - set(header)
             if missing:
                 raise BulkLoadError([
                     SongValidationError(f"missing columns: {', '.join(sorted(missing))}")
                 ])
 
-            for idx, row in enumerate(reader, start=2):  # 1行目はヘッダ、2行目をrow index=2とする
-                try:
-                    songs.append(Song.from_row(row))
-                except SongValidationError as e:
-                    e.row_index = idx
-                    e.row = row
-                    errors.append(e)
+            for records, chunk_errors in _map_chunks(header, _read_chunks(reader, chunk_rows), workers):
+                for record in records:
+                    cols.append_record(record)
+                error_count += len(chunk_errors)
+                for idx, message, row in chunk_errors[:max(0, max_errors - len(errors))]:
+                    errors.append(SongValidationError(message, row_index=idx, row=row))
 
-        if errors:
+        if error_count:
             # 1つでもエラーがあればまとめて例外
-            raise BulkLoadError(errors)
-        return cls(songs)
+            raise BulkLoadError(errors, error_count)
+        return cls._from_columns(cols)
 
     # ---- クエリAPI ----
     def all(self) -> Tuple[Song, ...]:
-        return self._songs
+        """全曲（初回呼び出し時に組み立て、以降は同じタプルを返す）。"""
+        return self._all_songs
+
+    @functools.cached_property
+    def _all_songs(self) -> Tuple[Song, ...]:
+        return tuple(self.song(i) for i in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self._year)
 
     def filter(
         self,
         decade: Optional[str] = None,
         mood: Optional[str] = None,
         situation: Optional[str] = None,
+        genre: Optional[str] = None,
+        gender: Optional[str] = None,
     ) -> List[Song]:
         """
         条件に合致する曲を返す。
         ・decade: '1990s' のような文字列。Noneなら無条件
-        ・mood/situation: タグ部分一致（小文字化して比較）
+        ・mood/situation: タグ完全一致（小文字化して比較）
+        ・genre: 小文字化して比較 / gender: '男性' '女性' '混合' など
         """
-        mood = normalize_tag(mood) if mood else None
-        situation = normalize_tag(situation) if situation else None
-
-        result: Iterable[Song] = self._songs
-
-        if decade:
-            d = normalize_text(decade)
-            result = (s for s in result if s.decade == d)
+        return [self.song(i) for i in self.filter_ids(decade, mood, situation, genre, gender)]
 
-        if mood:
-            result = (s for s in result if mood in s.mood_tags)
-
-        if situation:
-            result = (s for s in result if situation in s.situation_tags)
-
-        return list(result)
+    def filter_ids(
+        self,
+        decade: Optional[str] = None,
+        mood: Optional[str] = None,
+        situation: Optional[str] = None,
+        genre: Optional[str] = None,
+        gender: Optional[str] = None,
+    ) -> List[int]:
+        """
+        filter と同じ条件で、合致する曲IDを昇順で返す。
+        最も短いポスティングリスト（昇順の配列）を候補にして、残りの条件で絞り込む。
+        mood / situation はタグのビットマスク列で候補ごとに判定し、それ以外は
+        ポスティングリスト上の二分探索で判定する（どちらも候補数に比例し、曲数分の集合は作らない）。
+        """
+        criteria = [
+            ("decade", normalize_name(decade) if decade else None),
+            ("mood", normalize_tag(mood) if mood else None),
+            ("situation", normalize_tag(situation) if situation else None),
+            ("genre", normalize_tag(genre) if genre else None),
+            ("gender", normalize_name(gender) if gender else None),
+        ]
+
+        postings: List[Tuple[str, str, array]] = []
+        for field_name, key in criteria:
+            if not key:
+                continue
+            p = self._index[field_name].get(key)
+            if not p:
+                return []
+            postings.append((field_name, key, p))
+
+        if not postings:
+            return list(range(len(self)))
+
+        postings.sort(key=lambda entry: len(entry[2]))
+        result = np.frombuffer(postings[0][2], dtype=np.uint32)
+        for field_name, key, p in postings[1:]:
+            tags = self._tag_mask_filter(field_name, key)
+            if tags is not None:
+                masks, bit = tags
+                result = result[(masks[result] & bit) != 0]
+            else:
+                other = np.frombuffer(p, dtype=np.uint32)
+                pos = np.searchsorted(other, result)
+                found = pos < len(other)
+                found[found] = other[pos[found]] == result[found]
+                result = result[found]
+            if len(result) == 0:
+                return []
+        return result.tolist()
+
+    def _tag_mask_filter(self, field_name: str, key: str) -> Optional[Tuple[np.ndarray, np.uint64]]:
+        """mood / situation のタグ key を判定するビットマスク列とビット（固定長の列でなければ None）。"""
+        if field_name == "mood":
+            masks, vocab = self._mood_mask, self._mood_vocab
+        elif field_name == "situation":
+            masks, vocab = self._situation_mask, self._situation_vocab
+        else:
+            return None
+        bit = vocab.id_of(key)
+        if isinstance(masks, list) or bit is None:
+            return None
+        return np.frombuffer(masks, dtype=np.uint64), np.uint64(1 << bit)
 
     def decades(self) -> List[str]:
         """存在する年代の一覧（昇順）。"""
-        return sorted({s.decade for s in self._songs})
+        return sorted(self._index["decade"])
 
 
 # ========= 簡易の手動テスト =========
@@ -0,0 +1,67 @@
+from typing import Optional, Tuple
+from pathlib import Path
+import sys
+import time
+
+from models.song import SongCatalog
+from models.snapshot import SnapshotError, file_sha256, load_snapshot, write_snapshot
+from services.recommendation import RecommendationService
+
+
+def load_recommendation_service(
+    csv_path: Path,
+    snapshot_path: Optional[Path] = None,
+    previous: Optional[RecommendationService] = None,
+) -> Tuple[SongCatalog, RecommendationService]:
+    """
+    スナップショットがあり、ソースCSVのハッシュと一致すれば mmap で読み込む。
+    なければCSVから読み込んで学習し、次回用にスナップショットを書き出す。
+    previous（前の版のサービス）があれば、そのモデルを差分更新して使う
+    （曲が末尾に追加されただけなら追加分だけの計算で済む）。
+    """
+    if snapshot_path is not None:
+        snapshot = load_snapshot(snapshot_path, csv_path)
+        if snapshot is not None:
+            print(f"スナップショット読み込み: {snapshot_path}")
+            try:
+                return snapshot.catalog, RecommendationService(snapshot.catalog, model_arrays=snapshot.extras)
+            except (SnapshotError, KeyError, TypeError, ValueError) as e:
+                # 壊れたスナップショットは使わず、CSV から読み込んで書き直す
+                print(f"スナップショット読み込みエラー: {e}")
+        elif snapshot_path.exists():
+            print(f"スナップショットを使えません（古い・壊れている）: {snapshot_path}")
+
+    print(f"CSVファイル読み込み開始: {csv_path}")
+    catalog = SongCatalog.from_csv(csv_path)
+    model_store = previous.model_store.updated(catalog) if previous is not None else None
+    service = RecommendationService(catalog, model_store=model_store)
+
+    if snapshot_path is not None:
+        try:
+            write_snapshot(catalog, snapshot_path, file_sha256(csv_path), service.export_arrays())
+            print(f"スナップショット書き出し: {snapshot_path}")
+        except (OSError, SnapshotError) as e:
+            print(f"スナップショット書き出しエラー: {e}")
+    return catalog, service
+
+
+# ========= コンパイル =========
+#
+# デプロイ前にスナップショット（カタログ + 学習結果）を作っておくと、
+# サービング時はモデルを学習せずに復元するので sklearn を読み込まない（basic は NumPy だけで動く）。
+# RECOMMEND_TABLE=1 なら全プロファイルの候補プールの事前計算表も同梱する。
+if __name__ == "__main__":
+    # 例: python -m services.catalog_loader data/songs.csv data/songs.snapshot
+    base = Path(__file__).parents[1] / "data"
+    csv_path = Path(sys.argv[1]) if len(sys.argv) > 1 else base / "songs.csv"
+    snapshot_path = Path(sys.argv[2]) if len(sys.argv) > 2 else csv_path.with_suffix(".snapshot")
+
+    catalog = SongCatalog.from_csv(csv_path)
+    service = RecommendationService(catalog)
+    write_snapshot(catalog, snapshot_path, file_sha256(csv_path), service.export_arrays())
+
+    start = time.perf_counter()
+    load_snapshot(snapshot_path, csv_path)
+    print(f"compiled: {snapshot_path} ({len(catalog)} songs, load {time.perf_counter() - start:.4f}s)")
+    if service.table is not None:
+        print(f"table: {service.table.entries} profiles, {len(service.table.rows)} rows ({service.table.rows.nbytes} bytes)")
@@ -0,0 +1,846 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+from models.song import SongCatalog
+from services.features import (
+    FEATURE_SET,
+    FEATURE_SETS,
+    CatalogFeatures,
+    assigned_sq_distances,
+    cluster_sums,
+    distances_to,
+    issparse,
+    row_sq_norms,
+    sq_distances,
+    stack_rows,
+)
+import copy
+import hashlib
+import os
+import numpy as np
+
+# sklearn（KMeans・標準化の学習）はモデルを学習するときだけ読み込む。
+# スナップショットに書き出した学習結果から復元して推薦するだけなら NumPy だけで動く
+# （scipy は rich の特徴量を使うときだけ）。
+if TYPE_CHECKING:
+    from scipy import sparse
+    from sklearn.cluster import KMeans
+
+
+# ========= 年代グループ =========
+
+# 年代グループ名 → (開始年, 終了年) ※両端を含む。None は上限/下限なし
+ERA_RANGES: Dict[str, tuple] = {
+    "showa": (None, 1989),     # 昭和歌謡
+    "classic": (1990, 2022),   # 定番
+    "latest": (2023, None),    # 最新曲
+}
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    """書き込み不可にした配列を返す（学習後の配列はリクエスト間で共有するため）。"""
+    array.setflags(write=False)
+    return array
+
+
+def split_eras(years: np.ndarray) -> Dict[str, np.ndarray]:
+    """曲の年の配列を年代グループごとに分割する（各グループは配列上の位置 = カタログ上の行位置）。"""
+    groups = {}
+    for era, (start, end) in ERA_RANGES.items():
+        mask = np.ones(len(years), dtype=bool)
+        if start is not None:
+            mask &= years >= start
+        if end is not None:
+            mask &= years <= end
+        groups[era] = _frozen(np.flatnonzero(mask))
+    return groups
+
+
+# ========= クラスタモデル =========
+
+# 目標性別ごとの性別ボーナス係数（0=男性, 1=混合, 2=女性）
+GENDER_BONUS_WEIGHTS = np.array([2.0, 1.5, 2.0])
+N_GENDER_CODES = len(GENDER_BONUS_WEIGHTS)
+
+
+@dataclass(frozen=True)
+class PointIndex:
+    """
+    特徴量の点（重複を除いたもの）と、点ごとの曲のカタログ上の行位置。
+    木構造ではなく、全点との距離を NumPy でまとめて計算する（1問い合わせ O(点の数 + k)）。
+    basic の特徴量は性別・ムード・年の組み合わせなので、点の数は語彙と年の範囲で頭打ちになり
+    （数百程度）、曲数が増えても問い合わせの時間は増えない。この点の数では KD 木
+    （sklearn の KDTree）をたどるより速く、sklearn も要らない。
+    ・points: 点 (u, d)（辞書順）
+    ・rows / indptr: 点 i の曲は rows[indptr[i]:indptr[i + 1]]（カタログ上の行位置の昇順）
+    """
+    points: np.ndarray
+    indptr: np.ndarray
+    rows: np.ndarray
+
+    @classmethod
+    def build(cls, features: np.ndarray, catalog_rows: np.ndarray) -> "PointIndex":
+        # 列ごとの値の番号を組み合わせて点の番号にする（2次元の np.unique より速い）
+        inverse = np.zeros(len(features), dtype=np.int64)
+        for column in features.T:
+            values, codes = np.unique(column, return_inverse=True)
+            keys = inverse * len(values) + codes.reshape(-1)
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(first))
+        return cls(
+            points=_frozen(features[first]),
+            indptr=_frozen(np.concatenate([[0], np.cumsum(counts)])),
+            rows=_frozen(catalog_rows[np.argsort(inverse, kind="stable")]),
+        )
+
+    def nearest(self, vecs: np.ndarray, k: int) -> List[np.ndarray]:
+        """
+        各ベクトル (n, d) に近い最大 k 曲（カタログ上の行位置、近い順）。
+        同じ点の曲は行位置の順（距離が同じ点どうしの順も入力が同じなら常に同じ）。
+        """
+        sq_dists = np.zeros((len(vecs), len(self.points)))
+        for j in range(self.points.shape[1]):
+            sq_dists += (vecs[:, j, None] - self.points[None, :, j]) ** 2
+        # 各点に1曲以上あるので、近い k 点だけを距離順に並べれば足りる
+        if k < len(self.points):
+            order = np.argpartition(sq_dists, k - 1, axis=1)[:, :k]
+            order = np.take_along_axis(
+                order, np.argsort(np.take_along_axis(sq_dists, order, axis=1), axis=1, kind="stable"), axis=1
+            )
+        else:
+            order = np.argsort(sq_dists, axis=1, kind="stable")
+        # 近い点から順に曲を取り、累計が k 曲に届いたところで打ち切る（点ごとに取る曲数）
+        sizes = np.diff(self.indptr)[order]
+        taken = np.clip(k - (np.cumsum(sizes, axis=1) - sizes), 0, sizes).ravel()
+        # 各点の曲の先頭から taken 曲ずつ、全ベクトル分をまとめて取り出す
+        starts = self.indptr[:-1][order].ravel()
+        out_starts = np.cumsum(taken) - taken
+        rows = _frozen(self.rows[np.repeat(starts - out_starts, taken) + np.arange(taken.sum())])
+        return np.split(rows, np.cumsum(taken.reshape(len(vecs), -1).sum(axis=1))[:-1])
+
+
+@dataclass(frozen=True)
+class NeighborIndex:
+    """
+    標準化済み特徴量空間での曲単位の近傍探索インデックス（密な特徴量 = basic 用）。
+    グループ全体と性別コードごとの PointIndex を持ち、性別で絞り込んだ k 近傍を求める
+    （クラスタの境界をまたいで近い曲も候補になる）。
+    ・group: グループ全体 / by_gender: 性別コードごとの索引（曲がなければ None）
+    """
+    group: PointIndex
+    by_gender: Tuple[Optional[PointIndex], ...]
+
+    def nearest_rows_batch(self, custom_vecs: np.ndarray, target_genders: np.ndarray, k: int) -> List[np.ndarray]:
+        """
+        複数の赤星曲 (n, 3) それぞれに近い最大 k 曲（カタログ上の行位置、近い順）。
+        男性/女性希望ならその性別の曲から探す（該当曲がなければグループ全体）。
+        同じ索引を引くリクエストはまとめて距離を計算する。
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(custom_vecs)
+        for gender in np.unique(target_genders):
+            index = self.group
+            if gender in (0, 2) and self.by_gender[gender] is not None:
+                index = self.by_gender[gender]
+            positions = np.flatnonzero(target_genders == gender)
+            for position, rows in zip(positions, index.nearest(custom_vecs[positions], k)):
+                results[position] = rows
+        return results
+
+
+@dataclass(frozen=True)
+class SparseNeighborIndex:
+    """
+    疎な特徴量（rich）用の近傍探索。点の種類が多く次元も高いので、
+    非ゼロ要素だけを使った距離計算で全曲を走査する（1問い合わせ O(曲数 × 1曲の非ゼロ要素数)。
+    曲数に比例する）。one-hot の高次元空間では KD 木で枝刈りがほとんど効かず速くならないため、
+    木構造は使わない。インタフェースは NeighborIndex と同じ。
+    """
+    features: sparse.csr_matrix
+    sq_norms: np.ndarray
+    rows: np.ndarray
+    gender_positions: Tuple[np.ndarray, ...]  # 性別コードごとのグループ内の位置
+
+    # 距離行列 (曲数 × リクエスト数) を作るリクエスト数の上限
+    BATCH = 64
+
+    def nearest_rows_batch(self, custom_vecs: np.ndarray, target_genders: np.ndarray, k: int) -> List[np.ndarray]:
+        results: List[Optional[np.ndarray]] = [None] * len(custom_vecs)
+        for gender in np.unique(target_genders):
+            positions = None
+            if gender in (0, 2) and len(self.gender_positions[gender]):
+                positions = self.gender_positions[gender]
+            requests = np.flatnonzero(target_genders == gender)
+            for start in range(0, len(requests), self.BATCH):
+                chunk = requests[start:start + self.BATCH]
+                vecs = custom_vecs[chunk]
+                # ||x||² - 2x·v（||v||² は順位に影響しない）
+                scores = self.sq_norms[:, None] - 2 * np.asarray(self.features @ vecs.T)
+                if positions is not None:
+                    scores = scores[positions]
+                kk = min(k, len(scores))
+                for request, column in zip(chunk, scores.T):
+                    top = np.argpartition(column, kk - 1)[:kk]
+                    top = top[np.argsort(column[top], kind="stable")]
+                    if positions is not None:
+                        top = positions[top]
+                    results[request] = _frozen(self.rows[top])
+        return results
+
+
+def build_neighbor_index(
+    features: Union[np.ndarray, sparse.csr_matrix],
+    catalog_rows: np.ndarray,
+    gender_codes: np.ndarray,
+) -> Union[NeighborIndex, SparseNeighborIndex]:
+    """グループの特徴量（グループ内の順序）から近傍探索インデックスを作る。"""
+    if issparse(features):
+        return SparseNeighborIndex(
+            features=features,
+            sq_norms=_frozen(row_sq_norms(features)),
+            rows=catalog_rows,
+            gender_positions=tuple(_frozen(np.flatnonzero(gender_codes == g)) for g in range(N_GENDER_CODES)),
+        )
+    by_gender = []
+    for g in range(N_GENDER_CODES):
+        mask = gender_codes == g
+        by_gender.append(PointIndex.build(features[mask], catalog_rows[mask]) if mask.any() else None)
+    return NeighborIndex(group=PointIndex.build(features, catalog_rows), by_gender=tuple(by_gender))
+
+
+@dataclass(frozen=True)
+class ClusterModel:
+    """
+    1つの年代グループに対する学習済みモデル一式。配列はすべて書き込み不可。
+    ・catalog_rows: グループの曲のカタログ上の行位置 (n,)
+    ・gender_classes / mood_classes: 性別・ムード（タグの組み合わせの文字列）の語彙
+      （ソート済み。コードはこの順の番号）
+    ・scaler: 標準化の平均・標準偏差（rich なら None）
+    ・kmeans: 学習した KMeans（スナップショットから復元した場合・差分更新した場合は None）
+    ・centers: クラスタ重心 (k, d)（basic なら d = 3）
+    ・features: 特徴量 (n, d)。basic は標準化済みの密行列、rich は CSR 行列
+      / labels: クラスタ番号 (n,) / gender_codes: 性別コード (n,)
+      （features / labels / gender_codes はグループ内の順序）
+    ・gender_dist: クラスタ × 性別コードの構成比行列 (k, 3)
+    ・gender_rows: 性別コードごとのカタログ上の行位置配列
+    ・cluster_rows: クラスタごとのカタログ上の行位置配列
+    ・cluster_gender_rows: クラスタ × 性別コードごとのカタログ上の行位置配列
+    ・inertia: 各曲と所属クラスタ重心との距離の2乗和
+    ・baseline_inertia: 最後に KMeans を学習した時点の1曲あたりの inertia（drift の基準）
+    ・neighbors: 曲単位の近傍探索インデックス（学習・差分更新のたびに作り直す）
+    ・catalog_features: rich のときカタログ全体のカテゴリ特徴量（basic なら None）
+    """
+    catalog_rows: np.ndarray
+    gender_classes: np.ndarray
+    mood_classes: np.ndarray
+    scaler: Optional[Standardization]
+    kmeans: Optional[KMeans]
+    centers: np.ndarray
+    features: np.ndarray
+    labels: np.ndarray
+    gender_codes: np.ndarray
+    year_min: int
+    year_max: int
+    gender_dist: np.ndarray
+    gender_rows: Tuple[np.ndarray, ...]
+    cluster_rows: Tuple[np.ndarray, ...]
+    cluster_gender_rows: Tuple[Tuple[np.ndarray, ...], ...]
+    inertia: float
+    baseline_inertia: float
+    neighbors: Union[NeighborIndex, SparseNeighborIndex]
+    catalog_features: Optional[CatalogFeatures] = None
+
+    def __len__(self) -> int:
+        return len(self.catalog_rows)
+
+    @property
+    def drift(self) -> float:
+        """学習時からの1曲あたり inertia の増加率（差分更新でクラスタが崩れてきた度合い）。"""
+        if self.baseline_inertia <= 0:
+            return 0.0
+        return self.inertia / len(self) / self.baseline_inertia - 1.0
+
+    def year_scaled(self, target_year: float) -> float:
+        """グループの年範囲で target_year を0-1スケーリング。"""
+        return (target_year - self.year_min) / (self.year_max - self.year_min + 1e-6)
+
+    def query_vector(self, gender: int, mood: int, target_year: float) -> np.ndarray:
+        """赤星曲（性別コード・ムードコード・年）の特徴量ベクトル (d,)。"""
+        if self.catalog_features is not None:
+            return self.catalog_features.query_vector(gender, mood, self.year_scaled(target_year))
+        return np.array([
+            gender,                         # 男性=0, 混合=1, 女性=2
+            mood,                           # しっとり=0, リラックス=1, 元気=2, 盛り上がる=3
+            self.year_scaled(target_year),
+        ])
+
+    def score_clusters(self, custom_vec: np.ndarray, target_gender: int) -> np.ndarray:
+        """
+        全クラスタのスコアを一括計算する。
+        スコア = 重心との距離の逆数 + 性別ボーナス
+        """
+        return self.score_clusters_batch(custom_vec[None, :], np.array([target_gender]))[0]
+
+    def score_clusters_batch(self, custom_vecs: np.ndarray, target_genders: np.ndarray) -> np.ndarray:
+        """
+        複数の赤星曲 (n, 3) と目標性別 (n,) に対するスコア行列 (n, k)。
+        """
+        distances = np.linalg.norm(custom_vecs[:, None, :] - self.centers[None, :, :], axis=2)
+        bonus = self.gender_dist[:, target_genders].T * GENDER_BONUS_WEIGHTS[target_genders][:, None]
+        return 1.0 / (distances + 0.1) + bonus
+
+    def candidate_rows(self, cluster_id: int, target_gender: int) -> np.ndarray:
+        """
+        クラスタ内の候補（カタログ上の行位置）。男性/女性希望ならその性別の曲に絞る
+        （該当曲がなければクラスタ全体）。
+        """
+        if target_gender in (0, 2):
+            filtered = self.cluster_gender_rows[cluster_id][target_gender]
+            if len(filtered):
+                return filtered
+        return self.cluster_rows[cluster_id]
+
+    def nearest_rows(self, custom_vec: np.ndarray, target_gender: int, k: int) -> np.ndarray:
+        """赤星曲に近い最大 k 曲（カタログ上の行位置、近い順）。性別の絞り込みは candidate_rows と同じ。"""
+        return self.neighbors.nearest_rows_batch(custom_vec[None, :], np.array([target_gender]), k)[0]
+
+    def score_songs(self, custom_vec: np.ndarray, target_gender: int) -> np.ndarray:
+        """
+        グループ内の全曲のスコア (n,)。順序は catalog_rows と同じ。
+        スコア = 曲との距離の逆数 + 所属クラスタの性別ボーナス
+                 （男性/女性希望なら、その性別の曲にさらに同じ重みのボーナス）
+        """
+        distances = distances_to(self.features, custom_vec)
+        weight = GENDER_BONUS_WEIGHTS[target_gender]
+        scores = 1.0 / (distances + 0.1) + self.gender_dist[self.labels, target_gender] * weight
+        if target_gender in (0, 2):
+            scores += (self.gender_codes == target_gender) * weight
+        return scores
+
+
+# クラスタ数の既定値（グループの曲数がこれより少なければ曲数）
+DEFAULT_K = 8
+
+
+@dataclass(frozen=True)
+class Standardization:
+    """
+    標準化の平均・標準偏差（sklearn の StandardScaler の mean_ / scale_ と同じ値）。
+    変換は NumPy だけで行い、StandardScaler.transform と同じ値になる。
+    """
+    mean: np.ndarray
+    scale: np.ndarray
+
+    @classmethod
+    def fit(cls, X: np.ndarray) -> "Standardization":
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler().fit(X)
+        return cls(mean=_frozen(scaler.mean_), scale=_frozen(scaler.scale_))
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return (X - self.mean) / self.scale
+
+
+def _classes_and_codes(codes: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    カタログの語彙の番号列 codes → グループに現れる値 (values[番号]) とグループ内の番号。
+    values はソート済みなので、グループ内の番号は値のソート順（LabelEncoder と同じ）になる。
+    """
+    used, group_codes = np.unique(codes, return_inverse=True)
+    return _frozen(values[used]), group_codes.reshape(-1)
+
+
+def _encode_labels(classes: np.ndarray, values: np.ndarray) -> Optional[np.ndarray]:
+    """学習時の語彙 classes での番号（語彙にない値があれば None）。"""
+    if not set(values) <= set(classes):
+        return None
+    return np.searchsorted(classes, values)
+
+
+@dataclass(frozen=True)
+class GroupFeatures:
+    """
+    グループのエンコード・標準化の結果（KMeans の入力）。
+    features / gender_codes はグループ内の順序（catalog_rows と対応）。
+    rich の場合 features は CSR 行列で、scaler は None（年列以外は 0/1 のまま使う）。
+    """
+    catalog_rows: np.ndarray
+    gender_classes: np.ndarray
+    mood_classes: np.ndarray
+    scaler: Optional[Standardization]
+    features: Union[np.ndarray, sparse.csr_matrix]
+    gender_codes: np.ndarray
+    year_min: int
+    year_max: int
+    catalog_features: Optional[CatalogFeatures] = None
+
+
+def encode_group(
+    song_catalog: SongCatalog,
+    catalog_rows: np.ndarray,
+    catalog_features: Optional[CatalogFeatures] = None,
+    scaler: Optional[Standardization] = None,
+) -> Optional[GroupFeatures]:
+    """
+    グループ（カタログ上の行位置 catalog_rows）の性別・ムード・年を数値化して標準化する。
+    catalog_features（rich）が渡された場合は、そのカテゴリ列と年列の疎行列を特徴量にする。
+    scaler（学習済みの標準化）が渡された場合は標準化を学習しない（sklearn を使わない）。
+    カタログ自体はコピー・変更しない。グループが空なら None を返す。
+    """
+    if len(catalog_rows) == 0:
+        return None
+
+    # カテゴリ数値化（ムードはタグの組み合わせの文字列。語彙は
+    # カタログの版に依存しない文字列で持ち、差分更新で追加曲の判定に使う）
+    arrays = song_catalog.arrays
+    gender_classes, gender_codes = _classes_and_codes(arrays.gender[catalog_rows], arrays.genders)
+    mood_classes, mood_codes = _classes_and_codes(arrays.mood[catalog_rows], arrays.mood_keys)
+
+    # 年代を0-1スケーリング
+    years = arrays.year[catalog_rows]
+    year_min = int(years.min())
+    year_max = int(years.max())
+    year_scaled = (years - year_min) / (year_max - year_min + 1e-6)
+
+    if catalog_features is not None:
+        return GroupFeatures(
+            catalog_rows=catalog_rows,
+            gender_classes=gender_classes,
+            mood_classes=mood_classes,
+            scaler=None,
+            features=catalog_features.group_features(catalog_rows, year_scaled),
+            gender_codes=_frozen(gender_codes),
+            year_min=year_min,
+            year_max=year_max,
+            catalog_features=catalog_features,
+        )
+
+    # 特徴量行列と標準化（列優先にして DataFrame から作っていた頃と同じ丸め・クラスタ結果にする）
+    X = np.asfortranarray(np.column_stack([gender_codes, mood_codes, year_scaled]), dtype=float)
+    if scaler is None:
+        scaler = Standardization.fit(X)
+
+    return GroupFeatures(
+        catalog_rows=catalog_rows,
+        gender_classes=gender_classes,
+        mood_classes=mood_classes,
+        scaler=scaler,
+        features=_frozen(scaler.transform(X)),
+        gender_codes=_frozen(gender_codes),
+        year_min=year_min,
+        year_max=year_max,
+    )
+
+
+def fit_kmeans(features: np.ndarray, k: int = DEFAULT_K) -> KMeans:
+    """KMeans を学習する（k はグループの曲数で頭打ち）。"""
+    from sklearn.cluster import KMeans
+
+    kmeans = KMeans(n_clusters=min(k, features.shape[0]), random_state=42, n_init=10)
+    return kmeans.fit(features)
+
+
+def assemble_cluster_model(
+    encoded: GroupFeatures,
+    centers: np.ndarray,
+    labels: np.ndarray,
+    kmeans: Optional[KMeans] = None,
+    baseline_inertia: Optional[float] = None,
+) -> ClusterModel:
+    """
+    エンコード結果とクラスタ割り当てから、推薦時に使う行位置・構成比を事前計算する。
+    baseline_inertia を省略すると、今の割り当てを drift の基準にする。
+    """
+    catalog_rows = encoded.catalog_rows
+    gender_codes = encoded.gender_codes
+    labels = np.asarray(labels)
+    centers = np.asarray(centers)
+    k = len(centers)
+    inertia = float(assigned_sq_distances(encoded.features, centers, labels).sum())
+
+    # クラスタ × 性別の行位置（カタログ上）・構成比を事前計算
+    gender_rows = tuple(_frozen(catalog_rows[gender_codes == g]) for g in range(N_GENDER_CODES))
+    local_rows = [np.flatnonzero(labels == c) for c in range(k)]
+    cluster_rows = tuple(_frozen(catalog_rows[rows]) for rows in local_rows)
+    cluster_gender_rows = tuple(
+        tuple(_frozen(catalog_rows[rows[gender_codes[rows] == g]]) for g in range(N_GENDER_CODES))
+        for rows in local_rows
+    )
+    return ClusterModel(
+        catalog_rows=catalog_rows,
+        gender_classes=encoded.gender_classes,
+        mood_classes=encoded.mood_classes,
+        scaler=encoded.scaler,
+        kmeans=kmeans,
+        centers=_frozen(centers),
+        features=encoded.features,
+        labels=_frozen(labels),
+        gender_codes=gender_codes,
+        year_min=encoded.year_min,
+        year_max=encoded.year_max,
+        gender_dist=_gender_dist(cluster_rows, cluster_gender_rows),
+        gender_rows=gender_rows,
+        cluster_rows=cluster_rows,
+        cluster_gender_rows=cluster_gender_rows,
+        inertia=inertia,
+        baseline_inertia=inertia / len(labels) if baseline_inertia is None else float(baseline_inertia),
+        neighbors=build_neighbor_index(encoded.features, catalog_rows, gender_codes),
+        catalog_features=encoded.catalog_features,
+    )
+
+
+def _gender_dist(
+    cluster_rows: Tuple[np.ndarray, ...],
+    cluster_gender_rows: Tuple[Tuple[np.ndarray, ...], ...],
+) -> np.ndarray:
+    """クラスタ × 性別コードの構成比行列 (k, 3)。"""
+    counts = np.array(
+        [[len(by_gender) for by_gender in row] for row in cluster_gender_rows],
+        dtype=float,
+    )
+    sizes = np.array([len(rows) for rows in cluster_rows], dtype=float)
+    return _frozen(np.divide(counts, sizes[:, None], out=np.zeros_like(counts), where=sizes[:, None] > 0))
+
+
+def extend_cluster_model(
+    model: ClusterModel,
+    song_catalog: SongCatalog,
+    new_rows: np.ndarray,
+    catalog_features: Optional[CatalogFeatures] = None,
+) -> Optional[ClusterModel]:
+    """
+    追加曲（カタログ上の行位置 new_rows）を既存モデルに差分で取り込む（mini-batch KMeans 方式）。
+    ・学習済みのエンコーダ・年範囲・標準化で特徴量を作り、最も近い既存の重心に割り当てる
+    ・各重心は「既存曲 + 追加曲」の平均へ移動し、inertia もそれに合わせて更新する
+    計算量は追加曲数に比例する（既存の配列の連結を除く）。
+    rich の場合は追加曲まで含めた catalog_features を渡す。
+    学習時になかった性別・ムードが含まれる場合は差分更新できないので None を返す。
+    """
+    arrays = song_catalog.arrays
+    gender_codes = _encode_labels(model.gender_classes, arrays.genders[arrays.gender[new_rows]])
+    mood_codes = _encode_labels(model.mood_classes, arrays.mood_keys[arrays.mood[new_rows]])
+    if gender_codes is None or mood_codes is None:
+        return None
+
+    years = arrays.year[new_rows]
+    year_scaled = (years - model.year_min) / (model.year_max - model.year_min + 1e-6)
+    if model.catalog_features is not None:
+        X = catalog_features.group_features(new_rows, year_scaled)
+    else:
+        X = model.scaler.transform(np.column_stack([gender_codes, mood_codes, year_scaled]).astype(float))
+
+    # 既存の重心に割り当てて、重心を (既存曲 + 追加曲) の平均へ移動
+    centers = model.centers
+    k = len(centers)
+    labels = sq_distances(X, centers).argmin(axis=1)
+    sizes = np.array([len(rows) for rows in model.cluster_rows], dtype=float)
+    added = np.bincount(labels, minlength=k).astype(float)
+    sums = cluster_sums(X, labels, k)
+    total = sizes + added
+    new_centers = np.where(
+        total[:, None] > 0,
+        (centers * sizes[:, None] + sums) / np.maximum(total, 1)[:, None],
+        centers,
+    )
+
+    # 既存曲の inertia は重心の移動量の2乗 × 曲数だけ増える（重心が既存曲の平均である前提）
+    inertia = (
+        model.inertia
+        + float((sizes * ((new_centers - centers) ** 2).sum(axis=1)).sum())
+        + float(assigned_sq_distances(X, new_centers, labels).sum())
+    )
+
+    def extended(rows: np.ndarray, extra: np.ndarray) -> np.ndarray:
+        return rows if len(extra) == 0 else _frozen(np.concatenate([rows, extra]))
+
+    catalog_rows = extended(model.catalog_rows, new_rows)
+    features = stack_rows([model.features, X])
+    all_gender_codes = extended(model.gender_codes, gender_codes.astype(model.gender_codes.dtype))
+    cluster_rows = tuple(extended(rows, new_rows[labels == c]) for c, rows in enumerate(model.cluster_rows))
+    cluster_gender_rows = tuple(
+        tuple(
+            extended(rows, new_rows[(labels == c) & (gender_codes == g)])
+            for g, rows in enumerate(by_gender)
+        )
+        for c, by_gender in enumerate(model.cluster_gender_rows)
+    )
+    return replace(
+        model,
+        catalog_rows=catalog_rows,
+        kmeans=None,
+        centers=_frozen(new_centers),
+        features=features,
+        labels=extended(model.labels, labels.astype(model.labels.dtype)),
+        gender_codes=all_gender_codes,
+        gender_dist=_gender_dist(cluster_rows, cluster_gender_rows),
+        gender_rows=tuple(
+            extended(rows, new_rows[gender_codes == g]) for g, rows in enumerate(model.gender_rows)
+        ),
+        cluster_rows=cluster_rows,
+        cluster_gender_rows=cluster_gender_rows,
+        inertia=inertia,
+        neighbors=build_neighbor_index(features, catalog_rows, all_gender_codes),
+        catalog_features=catalog_features if model.catalog_features is not None else None,
+    )
+
+
+def fit_cluster_model(
+    song_catalog: SongCatalog,
+    catalog_rows: np.ndarray,
+    centers: Optional[np.ndarray] = None,
+    labels: Optional[np.ndarray] = None,
+    baseline_inertia: Optional[float] = None,
+    catalog_features: Optional[CatalogFeatures] = None,
+    scaler: Optional[Standardization] = None,
+) -> Optional[ClusterModel]:
+    """
+    グループ（カタログ上の行位置 catalog_rows）に対して
+    エンコード・標準化・KMeans（k = DEFAULT_K）を学習する（catalog_features / scaler は encode_group と同じ）。
+    学習済みの centers / labels（と drift の基準 baseline_inertia）が渡された場合は
+    KMeans の学習を省略する。グループが空なら None を返す。
+    """
+    encoded = encode_group(song_catalog, catalog_rows, catalog_features, scaler)
+    if encoded is None:
+        return None
+    kmeans = None
+    if centers is None or labels is None or len(labels) != len(catalog_rows):
+        kmeans = fit_kmeans(encoded.features)
+        centers, labels = kmeans.cluster_centers_, kmeans.labels_
+        baseline_inertia = None
+    return assemble_cluster_model(encoded, centers, labels, kmeans, baseline_inertia)
+
+
+# ========= モデルストア =========
+
+_HASH_PRIME = np.uint64(0x100000001B3)
+
+
+def _string_hashes(values) -> np.ndarray:
+    """文字列ごとの 64bit ハッシュ（プロセス・実行によらず同じ値）。"""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(v.encode("utf-8"), digest_size=8).digest(), "little") for v in values),
+        dtype=np.uint64,
+        count=len(values),
+    )
+
+
+def _column_hashes(song_catalog: SongCatalog, name: str) -> np.ndarray:
+    """文字列列（title / artist）の曲ごとのハッシュ（文字列は種類ごとに1回だけハッシュする）。"""
+    uniq, inverse = np.unique(np.asarray(song_catalog.column(name)), return_inverse=True)
+    strings = song_catalog.strings
+    return _string_hashes([strings[sid] for sid in uniq.tolist()])[inverse]
+
+
+def _row_hashes(song_catalog: SongCatalog) -> np.ndarray:
+    """曲ごとの内容（行位置を含む）のハッシュ (n,)。"""
+    arrays = song_catalog.arrays
+    columns = (
+        _column_hashes(song_catalog, "title"),
+        _column_hashes(song_catalog, "artist"),
+        _string_hashes(arrays.genders)[arrays.gender],
+        arrays.year.astype(np.uint64),
+        _string_hashes(arrays.genres)[arrays.genre],
+        _string_hashes(arrays.mood_keys)[arrays.mood],
+        _string_hashes(arrays.situation_keys)[arrays.situation],
+    )
+    hashes = np.arange(len(song_catalog), dtype=np.uint64)
+    for column in columns:
+        hashes = (hashes ^ column) * _HASH_PRIME
+    return hashes
+
+
+# drift（学習時からの1曲あたり inertia の増加率）がこれを超えた年代は差分更新をやめて再学習する
+DRIFT_THRESHOLD = float(os.environ.get("MODEL_DRIFT_THRESHOLD", "0.25"))
+
+
+@dataclass(frozen=True)
+class EraUpdate:
+    """updated() で年代ごとに行った処理の記録（update_report の要素）。"""
+    era: str
+    added: int                # 追加された曲数
+    refit: bool               # 再学習したか（False なら差分更新）
+    # incremental（差分更新）/ drift（drift が閾値超え）/ no_model（既存モデルなし）/
+    # unknown_values（学習時にない性別・ムード）/ new_vocabulary（rich の語彙にない値）
+    reason: str
+    drift: Optional[float]    # 差分更新した場合の drift（計算できなければ None）
+
+
+class ModelStore:
+    """
+    年代グループ（showa / classic / latest）ごとの学習済みモデルを保持する。
+    カタログが変わったときだけ再学習し、リクエスト時は参照のみ行う。
+    model_arrays（export_arrays の出力。スナップショットから復元）があれば
+    KMeans・標準化の学習と曲ごとの内容のハッシュ（カタログの変更検知に使う）の計算を省略する
+    （このとき sklearn は読み込まない）。
+    学習は services.model_build.build_models で行う（k の候補・プロセス数は同モジュールの既定値）。
+    build_report にグループごとの学習時間・選ばれた k が入る。
+    曲の追加だけなら updated() で差分更新でき、年代ごとの判断は update_report に入る。
+    feature_set（既定は MODEL_FEATURES）が rich なら、カタログ全体の疎な特徴量を
+    1回だけ作って保持し、全年代のモデルで共有する。
+    """
+
+    def __init__(
+        self,
+        song_catalog: SongCatalog,
+        model_arrays: Optional[Dict[str, object]] = None,
+        k_candidates: Optional[Tuple[int, ...]] = None,
+        processes: Optional[int] = None,
+        feature_set: Optional[str] = None,
+        catalog_features: Optional[CatalogFeatures] = None,
+    ):
+        arrays = model_arrays or {}
+        self.size = len(song_catalog)
+        # 曲ごとの内容のハッシュ（スナップショットに書き出したものがあれば再計算しない）
+        row_hashes = arrays.get("catalog.row_hashes")
+        if row_hashes is None or len(row_hashes) != self.size:
+            row_hashes = _row_hashes(song_catalog)
+        self.row_hashes = _frozen(np.asarray(row_hashes, dtype=np.uint64))
+        self.fingerprint = int(self.row_hashes.sum())
+        self.groups: Dict[str, np.ndarray] = split_eras(song_catalog.arrays.year)
+        self.k_candidates = k_candidates
+        self.processes = processes
+        self.feature_set = feature_set or FEATURE_SET
+        if self.feature_set not in FEATURE_SETS:
+            raise ValueError(f"未知の特徴量セットです: {self.feature_set} （{', '.join(FEATURE_SETS)} のいずれか）")
+        self.catalog_features: Optional[CatalogFeatures] = None
+        if self.feature_set == "rich":
+            self.catalog_features = catalog_features or CatalogFeatures.build(song_catalog)
+        dimension = self.catalog_features.dimension if self.catalog_features is not None else 3
+        # 別の特徴量セットで学習した結果（記録のない古いスナップショットも）は使わずに学習し直す
+        stored_feature_set = arrays.get("models.feature_set")
+        same_features = (
+            stored_feature_set is not None and bytes(stored_feature_set).decode("utf-8") == self.feature_set
+        )
+        self.models: Dict[str, Optional[ClusterModel]] = {}
+        to_fit: Dict[str, np.ndarray] = {}
+        for era, group in self.groups.items():
+            centers = arrays.get(f"{era}.centers")
+            labels = arrays.get(f"{era}.labels")
+            if centers is not None:
+                centers = np.asarray(centers)
+            if labels is not None:
+                labels = np.asarray(labels)
+            # 重心は (k, 次元) のまま、割り当ては 0〜k-1 でグループの曲数分あるときだけ使う
+            if (
+                not same_features or centers is None or labels is None or len(labels) != len(group)
+                or centers.ndim != 2 or centers.shape[1] != dimension
+                or (len(labels) and not 0 <= labels.min() <= labels.max() < len(centers))
+            ):
+                to_fit[era] = group
+                continue
+            baseline = arrays.get(f"{era}.baseline_inertia")
+            scaler = None
+            if f"{era}.scaler_mean" in arrays and f"{era}.scaler_scale" in arrays:
+                scaler = Standardization(
+                    mean=_frozen(np.array(arrays[f"{era}.scaler_mean"], dtype=np.float64)),
+                    scale=_frozen(np.array(arrays[f"{era}.scaler_scale"], dtype=np.float64)),
+                )
+            self.models[era] = fit_cluster_model(
+                song_catalog,
+                group,
+                centers=centers,
+                labels=labels,
+                baseline_inertia=float(np.asarray(baseline)[0]) if baseline is not None else None,
+                catalog_features=self.catalog_features,
+                scaler=scaler,
+            )
+        self.build_report = self._fit(song_catalog, to_fit) if to_fit else []
+        self.update_report: List[EraUpdate] = []
+        # 年代の順序を ERA_RANGES に揃える
+        self.models = {era: self.models[era] for era in self.groups}
+
+    def _fit(self, song_catalog: SongCatalog, groups: Dict[str, np.ndarray]) -> List:
+        # model_build は本モジュールを import するので、ここで読み込む
+        from services.model_build import build_models
+
+        fitted, report = build_models(
+            song_catalog, groups, self.k_candidates, self.processes, self.catalog_features
+        )
+        self.models.update(fitted)
+        return report
+
+    def updated(self, song_catalog: SongCatalog, drift_threshold: Optional[float] = None) -> "ModelStore":
+        """
+        新しいカタログに対応するストアを返す（自身は変更しない）。
+        ・内容が同じなら自身をそのまま返す
+        ・既存カタログの末尾に曲が追加されただけなら、追加曲を既存モデルに差分で取り込む。
+          drift が drift_threshold を超えた年代（と差分更新できない年代）だけ再学習する
+        ・それ以外（曲の削除・変更・並び替え）と、rich で語彙にない性別・ジャンル・タグが
+          追加された場合は全年代を再学習する
+        """
+        drift_threshold = DRIFT_THRESHOLD if drift_threshold is None else drift_threshold
+        hashes = _row_hashes(song_catalog)
+        if len(song_catalog) == self.size and int(hashes.sum()) == self.fingerprint:
+            return self
+        rebuild = dict(k_candidates=self.k_candidates, processes=self.processes, feature_set=self.feature_set)
+        if len(song_catalog) < self.size or int(hashes[:self.size].sum()) != self.fingerprint:
+            return ModelStore(song_catalog, **rebuild)
+        added = {
+            era: rows + self.size
+            for era, rows in split_eras(song_catalog.arrays.year[self.size:]).items()
+        }
+        catalog_features = None
+        if self.catalog_features is not None:
+            catalog_features = self.catalog_features.appended(song_catalog)
+            if catalog_features is None:
+                # 追加曲に語彙にない性別・ジャンル・タグがある
+                store = ModelStore(song_catalog, **rebuild)
+                store.update_report = [
+                    EraUpdate(era, len(rows), True, "new_vocabulary", None) for era, rows in added.items() if len(rows)
+                ]
+                return store
+
+        store = copy.copy(self)
+        store.catalog_features = catalog_features
+        store.size = len(song_catalog)
+        store.row_hashes = _frozen(hashes)
+        store.fingerprint = int(hashes.sum())
+        store.models = dict(self.models)
+        store.groups = {}
+        store.update_report = []
+        to_fit: Dict[str, np.ndarray] = {}
+        for era, rows in self.groups.items():
+            new_rows = added[era]
+            group = store.groups[era] = _frozen(np.concatenate([rows, new_rows])) if len(new_rows) else rows
+            if len(new_rows) == 0:
+                continue
+            model = self.models[era]
+            extended = (
+                extend_cluster_model(model, song_catalog, new_rows, catalog_features)
+                if model is not None else None
+            )
+            drift = extended.drift if extended is not None else None
+            if extended is None or extended.drift > drift_threshold:
+                reason = "drift" if extended is not None else "no_model" if model is None else "unknown_values"
+                store.update_report.append(EraUpdate(era, len(new_rows), True, reason, drift))
+                to_fit[era] = group
+            else:
+                store.update_report.append(EraUpdate(era, len(new_rows), False, "incremental", drift))
+                store.models[era] = extended
+        store.build_report = store._fit(song_catalog, to_fit) if to_fit else []
+        return store
+
+    def export_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        学習結果（重心・クラスタ割り当て・drift の基準・標準化）と曲ごとの内容のハッシュを配列として書き出す。
+        特徴量セット名（UTF-8 のバイト列）も書き出し、復元時に一致しなければ学習し直す。
+        """
+        arrays = {
+            "catalog.row_hashes": np.ascontiguousarray(self.row_hashes),
+            "models.feature_set": np.frombuffer(self.feature_set.encode("utf-8"), dtype=np.uint8).copy(),
+        }
+        for era, model in self.models.items():
+            if model is None:
+                continue
+            arrays[f"{era}.centers"] = np.ascontiguousarray(model.centers, dtype=np.float64)
+            arrays[f"{era}.labels"] = np.ascontiguousarray(model.labels, dtype=np.int32)
+            arrays[f"{era}.baseline_inertia"] = np.array([model.baseline_inertia], dtype=np.float64)
+            if model.scaler is not None:
+                arrays[f"{era}.scaler_mean"] = np.ascontiguousarray(model.scaler.mean, dtype=np.float64)
+                arrays[f"{era}.scaler_scale"] = np.ascontiguousarray(model.scaler.scale, dtype=np.float64)
+        return arrays
+
+    def get(self, era: str) -> Optional[ClusterModel]:
+        return self.models.get(era)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+import os
+import sys
+from models.song import CatalogArrays, SongCatalog
+import numpy as np
+
+# scipy は rich の特徴量を作るときだけ読み込む（basic の推薦は NumPy だけで動く）
+if TYPE_CHECKING:
+    from scipy import sparse
+
+
+# ========= 特徴量セット =========
+#
+# basic: 性別コード・ムードコード（グループ内のソート順の番号）・年（0-1）の3列を標準化した密行列（従来どおり）
+# rich:  性別・ジャンルの one-hot、ムード・シチュエーションタグの multi-hot、年の疎行列（CSR）
+#        タグの語彙が増えても非ゼロ要素数（曲数 × タグ数程度）しかメモリを使わない
+FEATURE_SETS = ("basic", "rich")
+FEATURE_SET = os.environ.get("MODEL_FEATURES", "basic")
+
+# rich の年列の重み（年の範囲の両端で、カテゴリ2つの不一致と同じ距離になる）
+YEAR_WEIGHT = 2.0
+
+
+def issparse(X) -> bool:
+    """X が scipy の疎行列か（scipy が未読み込みなら疎行列は存在しないので、読み込まずに判定する）。"""
+    module = sys.modules.get("scipy.sparse")
+    return module is not None and module.issparse(X)
+
+
+def _one_hot(codes: np.ndarray, width: int) -> sparse.csr_matrix:
+    from scipy import sparse
+
+    n = len(codes)
+    return sparse.csr_matrix(
+        (np.ones(n), codes.astype(np.int32), np.arange(n + 1, dtype=np.int32)),
+        shape=(n, width),
+    )
+
+
+def _vocabulary_codes(labels: np.ndarray, vocabulary: Sequence[str]) -> np.ndarray:
+    """カタログの語彙（labels）の各値 → vocabulary 上の番号（vocabulary はソート済み）。"""
+    return np.searchsorted(np.array(vocabulary, dtype=object), labels)
+
+
+def _multi_hot(set_codes: np.ndarray, tag_sets: Sequence[FrozenSet[str]], vocabulary: Sequence[str]) -> sparse.csr_matrix:
+    """タグの組み合わせの番号列を multi-hot 行列にする（列番号は組み合わせの種類ごとに1回だけ求める）。"""
+    from scipy import sparse
+
+    column = {tag: i for i, tag in enumerate(vocabulary)}
+    uniq, inverse = np.unique(set_codes, return_inverse=True)
+    tag_columns = [
+        np.array(sorted(column[tag] for tag in tag_sets[code] if tag in column), dtype=np.int32)
+        for code in uniq.tolist()
+    ]
+    lengths = np.array([len(cols) for cols in tag_columns], dtype=np.int64)
+    flat = np.concatenate(tag_columns) if len(tag_columns) else np.zeros(0, dtype=np.int32)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64) if len(lengths) else lengths
+
+    # 行ごとの列番号を、組み合わせごとの列番号 flat からまとめて取り出す
+    row_lengths = lengths[inverse]
+    indptr = np.concatenate([[0], np.cumsum(row_lengths)])
+    offsets = np.repeat(starts[inverse] - indptr[:-1], row_lengths) + np.arange(indptr[-1])
+    return sparse.csr_matrix(
+        (np.ones(indptr[-1]), flat[offsets], indptr),
+        shape=(len(set_codes), len(vocabulary)),
+    )
+
+
+def _tag_vocabulary(tag_sets: Iterable[FrozenSet[str]]) -> Tuple[str, ...]:
+    return tuple(sorted(set().union(*tag_sets)))
+
+
+def _used(values: np.ndarray, codes: np.ndarray) -> List:
+    """codes に現れる番号の値（values[番号]）。"""
+    return [values[code] for code in np.unique(codes).tolist()]
+
+
+@dataclass(frozen=True)
+class CatalogFeatures:
+    """
+    カタログ全体のカテゴリ特徴量（rich）。カタログの版ごとに1回だけ作り、ModelStore が保持する。
+    ・genders / genres / moods / situations: 語彙（ソート済み。性別・ムードのコードは
+      basic と同じくこの順の番号として解釈する）
+    ・matrix: 全曲 × カテゴリ列の CSR 行列 [性別 | ジャンル | ムード | シチュエーション]
+    年列はグループの年範囲でスケーリングするので、グループごとに group_features で付け足す。
+    """
+    genders: Tuple[str, ...]
+    genres: Tuple[str, ...]
+    moods: Tuple[str, ...]
+    situations: Tuple[str, ...]
+    matrix: sparse.csr_matrix
+
+    @classmethod
+    def build(cls, song_catalog: SongCatalog) -> "CatalogFeatures":
+        arrays = song_catalog.arrays
+        genders = tuple(arrays.genders)
+        genres = tuple(arrays.genres)
+        moods = _tag_vocabulary(arrays.mood_sets)
+        situations = _tag_vocabulary(arrays.situation_sets)
+        rows = np.arange(len(song_catalog))
+        return cls(genders, genres, moods, situations, cls._encode(arrays, rows, genders, genres, moods, situations))
+
+    @staticmethod
+    def _encode(arrays: CatalogArrays, rows: np.ndarray, genders, genres, moods, situations) -> sparse.csr_matrix:
+        from scipy import sparse
+
+        matrix = sparse.hstack([
+            _one_hot(_vocabulary_codes(arrays.genders, genders)[arrays.gender[rows]], len(genders)),
+            _one_hot(_vocabulary_codes(arrays.genres, genres)[arrays.genre[rows]], len(genres)),
+            _multi_hot(arrays.mood[rows], arrays.mood_sets, moods),
+            _multi_hot(arrays.situation[rows], arrays.situation_sets, situations),
+        ], format="csr")
+        return _frozen_csr(matrix)
+
+    @property
+    def dimension(self) -> int:
+        """年列を含めた特徴量の次元。"""
+        return self.matrix.shape[1] + 1
+
+    def appended(self, song_catalog: SongCatalog) -> Optional["CatalogFeatures"]:
+        """
+        末尾に曲が追加されたカタログに対応する特徴量（追加曲だけをエンコードする）。
+        追加曲に語彙にない性別・ジャンル・タグがあれば None（作り直しが必要）。
+        """
+        arrays = song_catalog.arrays
+        added = np.arange(self.matrix.shape[0], len(song_catalog))
+        if not (
+            set(_used(arrays.genders, arrays.gender[added])) <= set(self.genders)
+            and set(_used(arrays.genres, arrays.genre[added])) <= set(self.genres)
+            and set(_tag_vocabulary(_used(arrays.mood_sets, arrays.mood[added]))) <= set(self.moods)
+            and set(_tag_vocabulary(_used(arrays.situation_sets, arrays.situation[added]))) <= set(self.situations)
+        ):
+            return None
+        from scipy import sparse
+
+        encoded = self._encode(arrays, added, self.genders, self.genres, self.moods, self.situations)
+        return CatalogFeatures(
+            self.genders, self.genres, self.moods, self.situations,
+            _frozen_csr(sparse.vstack([self.matrix, encoded], format="csr")),
+        )
+
+    def group_features(self, catalog_rows: np.ndarray, year_scaled: np.ndarray) -> sparse.csr_matrix:
+        """グループの特徴量（カテゴリ列 + 重み付きの年列）。"""
+        from scipy import sparse
+
+        year = sparse.csr_matrix(np.asarray(year_scaled, dtype=float)[:, None] * YEAR_WEIGHT)
+        return _frozen_csr(sparse.hstack([self.matrix[catalog_rows], year], format="csr"))
+
+    def query_vector(self, gender: int, mood: int, year_scaled: float) -> np.ndarray:
+        """
+        赤星曲（性別コード・ムードコード・グループ内の年）の特徴量ベクトル（密）。
+        ジャンル・シチュエーションは指定しない（0）。
+        """
+        vec = np.zeros(self.dimension)
+        if 0 <= gender < len(self.genders):
+            vec[gender] = 1.0
+        if 0 <= mood < len(self.moods):
+            vec[len(self.genders) + len(self.genres) + mood] = 1.0
+        vec[-1] = year_scaled * YEAR_WEIGHT
+        return vec
+
+
+def _frozen_csr(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """CSR 行列の配列を書き込み不可にする（学習後の行列はリクエスト間で共有するため）。"""
+    for array in (matrix.data, matrix.indices, matrix.indptr):
+        array.setflags(write=False)
+    return matrix
+
+
+# ========= 距離計算（密・疎の両対応） =========
+
+def row_sq_norms(X) -> np.ndarray:
+    """各行の2乗ノルム (n,)。"""
+    if issparse(X):
+        return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    return (X ** 2).sum(axis=1)
+
+
+def sq_distances(X, centers: np.ndarray) -> np.ndarray:
+    """各行と各重心の距離の2乗 (n, k)。疎行列は ||x||² - 2x·c + ||c||² で非ゼロ要素だけ計算する。"""
+    if issparse(X):
+        cross = np.asarray(X @ centers.T)
+        return np.maximum(row_sq_norms(X)[:, None] - 2 * cross + (centers ** 2).sum(axis=1)[None, :], 0.0)
+    return ((X[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+
+def assigned_sq_distances(X, centers: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """各行と所属クラスタ重心との距離の2乗 (n,)。"""
+    if issparse(X):
+        cross = np.asarray(X @ centers.T)[np.arange(len(labels)), labels]
+        return np.maximum(row_sq_norms(X) - 2 * cross + (centers ** 2).sum(axis=1)[labels], 0.0)
+    return ((X - centers[labels]) ** 2).sum(axis=1)
+
+
+def distances_to(X, vec: np.ndarray) -> np.ndarray:
+    """各行とベクトル vec の距離 (n,)。"""
+    if issparse(X):
+        return np.sqrt(np.maximum(row_sq_norms(X) - 2 * np.asarray(X @ vec).ravel() + vec @ vec, 0.0))
+    return np.linalg.norm(X - vec, axis=1)
+
+
+def cluster_sums(X, labels: np.ndarray, k: int) -> np.ndarray:
+    """クラスタごとの特徴量の和 (k, d)。"""
+    if issparse(X):
+        from scipy import sparse
+
+        n = len(labels)
+        assignment = sparse.csr_matrix((np.ones(n), (labels, np.arange(n))), shape=(k, n))
+        return (assignment @ X).toarray()
+    sums = np.zeros((k, X.shape[1]))
+    np.add.at(sums, labels, X)
+    return sums
+
+
+def stack_rows(parts: List):
+    """特徴量行列を縦に連結する。"""
+    if issparse(parts[0]):
+        from scipy import sparse
+
+        return _frozen_csr(sparse.vstack(parts, format="csr"))
+    matrix = np.concatenate(parts)
+    matrix.setflags(write=False)
+    return matrix
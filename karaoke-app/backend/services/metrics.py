@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence, Tuple
+import bisect
+import threading
+import time
+
+
+# ========= メトリクス（Prometheus テキスト形式で出力） =========
+#
+# プロセス内で集計する。pre-fork 構成ではワーカーごとの値になる。
+
+# 既定のバケット（秒）: 10µs 〜 2.5s
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+def _label_str(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # ラベル値 → [バケットごとの件数..., 合計値, 件数]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _label_str(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_str(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録先。render() に渡した行（キャッシュ統計など）も末尾に出力する。"""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra: Iterable[str] = ()) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(extra)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# 推薦処理の各ステージ（年決定・性別判定・ムード決定・年代分け・スコア計算・抽選・歌う人選択など）
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "karaoke_recommend_stage_seconds", "Time spent in each recommendation stage.", ["stage"]
+))
+# モデル学習（グループごと。k の候補が複数なら全候補の合計）
+MODEL_BUILD_SECONDS = REGISTRY.register(Histogram(
+    "karaoke_model_build_seconds", "Time spent fitting the model of a song group.", ["group"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+))
+RECOMMENDATIONS = REGISTRY.register(Counter(
+    "karaoke_recommendations_total", "Number of recommendations served.", ["era"]
+))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "karaoke_http_request_seconds", "HTTP request latency.", ["endpoint", "status"]
+))
+# 非同期サーバで受け付けなかった・打ち切ったリクエスト（reason = busy / timeout / too_large）
+HTTP_REJECTED = REGISTRY.register(Counter(
+    "karaoke_http_rejected_total", "Requests rejected or cut off by the async server.", ["reason"]
+))
+
+
+def stage(name: str):
+    """ステージの所要時間を計測するコンテキストマネージャ。"""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def cache_gauges(caches: Dict[str, Dict]) -> List[str]:
+    """LRUCache.stats() の辞書（キャッシュ名 → 統計）を gauge 形式の行にする。"""
+    fields = (
+        ("size", "karaoke_cache_entries", "Number of entries in the cache."),
+        ("hits", "karaoke_cache_hits", "Cache hits since the service was built."),
+        ("misses", "karaoke_cache_misses", "Cache misses since the service was built."),
+        ("hitRate", "karaoke_cache_hit_ratio", "Cache hit ratio since the service was built."),
+        ("evictions", "karaoke_cache_evictions", "Entries evicted by the LRU policy."),
+    )
+    lines: List[str] = []
+    for field, name, help in fields:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for cache, stats in sorted(caches.items()):
+            lines.append(f'{name}{{cache="{cache}"}} {float(stats[field])}')
+    return lines
@@ -0,0 +1,306 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+from scipy import sparse
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from models.song import SongCatalog
+from services.cluster_model import (
+    DEFAULT_K,
+    ClusterModel,
+    GroupFeatures,
+    assemble_cluster_model,
+    encode_group,
+    fit_kmeans,
+    split_eras,
+)
+from services.features import FEATURE_SET, FEATURE_SETS, CatalogFeatures
+from services.metrics import MODEL_BUILD_SECONDS
+import numpy as np
+
+
+# ========= モデル構築パイプライン =========
+#
+# グループ（年代 × ジャンル × シチュエーションなど）ごと・k の候補ごとの KMeans 学習を
+# プロセスプールに分散する。特徴量行列は共有メモリに1回だけ書き込み、
+# ワーカーはその一部をコピーせずに参照する（疎行列の特徴量はタスクごとに渡す）。
+# 複数の k 候補があればシルエット係数が最大の k を選ぶ。
+
+
+def parse_k_candidates(value: str) -> Tuple[int, ...]:
+    """カンマ区切りの k の候補。空・整数でない値・1 未満の値があれば ValueError。"""
+    try:
+        ks = tuple(int(k) for k in value.split(",") if k.strip())
+    except ValueError:
+        ks = ()
+    if not ks or min(ks) < 1:
+        raise ValueError(f"k の候補は 1 以上の整数をカンマ区切りで指定してください: {value!r}")
+    return ks
+
+
+# k の候補（カンマ区切り）。既定は従来どおり k = 8 固定
+K_CANDIDATES: Tuple[int, ...] = parse_k_candidates(os.environ.get("MODEL_K_CANDIDATES", str(DEFAULT_K)))
+# 学習に使うプロセス数。1 ならプロセスプールを使わずに順に学習する。
+# 2 以上にする場合、起動スクリプトは `if __name__ == "__main__":` で保護すること
+# （子プロセスは spawn で起動し main モジュールを読み込み直す。gunicorn / uvicorn 経由なら問題ない）
+BUILD_PROCESSES = int(os.environ.get("MODEL_BUILD_PROCESSES", "1"))
+# シルエット係数の計算に使う最大サンプル数（計算量は曲数の2乗）
+SILHOUETTE_SAMPLE_SIZE = 5000
+
+# グループ分けに使える軸
+GROUP_DIMENSIONS = ("era", "genre", "situation")
+
+
+@dataclass(frozen=True)
+class KFit:
+    """1つのグループ・1つの k に対する学習結果。"""
+    k: int
+    kmeans: KMeans
+    inertia: float
+    silhouette: Optional[float]
+    seconds: float
+
+
+@dataclass(frozen=True)
+class GroupBuild:
+    """グループごとの学習結果の記録（build_report の要素）。"""
+    group: str
+    size: int
+    k: int
+    seconds: float
+    silhouette: Optional[float]
+    candidates: Tuple[Tuple[int, float, Optional[float]], ...]  # (k, inertia, silhouette)
+
+
+def _fit_k(features: np.ndarray, k: int, score: bool) -> KFit:
+    start = time.perf_counter()
+    kmeans = fit_kmeans(features, k)
+    silhouette = None
+    n_clusters = len(kmeans.cluster_centers_)
+    if score and 2 <= n_clusters < features.shape[0]:
+        silhouette = float(silhouette_score(
+            features,
+            kmeans.labels_,
+            sample_size=min(SILHOUETTE_SAMPLE_SIZE, features.shape[0]),
+            random_state=42,
+        ))
+    return KFit(
+        k=n_clusters,
+        kmeans=kmeans,
+        inertia=float(kmeans.inertia_),
+        silhouette=silhouette,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def _fit_shared(name: str, shape: Tuple[int, int], offset: int, size: int, k: int, score: bool) -> KFit:
+    """ワーカー側: 共有メモリ上の特徴量行列の一部（コピーしない）で学習する。"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        features = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[offset:offset + size]
+        result = _fit_k(features, k, score)
+        del features  # 共有メモリを閉じる前にビューを手放す
+        return result
+    finally:
+        shm.close()
+
+
+def _candidate_ks(size: int, k_candidates: Sequence[int]) -> List[int]:
+    """グループの曲数で頭打ちにした k の候補（重複なし）。有効な候補がなければ k = 1。"""
+    return sorted({min(k, size) for k in k_candidates if k > 0}) or [1]
+
+
+def _select(fits: List[KFit]) -> KFit:
+    """シルエット係数が最大の結果（同点・未計算なら k が小さい方）。"""
+    scored = [fit for fit in fits if fit.silhouette is not None]
+    if not scored:
+        return fits[0]
+    return max(scored, key=lambda fit: (fit.silhouette, -fit.k))
+
+
+def _fit_parallel(
+    encoded: Dict[str, GroupFeatures],
+    tasks: List[Tuple[str, int, bool]],
+    processes: int,
+) -> Dict[Tuple[str, int], KFit]:
+    """全グループの特徴量を共有メモリにまとめて書き込み、(グループ, k) ごとにプロセスプールで学習する。"""
+    # 推薦サービスのスレッドから呼ばれても安全なように fork ではなく spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    if any(sparse.issparse(group.features) for group in encoded.values()):
+        # 疎行列（rich）は共有メモリに載せず、そのまま渡す（コピーは非ゼロ要素数に比例）
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)), mp_context=context) as pool:
+            futures = {
+                (key, k): pool.submit(_fit_k, encoded[key].features, k, score)
+                for key, k, score in tasks
+            }
+            return {task: future.result() for task, future in futures.items()}
+
+    offsets: Dict[str, Tuple[int, int]] = {}
+    total = 0
+    for key, group in encoded.items():
+        offsets[key] = (total, group.features.shape[0])
+        total += group.features.shape[0]
+    shape = (total, 3)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(total * 3 * 8, 1))
+    try:
+        shared = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for key, (offset, size) in offsets.items():
+            shared[offset:offset + size] = encoded[key].features
+        del shared
+
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)), mp_context=context) as pool:
+            futures = {
+                (key, k): pool.submit(_fit_shared, shm.name, shape, *offsets[key], k, score)
+                for key, k, score in tasks
+            }
+            return {task: future.result() for task, future in futures.items()}
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def build_models(
+    song_catalog: SongCatalog,
+    groups: Dict[str, np.ndarray],
+    k_candidates: Optional[Sequence[int]] = None,
+    processes: Optional[int] = None,
+    catalog_features: Optional[CatalogFeatures] = None,
+) -> Tuple[Dict[str, Optional[ClusterModel]], List[GroupBuild]]:
+    """
+    グループ（名前 → カタログ上の行位置）ごとにモデルを学習する。
+    エンコードは親プロセスで行い、KMeans の学習（グループ × k の候補）を
+    processes 個のプロセスに分散する。空のグループのモデルは None。
+    catalog_features（rich の疎な特徴量）を渡すとそれで学習する。
+
+    Returns:
+        (グループ名 → モデル, グループごとの学習記録)
+    """
+    k_candidates = tuple(k_candidates or K_CANDIDATES)
+    processes = processes or BUILD_PROCESSES
+
+    encoded = {key: encode_group(song_catalog, rows, catalog_features) for key, rows in groups.items()}
+    active = {key: group for key, group in encoded.items() if group is not None}
+
+    # 大きいグループから投入して、最後に大きな学習だけが残るのを避ける
+    tasks = []
+    for key in sorted(active, key=lambda key: -active[key].features.shape[0]):
+        ks = _candidate_ks(active[key].features.shape[0], k_candidates)
+        tasks.extend((key, k, len(ks) > 1) for k in ks)
+
+    # プールの子プロセス内（spawn で main モジュールが再実行された場合など）では並列化しない
+    if processes > 1 and len(tasks) > 1 and multiprocessing.parent_process() is None:
+        fits = _fit_parallel(active, tasks, processes)
+    else:
+        fits = {(key, k): _fit_k(active[key].features, k, score) for key, k, score in tasks}
+
+    models: Dict[str, Optional[ClusterModel]] = {key: None for key in groups}
+    report: List[GroupBuild] = []
+    for key, group in active.items():
+        group_fits = [fits[(k_key, k)] for k_key, k, _ in tasks if k_key == key]
+        best = _select(group_fits)
+        seconds = sum(fit.seconds for fit in group_fits)
+        MODEL_BUILD_SECONDS.observe(seconds, group=key)
+        models[key] = assemble_cluster_model(group, best.kmeans.cluster_centers_, best.kmeans.labels_, best.kmeans)
+        report.append(GroupBuild(
+            group=key,
+            size=group.features.shape[0],
+            k=best.k,
+            seconds=seconds,
+            silhouette=best.silhouette,
+            candidates=tuple((fit.k, fit.inertia, fit.silhouette) for fit in group_fits),
+        ))
+    return models, report
+
+
+# ========= グループ分け =========
+
+def _dimension_masks(song_catalog: SongCatalog, dimension: str) -> Dict[str, np.ndarray]:
+    """軸の値ごとのカタログ全体のマスク。シチュエーションは複数タグなので1曲が複数の値に入る。"""
+    arrays = song_catalog.arrays
+    if dimension == "era":
+        masks = {}
+        for era, rows in split_eras(arrays.year).items():
+            mask = np.zeros(len(song_catalog), dtype=bool)
+            mask[rows] = True
+            masks[era] = mask
+        return masks
+    if dimension == "genre":
+        return {genre: arrays.genre == code for code, genre in enumerate(arrays.genres)}
+    if dimension == "situation":
+        # タグごとに、そのタグを含む組み合わせの番号で判定する
+        return {
+            tag: np.isin(arrays.situation, [code for code, tags in enumerate(arrays.situation_sets) if tag in tags])
+            for tag in sorted(set().union(*arrays.situation_sets))
+        }
+    raise ValueError(f"未知のグループ軸です: {dimension} （{', '.join(GROUP_DIMENSIONS)} のいずれか）")
+
+
+def group_rows(song_catalog: SongCatalog, group_by: Sequence[str] = ("era",)) -> Dict[str, np.ndarray]:
+    """
+    group_by の軸（era / genre / situation）の組み合わせごとの行位置。
+    グループ名は軸の値を '/' でつないだもの（例: "classic/J-POP/カラオケ"）。空のグループは含めない。
+    """
+    groups = {"": np.arange(len(song_catalog))}
+    for dimension in group_by:
+        masks = _dimension_masks(song_catalog, dimension)
+        groups = {
+            f"{key}/{value}" if key else value: rows[mask[rows]]
+            for key, rows in groups.items()
+            for value, mask in masks.items()
+        }
+        groups = {key: rows for key, rows in groups.items() if len(rows)}
+    return groups
+
+
+# ========= 一括構築 =========
+if __name__ == "__main__":
+    # 例: python -m services.model_build data/songs.csv --group-by era,genre,situation --k 4,6,8,10 --processes 8
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="グループごとのモデルを並列に学習し、学習時間を出力する")
+    parser.add_argument("csv", nargs="?", default=str(Path(__file__).parents[1] / "data" / "songs.csv"))
+    parser.add_argument("--group-by", default="era", help=f"グループ分けの軸（カンマ区切り: {', '.join(GROUP_DIMENSIONS)}）")
+    parser.add_argument("--k", default=",".join(map(str, K_CANDIDATES)), help="k の候補（カンマ区切り）")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="学習に使うプロセス数")
+    parser.add_argument("--features", choices=FEATURE_SETS, default=FEATURE_SET, help="特徴量セット")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = parser.parse_args()
+    try:
+        k_candidates = parse_k_candidates(args.k)
+    except ValueError as e:
+        parser.error(str(e))
+
+    catalog = SongCatalog.from_csv(Path(args.csv))
+    groups = group_rows(catalog, [d.strip() for d in args.group_by.split(",") if d.strip()])
+    start = time.perf_counter()
+    _, report = build_models(
+        catalog, groups, k_candidates, processes=args.processes,
+        catalog_features=CatalogFeatures.build(catalog) if args.features == "rich" else None,
+    )
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps({
+            "songs": len(catalog),
+            "groups": len(report),
+            "processes": args.processes,
+            "wallSeconds": elapsed,
+            "builds": [
+                {"group": b.group, "size": b.size, "k": b.k, "seconds": b.seconds, "silhouette": b.silhouette}
+                for b in report
+            ],
+        }, ensure_ascii=False, indent=2))
+    else:
+        for b in sorted(report, key=lambda b: -b.seconds):
+            silhouette = f"{b.silhouette:.3f}" if b.silhouette is not None else "-"
+            print(f"{b.group:40s} {b.size:8d}曲  k={b.k:<3d} {b.seconds:8.3f}s  silhouette={silhouette}")
+        cpu = sum(b.seconds for b in report)
+        print(f"{len(report)} グループ / {len(catalog)} 曲: 経過 {elapsed:.3f}s（学習時間の合計 {cpu:.3f}s, {args.processes} プロセス）")
@@ -1,236 +1,608 @@
+from dataclasses import dataclass
 from typing import List, Dict, Optional, Tuple
+import os
 import random
+import uuid
 from models.song import SongCatalog, Song
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.cluster import KMeans
-import pandas as pd
+from services.cluster_model import ClusterModel, ModelStore
+from services.cache import LRUCache
+from services.metrics import RECOMMENDATIONS, stage
+from services.recommendation_table import N_GENDERS, N_MOODS, RecommendationTable, table_signature
 import numpy as np
 
 
+# 画面の「年代」設定 → 年代グループ
+GENERATION_TO_ERA = {
+    "演歌・昭和歌謡": "showa",
+    "定番曲・懐メロ": "classic",
+    "最新ヒット": "latest",
+}
+# クラスタから選曲する年代グループ
+CLUSTERED_ERAS = ("classic", "latest")
+
+# ランキングとして保持する最大曲数（カーソルで順に返す）
+RANKING_SIZE = 100
+
+# 定番・最新で候補にする近傍曲数（赤星曲に近い順）。0 なら最適クラスタ内の曲を候補にする
+NEIGHBOR_COUNT = int(os.environ.get("RECOMMEND_NEIGHBORS", "50"))
+
+# デバッグ出力（候補・スコア）をサンプリングで有効にする割合。0 なら settings.debug のときのみ
+DEBUG_SAMPLE_RATE = float(os.environ.get("RECOMMEND_DEBUG_SAMPLE_RATE", "0"))
+
+# 演歌・昭和歌謡 / 最新ヒットの赤星曲の年（この範囲から一様に選ぶ。両端を含む）
+SHOWA_YEARS = (1980, 1989)
+LATEST_YEARS = (2023, 2024)
+
+# 全プロファイルの候補プールの事前計算表（services.recommendation_table）を使うか。
+# 定番曲・懐メロの年は平均年齢から求まるので、TABLE_MAX_MEMBERS 人以下・年齢が TABLE_AGES の
+# 整数のグループで取りうる年をすべて表に載せる（それ以外の年は従来どおり計算する）
+USE_TABLE = os.environ.get("RECOMMEND_TABLE", "0") == "1"
+TABLE_MAX_MEMBERS = int(os.environ.get("RECOMMEND_TABLE_MAX_MEMBERS", "6"))
+TABLE_AGES = (0, 100)
+
+
+def classic_year(avg_age: float) -> float:
+    """定番曲・懐メロの赤星曲の年（平均年齢から）。"""
+    return 2025 - avg_age + 20 # +20は二十歳想定
+
+
+def table_years(max_members: int = None) -> Dict[str, np.ndarray]:
+    """
+    事前計算表で列挙する年代ごとの年。昭和歌謡・最新は _determine_year が選ぶ年そのもの。
+    定番曲・懐メロは人数 1〜max_members・年齢の合計から classic_year と同じ計算で求めた年
+    （表は完全一致で引くので、計算を変えると表に当たらなくなるだけで結果は変わらない）。
+    """
+    max_members = TABLE_MAX_MEMBERS if max_members is None else max_members
+    low, high = TABLE_AGES
+    classic = {
+        classic_year(total / members)
+        for members in range(1, max_members + 1)
+        for total in range(low * members, high * members + 1)
+    }
+    return {
+        "showa": np.arange(SHOWA_YEARS[0], SHOWA_YEARS[1] + 1, dtype=np.float64),
+        "classic": np.array(sorted(classic), dtype=np.float64),
+        "latest": np.arange(LATEST_YEARS[0], LATEST_YEARS[1] + 1, dtype=np.float64),
+    }
+
+
+class RankingCursorError(Exception):
+    """ランキングのカーソルが不正、または期限切れ。"""
+
+
+# ========= 乱数 =========
+#
+# 推薦の乱数（年・ムード・抽選・歌う人）はリクエストごとの NumPy Generator から引く。
+# 同じシードなら同じ結果になり（負荷試験・リクエストログの再実行で再現できる）、
+# 並行するリクエストは互いに独立したストリームを使う（グローバルな乱数状態を共有しない）。
+
+def new_seed() -> int:
+    """OS のエントロピーから作るシード（リクエストログに記録しておけば同じ結果を再現できる）。"""
+    return int(np.random.SeedSequence().entropy)
+
+
+def make_rng(seed: Optional[int] = None) -> np.random.Generator:
+    """リクエスト用の乱数生成器。seed がなければ独立した新しいストリーム。"""
+    return np.random.default_rng(new_seed() if seed is None else seed)
+
+
+class InvalidSeedError(ValueError):
+    """リクエストの seed が不正。"""
+
+
+def parse_seed(value) -> Optional[int]:
+    """リクエストの seed（0 以上の整数 または 省略）を検証する。"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise InvalidSeedError("seed must be a non-negative integer")
+    return value
+
+
+# 候補プール: 候補のカタログ上の行位置配列
+# 学習時に作った書き込み不可の配列を共有する（リクエストごとにコピーしない）
+CandidatePool = np.ndarray
+
+
+@dataclass(frozen=True)
+class _Ranking:
+    """計算済みランキング（カーソルによる続きの取得に使う）。"""
+    songs: List[Dict]
+    members: List[Dict]
+    mic_count: int
+
+
 class RecommendationService:
     """
     カラオケ選曲のビジネスロジック
+    カタログは SongCatalog（列指向）をそのまま使い、曲は行位置（曲ID）で扱う。
     """
     
-    def __init__(self, song_catalog: pd.DataFrame):
+    def __init__(
+        self,
+        song_catalog: SongCatalog,
+        model_arrays: Optional[Dict] = None,
+        pool_cache_size: int = 4096,
+        pool_cache_ttl: Optional[float] = 600.0,
+        debug_sample_rate: Optional[float] = None,
+        model_store: Optional[ModelStore] = None,
+        neighbor_count: Optional[int] = None,
+        use_table: Optional[bool] = None,
+    ):
         self.song_catalog = song_catalog
+        self.all_rows = self._catalog_rows(song_catalog)
+        # 年代グループごとの学習済みモデル（カタログ変更時のみ再学習。
+        # 前の版のストアを ModelStore.updated で更新したものを渡してもよい）
+        self.model_store = model_store or ModelStore(song_catalog, model_arrays)
+        # カーソル → 計算済みランキング
+        self.ranking_cache = LRUCache(maxsize=1024)
+        # 正規化プロファイル → 候補プール
+        self.pool_cache = LRUCache(maxsize=pool_cache_size, ttl=pool_cache_ttl)
+        # デバッグ出力をサンプリングで有効にする割合（0 なら settings.debug のときのみ。省略時は DEBUG_SAMPLE_RATE）
+        self.debug_sample_rate = DEBUG_SAMPLE_RATE if debug_sample_rate is None else debug_sample_rate
+        # 定番・最新の候補数（近傍探索）。0 ならクラスタ単位で候補を選ぶ（省略時は NEIGHBOR_COUNT）
+        self.neighbor_count = NEIGHBOR_COUNT if neighbor_count is None else neighbor_count
+        # 全プロファイルの候補プールの事前計算表（use_table のとき。省略時は USE_TABLE。
+        # model_arrays に今のモデル・設定で作った表があればそれを使い、なければ作る）
+        use_table = USE_TABLE if use_table is None else use_table
+        self.table: Optional[RecommendationTable] = self._load_table(model_arrays) if use_table else None
+
+    @staticmethod
+    def _catalog_rows(song_catalog: SongCatalog) -> np.ndarray:
+        """全曲の行位置（フォールバック用の候補プール）。"""
+        rows = np.arange(len(song_catalog))
+        rows.setflags(write=False)
+        return rows
+
+    def export_arrays(self) -> Dict[str, np.ndarray]:
+        """スナップショットに同梱する配列（モデルの学習結果と、使っていれば事前計算表）。"""
+        arrays = self.model_store.export_arrays()
+        if self.table is not None:
+            arrays.update(self.table.export_arrays())
+        return arrays
+
+    def _load_table(self, model_arrays: Optional[Dict]) -> RecommendationTable:
+        """model_arrays の事前計算表（今のモデル・設定で作ったものに限る）。なければ作る。"""
+        years = table_years()
+        signature = table_signature(self.model_store, self.neighbor_count, years)
+        table = RecommendationTable.from_arrays(model_arrays or {}, signature)
+        if table is None:
+            table = self._build_table(years, signature)
+        return table
+
+    def _build_table(self, years: Dict[str, np.ndarray], signature: int) -> RecommendationTable:
+        """
+        全プロファイル（年代 × 年 × 性別グループ × ムード）の候補プールを求めて表にする。
+        候補プールはリクエスト時と同じ処理で求める（定番・最新は全プロファイル分を一括で近傍探索）。
+        曲がない年代は表に載せない（リクエスト時に全曲から選ぶ）。
+        """
+        era_generation = {era: generation for generation, era in GENERATION_TO_ERA.items()}
+        pools: Dict[str, List[CandidatePool]] = {}
+        for era, era_years in years.items():
+            model = self.model_store.get(era)
+            if model is None:
+                continue
+            keys = [
+                (gender, era, mood, year)
+                for year in era_years.tolist()
+                for gender in range(N_GENDERS)
+                for mood in range(N_MOODS)
+            ]
+            if era in CLUSTERED_ERAS:
+                pools[era] = self._clustered_pools(model, keys)
+            else:
+                pools[era] = [
+                    self._build_candidate_pool(era_generation[era], year, gender, mood)
+                    for gender, _, mood, year in keys
+                ]
+        return RecommendationTable.from_pools({era: years[era] for era in pools}, pools, signature)
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """キャッシュの統計（ヒット率・削除数など）。"""
+        return {
+            "candidatePool": self.pool_cache.stats(),
+            "ranking": self.ranking_cache.stats(),
+        }
     
-    def recommend_songs(self, members: List[Dict], settings: Dict) -> Dict:
+    def recommend_songs(
+        self, members: List[Dict], settings: Dict, rng: Optional[np.random.Generator] = None
+    ) -> Dict:
         """
         メンバーと設定に基づいて曲と歌う人を推薦
         
         Args:
             members: メンバーリスト [{"id": "1", "nickname": "太郎", "gender": "male", "age": 25}]
             settings: 設定 {"mood": "upbeat", "micCount": 2}
+            rng: このリクエストで使う乱数生成器（省略時は新しいストリーム）
             
         Returns:
             推薦結果 {"selectedSong": {...}, "selectedSingers": [...]}
         """
+        rng = rng or make_rng()
+        debug = self._debug_enabled(settings)
+        generation = settings.get("mood")
+
         # 1. 年を出力
-        year = self._determine_year(members, settings)
-        
+        with stage("determine_year"):
+            year = self._determine_year(members, settings, rng)
+
         # 2. 性別グループ番号を出力
-        gender = self._divide_gender(members)
+        with stage("divide_gender"):
+            gender = self._divide_gender(members)
 
         # 3. シチュエーションからムード番号を出力
-        mood = self._determine_mood(settings)
-        
-        # デバッグ用ログ
-        print(f"デバッグ情報:")
-        print(f"  メンバー: {[m.get('gender') for m in members]}")
-        print(f"  性別グループ: {gender} (0=男性, 1=混合, 2=女性)")
-        print(f"  年: {year}")
-        print(f"  ムード: {mood}")
-        print(f"  設定: {settings.get('mood')}")
-        
-        # データ分布確認
-        try:
+        with stage("determine_mood"):
+            mood = self._determine_mood(settings, rng)
+
+        # デバッグ用ログ（リクエストの settings.debug、またはサンプリングで有効化）
+        if debug:
+            print(f"デバッグ情報:")
+            print(f"  メンバー: {[m.get('gender') for m in members]}")
+            print(f"  性別グループ: {gender} (0=男性, 1=混合, 2=女性)")
+            print(f"  年: {year}")
+            print(f"  ムード: {mood}")
+            print(f"  設定: {generation}")
+
+            # データ分布確認
             print(f"データ分布:")
-            print(f"  全曲数: {len(df)}")
-            print(f"  昭和歌謡: {len(showa_group)}")
-            print(f"  定番曲: {len(classic_group)}")
-            print(f"  最新曲: {len(latest_group)}")
-            if not showa_group.empty:
-                print(f"  昭和歌謡性別分布: {showa_group['gender'].value_counts().to_dict()}")
-            if not classic_group.empty:
-                print(f"  定番曲性別分布: {classic_group['gender'].value_counts().to_dict()}")
-            if not latest_group.empty:
-                print(f"  最新曲性別分布: {latest_group['gender'].value_counts().to_dict()}")
-        except Exception as e:
-            print(f"データ分布確認エラー: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        
-        # 4. 
+            print(f"  全曲数: {len(self.song_catalog)}")
+            print(f"  昭和歌謡: {len(self.model_store.groups['showa'])}")
+            print(f"  定番曲: {len(self.model_store.groups['classic'])}")
+            print(f"  最新曲: {len(self.model_store.groups['latest'])}")
 
-        # ===== 1. データ読み込み =====
-        df = self.song_catalog
+        # 4. 候補プール（キャッシュ）から曲を選択
+        pool = self._candidate_pool(generation, year, gender, mood, debug=debug)
+        with stage("sampling"):
+            selected_song = self._draw(pool, rng)
 
-        # ===== 2. 年代グループ分け =====
-        showa_group = df[df["year"] < 1990].copy()                   # 昭和歌謡
-        classic_group = df[(df["year"] >= 1990) & (df["year"] <= 2022)].copy()  # 定番
-        latest_group = df[df["year"] >= 2023].copy()                # 最新曲
-        
-        # 昭和歌謡にも性別エンコーディングを追加
-        if not showa_group.empty:
-            le_gender_showa = LabelEncoder()
-            showa_group["gender_enc"] = le_gender_showa.fit_transform(showa_group["gender"])
-            print(f"  昭和歌謡性別エンコーディング: {dict(zip(le_gender_showa.classes_, le_gender_showa.transform(le_gender_showa.classes_)))}")
-
-
-        def _cluster(df_group):
-            if df_group.empty:
-                return None, None, None, None, None
-
-            # カテゴリ数値化
-            le_gender = LabelEncoder()
-            le_mood = LabelEncoder()
-            df_group["gender_enc"] = le_gender.fit_transform(df_group["gender"])
-            df_group["mood_enc"] = le_mood.fit_transform(df_group["mood_tags"])
-            
-            # デバッグ: エンコーディング値を表示
-            print(f"    性別エンコーディング: {dict(zip(le_gender.classes_, le_gender.transform(le_gender.classes_)))}")
-            print(f"    ムードエンコーディング: {dict(zip(le_mood.classes_, le_mood.transform(le_mood.classes_)))}")
-            
-            # 年代を0-1スケーリング
-            df_group["year_scaled"] = (df_group["year"] - df_group["year"].min()) / (df_group["year"].max() - df_group["year"].min() + 1e-6)
-            
-            # 特徴量行列と標準化
-            X = df_group[["gender_enc", "mood_enc", "year_scaled"]]
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            
-            # KMeansクラスタリング
-            k = min(8, len(df_group))
-            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-            df_group["cluster_id"] = kmeans.fit_predict(X_scaled)
- 
-            
-            return df_group, le_gender, le_mood, scaler, kmeans
-
-        # ===== 8. 性別重み付きで曲を選択 =====
-        def pick_gender_weighted_song(clustered_df, custom_song, kmeans_model, target_gender):
-            """
-            性別を重視した曲選択
-            target_gender: 0=男性, 1=混合, 2=女性
-            """
-            custom_vec = np.array([custom_song["gender_enc"], custom_song["mood_enc"], custom_song["year_scaled"]])
-            centers = kmeans_model.cluster_centers_
-            
-            # 各クラスタのスコアを計算（性別重み付き）
-            cluster_scores = []
-            print(f"    クラスタ分析 (目標性別: {target_gender}):")
-            for i, center in enumerate(centers):
-                # 基本距離
-                base_distance = np.linalg.norm(center - custom_vec)
-                
-                # 性別マッチングボーナス
-                gender_bonus = 0
-                cluster_songs = clustered_df[clustered_df["cluster_id"] == i]
-                if not cluster_songs.empty:
-                    # クラスタ内の性別分布を確認
-                    gender_dist = cluster_songs["gender_enc"].value_counts(normalize=True)
-                    gender_counts = cluster_songs["gender_enc"].value_counts()
-                    
-                    if target_gender == 0:  # 男性希望
-                        gender_bonus = gender_dist.get(0, 0) * 2.0  # 男性曲が多いほど高スコア
-                    elif target_gender == 2:  # 女性希望
-                        gender_bonus = gender_dist.get(2, 0) * 2.0  # 女性曲が多いほど高スコア
-                    else:  # 混合
-                        gender_bonus = gender_dist.get(1, 0) * 1.5  # 混合曲が多いほど高スコア
-                    
-                    print(f"      クラスタ{i}: 性別分布={gender_counts.to_dict()}, ボーナス={gender_bonus:.2f}")
-                
-                # スコア = 距離の逆数 + 性別ボーナス
-                score = 1.0 / (base_distance + 0.1) + gender_bonus
-                cluster_scores.append(score)
-            
-            # 最高スコアのクラスタを選択
-            best_cluster_id = np.argmax(cluster_scores)
-            cluster_songs = clustered_df[clustered_df["cluster_id"] == best_cluster_id]
-            
-            # さらに性別でフィルタリング
-            if target_gender in [0, 2]:  # 男性または女性を希望
-                gender_filtered = cluster_songs[cluster_songs["gender_enc"] == target_gender]
-                if not gender_filtered.empty:
-                    cluster_songs = gender_filtered
-            
-            return cluster_songs.sample(1) if not cluster_songs.empty else None
-        
+        # 5. 歌う人を選択
+        with stage("select_singers"):
+            mic_count = settings.get("micCount", 1)
+            selected_singers = self._select_singers(members, mic_count, rng)
 
-        # ===== 7. 任意の赤星曲を設定 =====
-        # 年スケーリングを各グループに応じて動的に計算
-        def get_year_scaled(target_year, df_group):
-            if df_group.empty:
-                return 0.5  # デフォルト値
-            year_min = df_group["year"].min()
-            year_max = df_group["year"].max()
-            return (target_year - year_min) / (year_max - year_min + 1e-6)
-        
-        custom_param = {
-            "gender_enc": gender,   # 男性=0, 混合=1, 女性=2
-            "mood_enc": mood,     # しっとり=0, リラックス=1, 元気=2, 盛り上がる=3
-            "year_scaled": get_year_scaled(year, classic_group)  # 動的に計算
+        RECOMMENDATIONS.inc(era=GENERATION_TO_ERA.get(generation, "all"))
+
+        # 6. 結果を整形
+        if debug and selected_song is not None:
+            # デバッグ: 選ばれた曲の性別を確認
+            print(f"  選ばれた曲の性別: {self.song_catalog.song(selected_song).gender}")
+        return self._format_result(selected_song, selected_singers)
+
+    def recommend_batch(self, requests: List[Dict], seed: Optional[int] = None) -> List[Dict]:
+        """
+        複数グループの推薦をまとめて行う。
+        クラスタを使う年代（定番・最新）は、全リクエストの近傍探索
+        （クラスタ単位なら (リクエスト数 × クラスタ数) の重心距離行列）を一括で行う。
+
+        Args:
+            requests: [{"members": [...], "settings": {...}, "seed": 任意}, ...]
+                （要素の seed が同じなら recommend_songs と同じ結果）
+            seed: 要素に seed がない場合に、要素ごとの独立したストリームを作る元のシード
+
+        Returns:
+            入力と同じ順序の結果リスト。失敗した要素は {"error": "..."}
+        """
+        streams = np.random.SeedSequence(new_seed() if seed is None else seed).spawn(len(requests))
+        rngs: List[Optional[np.random.Generator]] = [None] * len(requests)
+        results: List[Optional[Dict]] = [None] * len(requests)
+        songs: List[Optional[int]] = [None] * len(requests)
+        singers: List[List[Dict]] = [[] for _ in requests]
+        eras: List[str] = ["all"] * len(requests)
+
+        def draw(i: int, pool: CandidatePool) -> None:
+            # recommend_songs と同じ順（曲 → 歌う人）に乱数を使う（同じ seed なら同じ結果）
+            payload = requests[i]
+            songs[i] = self._draw(pool, rngs[i])
+            singers[i] = self._select_singers(
+                payload["members"], (payload.get("settings") or {}).get("micCount", 1), rngs[i]
+            )
+
+        # 1. 各リクエストのプロファイルを求める。キャッシュにない
+        #    クラスタ年代のリクエストは年代ごとにまとめる
+        pending: Dict[str, List[Tuple[int, Tuple]]] = {}
+        for i, payload in enumerate(requests):
+            try:
+                if not isinstance(payload, dict):
+                    raise ValueError("Invalid request")
+                members = payload.get("members") or []
+                settings = payload.get("settings") or {}
+                if not members:
+                    raise ValueError("Members are required")
+                item_seed = parse_seed(payload.get("seed"))
+                rng = rngs[i] = np.random.default_rng(streams[i] if item_seed is None else item_seed)
+
+                year = self._determine_year(members, settings, rng)
+                gender = self._divide_gender(members)
+                mood = self._determine_mood(settings, rng)
+
+                generation = settings.get("mood")
+                era = GENERATION_TO_ERA.get(generation)
+                eras[i] = era or "all"
+                key = self._profile_key(generation, year, gender, mood)
+                pool = self._table_pool(era, year, gender, mood)
+                if pool is None:
+                    pool = self.pool_cache.get(key)
+                if pool is not None:
+                    draw(i, pool)
+                elif era in CLUSTERED_ERAS and self.model_store.get(era) is not None:
+                    pending.setdefault(era, []).append((i, key))
+                else:
+                    draw(i, self._candidate_pool(generation, year, gender, mood))
+            except Exception as e:
+                results[i] = {"error": str(e)}
+
+        # 2. 年代ごとに全リクエスト分の候補を一括で求める
+        for era, items in pending.items():
+            pools = self._clustered_pools(self.model_store.get(era), [key for _, key in items])
+            for (i, key), pool in zip(items, pools):
+                self.pool_cache.put(key, pool)
+                try:
+                    draw(i, pool)
+                except Exception as e:
+                    results[i] = {"error": str(e)}
+
+        # 3. 結果を整形
+        for i in range(len(requests)):
+            if results[i] is None:
+                results[i] = self._format_result(songs[i], singers[i])
+                RECOMMENDATIONS.inc(era=eras[i])
+        return results
+
+    def recommend_ranking(
+        self,
+        members: Optional[List[Dict]] = None,
+        settings: Optional[Dict] = None,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> Dict:
+        """
+        スコア順の上位曲をページ単位で返す。
+        cursor を渡すと、前回計算したランキングの続きを再計算なしで返す
+        （「別の曲」ボタンは cursor と limit=1 で呼ぶ）。
+        rng はこのリクエストで使う乱数生成器（省略時は新しいストリーム）。
+
+        Returns:
+            {"songs": [{..., "score": float}, ...], "selectedSingers": [...], "nextCursor": str | None}
+        """
+        rng = rng or make_rng()
+        if cursor:
+            token, _, offset_str = cursor.rpartition(":")
+            ranking = self.ranking_cache.get(token)
+            if ranking is None or not offset_str.isdigit():
+                raise RankingCursorError(f"unknown or expired cursor: {cursor}")
+            offset = int(offset_str)
+        else:
+            if not members:
+                raise ValueError("Members are required")
+            settings = settings or {}
+            year = self._determine_year(members, settings, rng)
+            gender = self._divide_gender(members)
+            mood = self._determine_mood(settings, rng)
+            ranking = _Ranking(
+                songs=self._rank_songs(settings.get("mood"), year, gender, mood, rng),
+                members=members,
+                mic_count=settings.get("micCount", 1),
+            )
+            token = uuid.uuid4().hex
+            self.ranking_cache.put(token, ranking)
+            offset = 0
+
+        end = offset + max(1, limit)
+        return {
+            "songs": ranking.songs[offset:end],
+            "selectedSingers": self._select_singers(ranking.members, ranking.mic_count, rng),
+            "nextCursor": f"{token}:{end}" if end < len(ranking.songs) else None,
         }
 
-        # ===== 3. 昭和歌謡はランダムに1曲選択 =====
-        generation = settings.get("mood")
-        selected_song = None
-        
-        if generation == "演歌・昭和歌謡":
-            if not showa_group.empty:
-                # 昭和歌謡でも性別フィルタリング
+    # ---- セッション（services.session）用 ----
+    def session_profile(self, members: List[Dict], settings: Dict, rng: np.random.Generator) -> Tuple:
+        """
+        候補プールを決めるプロファイル (年代設定, 年, 性別グループ, ムード)。
+        年・ムードは設定によって乱数で決まるので、呼ぶたびに変わることがある。
+        """
+        return (
+            settings.get("mood"),
+            self._determine_year(members, settings, rng),
+            self._divide_gender(members),
+            self._determine_mood(settings, rng),
+        )
+
+    def candidate_rows(self, profile: Tuple) -> np.ndarray:
+        """プロファイルの候補（カタログ上の行位置。書き込み不可）。候補プールのキャッシュを使う。"""
+        return self._candidate_pool(*profile)
+
+    def song_at(self, row: int) -> Dict:
+        """カタログ上の行位置の曲（selectedSong の形式）。"""
+        return self._song_dicts([row])[0]
+
+    def _rank_songs(
+        self, generation: Optional[str], year: float, gender: int, mood: int, rng: np.random.Generator
+    ) -> List[Dict]:
+        """
+        上位 RANKING_SIZE 曲をスコア順に返す。
+        定番・最新はクラスタをまたいで曲ごとのスコアで順位付けし、
+        昭和歌謡・その他はランダム順（昭和は希望の性別の曲を先に）。
+        """
+        era = GENERATION_TO_ERA.get(generation)
+        model = self.model_store.get(era) if era else None
+
+        if era in CLUSTERED_ERAS and model is not None:
+            custom_vec = model.query_vector(gender, mood, year)
+            scores = model.score_songs(custom_vec, gender)
+            k = min(RANKING_SIZE, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return self._song_dicts(model.catalog_rows[top].tolist(), scores[top])
+
+        if era == "showa" and model is not None:
+            if gender in (0, 2):
+                # 希望の性別の曲を先に、残りは他の性別の曲からランダム
+                preferred = self._sample_rows([model.gender_rows[gender]], RANKING_SIZE, rng)
+                others = [rows for g, rows in enumerate(model.gender_rows) if g != gender]
+                rows = preferred + self._sample_rows(others, RANKING_SIZE - len(preferred), rng)
+            else:
+                rows = self._sample_rows([model.catalog_rows], RANKING_SIZE, rng)
+            return self._song_dicts(rows)
+
+        # デフォルト: 全曲からランダム
+        return self._song_dicts(self._sample_rows([self.all_rows], RANKING_SIZE, rng))
+
+    @staticmethod
+    def _sample_rows(parts: List[np.ndarray], k: int, rng: np.random.Generator) -> List[int]:
+        """
+        行位置配列（複数なら連結したものとみなす）から重複なしで最大 k 件をランダムに選ぶ。
+        配列の連結・シャッフルはしないので、コストは k に比例する。
+        """
+        total = sum(len(part) for part in parts)
+        picked = []
+        for i in rng.choice(total, size=min(max(k, 0), total), replace=False).tolist():
+            for part in parts:
+                if i < len(part):
+                    picked.append(int(part[i]))
+                    break
+                i -= len(part)
+        return picked
+
+    def _song_dicts(self, rows: List[int], scores: Optional[np.ndarray] = None) -> List[Dict]:
+        """カタログ上の行位置の曲を selectedSong の形式にする（列から直接組み立てる）。"""
+        catalog = self.song_catalog
+        strings = catalog.strings
+        title, artist, year, genre = (catalog.column(name) for name in ("title", "artist", "year", "genre"))
+        songs = [
+            {
+                "title": strings[title[row]],
+                "artist": strings[artist[row]],
+                "year": int(year[row]),
+                "genre": strings[genre[row]],
+            }
+            for row in rows
+        ]
+        if scores is not None:
+            for song, score in zip(songs, scores):
+                song["score"] = round(float(score), 4)
+        return songs
+
+    def _debug_enabled(self, settings: Dict) -> bool:
+        """
+        デバッグ出力の有無。settings.debug で明示するか、debug_sample_rate の確率で有効。
+        推薦結果に影響しないので、リクエストの乱数生成器ではなく random を使う
+        （サンプリング率を変えても同じシードなら同じ結果になる）。
+        """
+        if settings.get("debug"):
+            return True
+        return self.debug_sample_rate > 0 and random.random() < self.debug_sample_rate
+
+    def _profile_key(self, generation: Optional[str], year: float, gender: int, mood: int) -> Tuple:
+        """
+        候補プールを決める正規化済みプロファイル（キャッシュキー、(性別, 年代, ムード, 年) の形）。
+        プールが依存する値だけを残し、同じプールになるプロファイルは同じキーにする:
+        ・定番・最新: すべて / 昭和歌謡: 性別だけ（年・ムードは None）
+        ・年代指定なし・モデルのない年代: 全曲なので何も残さない
+        """
+        era = GENERATION_TO_ERA.get(generation)
+        if self.model_store.get(era) is None:
+            return (None, None, None, None)
+        if era in CLUSTERED_ERAS:
+            return (gender, era, mood, year)
+        return (gender, era, None, None)
+
+    def _table_pool(self, era: Optional[str], year: float, gender: int, mood: int) -> Optional[CandidatePool]:
+        """事前計算表の候補プール（表を使わない・表にないプロファイルなら None）。"""
+        if self.table is None:
+            return None
+        return self.table.lookup(era, year, gender, mood)
+
+    def _candidate_pool(
+        self, generation: Optional[str], year: float, gender: int, mood: int, debug: bool = False
+    ) -> CandidatePool:
+        """
+        年代設定・年・性別グループ・ムードから候補プール（カタログ上の行位置配列）を返す。
+        事前計算表にあるプロファイルは表引きだけで返す。
+        それ以外は同じプロファイルの結果をキャッシュし、フィルタ・スコア計算を省略する。
+        """
+        if self.table is not None:
+            with stage("table_lookup"):
+                pool = self.table.lookup(GENERATION_TO_ERA.get(generation), year, gender, mood)
+            if pool is not None:
+                return pool
+        key = self._profile_key(generation, year, gender, mood)
+        with stage("pool_cache_lookup"):
+            pool = self.pool_cache.get(key)
+        if pool is None:
+            pool = self._build_candidate_pool(generation, year, gender, mood, debug=debug)
+            self.pool_cache.put(key, pool)
+        return pool
+
+    def _build_candidate_pool(
+        self, generation: Optional[str], year: float, gender: int, mood: int, debug: bool = False
+    ) -> CandidatePool:
+        with stage("era_split"):
+            era = GENERATION_TO_ERA.get(generation)
+            model = self.model_store.get(era) if era else None
+
+        # ===== 昭和歌謡はランダムに1曲選択 =====
+        if era == "showa" and model is not None:
+            # 昭和歌謡でも性別フィルタリング
+            with stage("gender_filter"):
                 if gender in [0, 2]:  # 男性または女性を希望
-                    gender_filtered = showa_group[showa_group["gender_enc"] == gender]
-                    if not gender_filtered.empty:
-                        selected_song = gender_filtered.sample(1)
-                    else:
-                        selected_song = showa_group.sample(1)
-                else:
-                    selected_song = showa_group.sample(1)
+                    rows = model.gender_rows[gender]
+                    if len(rows):
+                        return rows
+                return model.catalog_rows
+
+        # ===== 定番・最新は赤星曲に近い曲（またはクラスタ）から性別で絞って選択 =====
+        if era in CLUSTERED_ERAS and model is not None:
+            # 任意の赤星曲（年スケーリングはグループの学習時の年範囲で計算）
+            custom_vec = model.query_vector(gender, mood, year)
+            if self.neighbor_count > 0:
+                # 曲単位の近傍探索（クラスタの境界をまたいで近い曲も候補にする）
+                with stage("neighbor_search"):
+                    rows = model.nearest_rows(custom_vec, gender, self.neighbor_count)
+                if debug:
+                    print(f"    近傍曲 (目標性別: {gender}): {len(rows)} 曲")
             else:
-                # フォールバック: 全曲からランダム選択
-                selected_song = df.sample(1)
-
-        elif generation == "定番曲・懐メロ":
-            # 定番グループ用の年スケーリング
-            custom_param["year_scaled"] = get_year_scaled(year, classic_group)
-            classic_clustered, classic_le_gender, classic_le_mood, classic_scaler, classic_kmeans = _cluster(classic_group)
-            if classic_clustered is not None:
-                selected_song = pick_gender_weighted_song(classic_clustered, custom_param, classic_kmeans, gender)
-            if selected_song is None:
-                selected_song = df.sample(1)
+                with stage("cluster_scoring"):
+                    cluster_scores = model.score_clusters(custom_vec, gender)
+                    rows = model.candidate_rows(int(np.argmax(cluster_scores)), gender)
+                if debug:
+                    print(f"    クラスタスコア (目標性別: {gender}): {np.round(cluster_scores, 2).tolist()}")
+            if len(rows):
+                return rows
 
-        elif generation == "最新ヒット":
-            # 最新グループ用の年スケーリング
-            custom_param["year_scaled"] = get_year_scaled(year, latest_group)
-            latest_clustered, latest_le_gender, latest_le_mood, latest_scaler, latest_kmeans = _cluster(latest_group)
-            if latest_clustered is not None:
-                selected_song = pick_gender_weighted_song(latest_clustered, custom_param, latest_kmeans, gender)
-            if selected_song is None:
-                selected_song = df.sample(1)
+        # デフォルト / フォールバック: 全曲からランダム選択
+        return self.all_rows
+
+    def _clustered_pools(self, model: ClusterModel, keys: List[Tuple]) -> List[CandidatePool]:
+        """
+        クラスタを使う年代（定番・最新）の候補プールをまとめて求める（キーは _profile_key の形式）。
+        近傍探索（クラスタ単位なら (キー数 × クラスタ数) の重心距離行列）を1回で行う。
+        """
+        custom_vecs = np.array([model.query_vector(g, m, y) for g, _, m, y in keys])
+        target_genders = np.array([key[0] for key in keys])
+        if self.neighbor_count > 0:
+            with stage("batch_neighbor_search"):
+                candidates = model.neighbors.nearest_rows_batch(custom_vecs, target_genders, self.neighbor_count)
         else:
-            # デフォルト: 全曲からランダム選択
-            selected_song = df.sample(1)
-        
-        # 7. 歌う人を選択
-        mic_count = settings.get("micCount", 1)
-        selected_singers = self._select_singers(members, mic_count)
-        
-        # 8. 結果を整形
-        if selected_song is not None and not selected_song.empty:
-            # デバッグ: 選ばれた曲の性別を確認
-            selected_gender = selected_song.iloc[0]["gender"]
-            print(f"  選ばれた曲の性別: {selected_gender}")
-            
+            with stage("batch_cluster_scoring"):
+                best_clusters = np.argmax(model.score_clusters_batch(custom_vecs, target_genders), axis=1)
+            candidates = [
+                model.candidate_rows(int(cluster_id), key[0])
+                for key, cluster_id in zip(keys, best_clusters)
+            ]
+        return [rows if len(rows) else self.all_rows for rows in candidates]
+
+    @staticmethod
+    def _draw(pool: CandidatePool, rng: np.random.Generator) -> Optional[int]:
+        """候補プールから1曲をランダムに選ぶ（カタログ上の行位置）。"""
+        if len(pool) == 0:
+            return None
+        return int(pool[rng.integers(len(pool))])
+
+    def _format_result(self, selected_song: Optional[int], selected_singers: List[Dict]) -> Dict:
+        if selected_song is not None:
             return {
-                "selectedSong": {
-                    "title": selected_song.iloc[0]["title"],
-                    "artist": selected_song.iloc[0]["artist"],
-                    "year": int(selected_song.iloc[0]["year"]),
-                    "genre": selected_song.iloc[0]["genre"]
-                },
+                "selectedSong": self.song_at(selected_song),
                 "selectedSingers": selected_singers
             }
         else:
@@ -246,35 +618,6 @@ class RecommendationService:
             }
 
 
-
-    def _cluster(df_group, group_name):
-            if df_group.empty:
-                print(f"{group_name} に曲がありません。")
-                return None, None, None, None, None
-
-            # カテゴリ数値化
-            le_gender = LabelEncoder()
-            le_mood = LabelEncoder()
-            df_group["gender_enc"] = le_gender.fit_transform(df_group["gender"])
-            df_group["mood_enc"] = le_mood.fit_transform(df_group["mood_tags"])
-            
-            # 年代を0-1スケーリング
-            df_group["year_scaled"] = (df_group["year"] - df_group["year"].min()) / (df_group["year"].max() - df_group["year"].min() + 1e-6)
-            
-            # 特徴量行列と標準化
-            X = df_group[["gender_enc", "mood_enc", "year_scaled"]]
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            
-            # KMeansクラスタリング
-            k = min(8, len(df_group))
-            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-            df_group["cluster_id"] = kmeans.fit_predict(X_scaled)
- 
-            
-            return df_group, le_gender, le_mood, scaler, kmeans
-
-
     def _divide_gender(self, members: List[Dict]) -> int:
         """
         メンバーの性別からグループの性別構成を判定して返す。
@@ -306,7 +649,7 @@ class RecommendationService:
 
 
 
-    def _determine_year(self, members: List[Dict], settings: Dict) -> int:
+    def _determine_year(self, members: List[Dict], settings: Dict, rng: np.random.Generator) -> int:
         """
         メンバーの平均年齢から年代を決定
         """
@@ -314,16 +657,16 @@ class RecommendationService:
         # 平均年齢から
         generation = settings.get("mood")
         if generation == "演歌・昭和歌謡": 
-            candidate_year = random.randint(1980, 1989)
+            candidate_year = int(rng.integers(*SHOWA_YEARS, endpoint=True))
             return candidate_year
         
         elif generation == "定番曲・懐メロ": 
             avg_age = sum(member.get("age", 25) for member in members) / len(members)
-            candidate_year = 2025 - avg_age + 20 # +20は二十歳想定
+            candidate_year = classic_year(avg_age)
             return candidate_year 
         
         elif generation == "最新ヒット":
-            candidate_year = random.randint(2023, 2024)
+            candidate_year = int(rng.integers(*LATEST_YEARS, endpoint=True))
             return candidate_year
         
         # デフォルト値
@@ -331,30 +674,30 @@ class RecommendationService:
 
 
 
-    def _determine_mood(self, settings: Dict) -> int:
+    def _determine_mood(self, settings: Dict, rng: np.random.Generator) -> int:
         situation = settings.get("situation")
 
         if situation == "友人と" or situation == "会社の人と":
             l = [2,3]
-            candidate_mood = random.choice(l)
+            candidate_mood = l[rng.integers(len(l))]
             return candidate_mood
         
         elif situation == "恋人と":
             l = [0,1]
-            candidate_mood = random.choice(l)
+            candidate_mood = l[rng.integers(len(l))]
             return candidate_mood
         
         elif situation == "家族と":
             l = [0,1,2,3]
-            candidate_mood = random.choice(l)
+            candidate_mood = l[rng.integers(len(l))]
             return candidate_mood
         
         # デフォルト値
-        return random.choice([0,1,2,3])
+        return int(rng.integers(4))
 
     
     
-    def _select_singers(self, members: List[Dict], mic_count: int) -> List[Dict]:
+    def _select_singers(self, members: List[Dict], mic_count: int, rng: np.random.Generator) -> List[Dict]:
         """
         歌う人をランダムに選択
         元のJavaScriptロジックを移植
@@ -363,8 +706,7 @@ class RecommendationService:
             return []
         
         # メンバーをシャッフル
-        shuffled_members = members.copy()
-        random.shuffle(shuffled_members)
+        shuffled_members = [members[i] for i in rng.permutation(len(members))]
         
         # micCount分だけ選択
         return shuffled_members[:mic_count]
\ No newline at end of file
@@ -0,0 +1,142 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional
+import hashlib
+import numpy as np
+
+
+# ========= 推薦の事前計算表 =========
+#
+# 候補プールはプロファイル (年代, 年, 性別グループ, ムード) だけで決まり、その組み合わせは有限
+# （定番曲・懐メロの年は平均年齢から求まるので、想定する人数・年齢で取りうる値を列挙する）。
+# 全組み合わせの候補プールをオフラインで求めて1つの表にし、スナップショットに同梱する。
+# リクエスト時は表引き（配列のスライス）と、プールからの抽選だけになる。
+# 年は丸めずに完全一致で引くので、表にあるプロファイルの結果は表を使わない場合と同じ
+# （表にない年は呼び出し側が従来どおり計算する）。読み込み・表引きは NumPy だけで動く。
+
+# 性別グループ（0=男性, 1=混合, 2=女性）・ムード（0〜3）の数
+N_GENDERS = 3
+N_MOODS = 4
+
+# 表の形式（変えたら上げる。スナップショットの古い表は作り直す）
+TABLE_FORMAT = 2
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+@dataclass(frozen=True)
+class RecommendationTable:
+    """
+    全プロファイルの候補プールを事前計算した表。配列はすべて書き込み不可。
+    ・years: 年代 → 列挙した年 (float64, 昇順)
+    ・slots: 年代 → (年の番号, 性別, ムード) ごとの rows 上の [start, stop) (年の数, 3, 4, 2)
+    ・rows: 候補プールを連結したカタログ上の行位置 (int32)。同じ内容のプールは1回だけ格納する
+      （昭和歌謡は年・ムードによらないので、性別ごとのプールを全スロットで共有する）
+    ・signature: 表を作ったモデル・設定のハッシュ（table_signature。一致しなければ作り直す）
+    候補プールの曲は等確率で抽選するので、重みは持たない。
+    """
+    years: Dict[str, np.ndarray]
+    slots: Dict[str, np.ndarray]
+    rows: np.ndarray
+    signature: int
+    # 年代 → 年 → 年の番号（years から作る）
+    _positions: Dict[str, Dict[float, int]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        positions = {era: {year: i for i, year in enumerate(years.tolist())} for era, years in self.years.items()}
+        object.__setattr__(self, "_positions", positions)
+
+    @classmethod
+    def from_pools(
+        cls, years: Dict[str, np.ndarray], pools: Dict[str, List[np.ndarray]], signature: int
+    ) -> "RecommendationTable":
+        """pools[era] は (年, 性別, ムード) の順（ムードが最も内側）に並べた候補プール。"""
+        parts: List[np.ndarray] = []
+        offsets: Dict[bytes, int] = {}
+        size = 0
+        slots = {}
+        for era, era_pools in pools.items():
+            slot = np.empty((len(era_pools), 2), dtype=np.int64)
+            for i, pool in enumerate(era_pools):
+                rows = np.asarray(pool, dtype=np.int32)
+                key = rows.tobytes()
+                if key not in offsets:
+                    offsets[key] = size
+                    parts.append(rows)
+                    size += len(rows)
+                slot[i] = (offsets[key], offsets[key] + len(rows))
+            slots[era] = _frozen(slot.reshape(len(years[era]), N_GENDERS, N_MOODS, 2))
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+        return cls(
+            years={era: _frozen(np.asarray(years[era], dtype=np.float64)) for era in pools},
+            slots=slots,
+            rows=_frozen(rows),
+            signature=signature,
+        )
+
+    @property
+    def entries(self) -> int:
+        """スロット数（列挙したプロファイルの数）。"""
+        return sum(len(years) * N_GENDERS * N_MOODS for years in self.years.values())
+
+    def lookup(self, era: Optional[str], year: float, gender: int, mood: int) -> Optional[np.ndarray]:
+        """プロファイルの候補プール（rows のビュー）。表にない年代・年（完全一致で引く）なら None。"""
+        positions = self._positions.get(era)
+        if positions is None or not (0 <= gender < N_GENDERS and 0 <= mood < N_MOODS):
+            return None
+        i = positions.get(year)
+        if i is None:
+            return None
+        start, stop = self.slots[era][i, gender, mood]
+        return self.rows[start:stop]
+
+    def export_arrays(self) -> Dict[str, np.ndarray]:
+        """スナップショットに同梱する配列。"""
+        arrays = {
+            "table.rows": np.ascontiguousarray(self.rows),
+            "table.signature": np.array([self.signature], dtype=np.uint64),
+        }
+        for era, years in self.years.items():
+            arrays[f"table.{era}.years"] = np.ascontiguousarray(years)
+            arrays[f"table.{era}.slots"] = np.ascontiguousarray(self.slots[era].reshape(-1))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, object], signature: int) -> Optional["RecommendationTable"]:
+        """
+        export_arrays の出力（スナップショットの mmap 上のビュー）から、コピーせずに復元する。
+        表がない、または signature が一致しなければ None。
+        """
+        stored = arrays.get("table.signature")
+        if stored is None or int(np.asarray(stored)[0]) != signature:
+            return None
+        years = {}
+        slots = {}
+        for name, values in arrays.items():
+            if not (name.startswith("table.") and name.endswith(".years")):
+                continue
+            era = name[len("table."):-len(".years")]
+            years[era] = np.asarray(values)
+            slots[era] = np.asarray(arrays[f"table.{era}.slots"]).reshape(len(years[era]), N_GENDERS, N_MOODS, 2)
+        return cls(years=years, slots=slots, rows=np.asarray(arrays["table.rows"]), signature=signature)
+
+
+def table_signature(model_store, neighbor_count: int, years: Dict[str, np.ndarray]) -> int:
+    """
+    表の内容を決めるもののハッシュ: カタログの内容・各年代のモデル（重心・クラスタ割り当て）・
+    近傍曲数・列挙した年。スナップショットの表がこれと一致するときだけ使う。
+    """
+    h = hashlib.blake2b(digest_size=8)
+    config = (TABLE_FORMAT, model_store.fingerprint, model_store.feature_set, neighbor_count)
+    h.update(repr(config).encode("utf-8"))
+    for era in sorted(years):
+        h.update(era.encode("utf-8"))
+        h.update(np.ascontiguousarray(years[era], dtype=np.float64).tobytes())
+    for era, model in model_store.models.items():
+        h.update(era.encode("utf-8"))
+        if model is not None:
+            h.update(np.ascontiguousarray(model.centers, dtype=np.float64).tobytes())
+            h.update(np.ascontiguousarray(model.labels, dtype=np.int32).tobytes())
+    return int.from_bytes(h.digest(), "little")
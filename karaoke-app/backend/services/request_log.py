@@ -0,0 +1,31 @@
+from pathlib import Path
+from typing import Dict, Iterator
+import json
+import threading
+
+
+# ========= リクエストログ =========
+#
+# 推薦 API のリクエスト（seed を確定させたもの）・レスポンス・所要時間を JSON Lines で追記する。
+# benchmarks/replay.py で同じ順に再実行すると、同じカタログなら同じレスポンスになり、
+# 所要時間を記録時と比較できる。
+# 1行ずつ追記モードで書くので、pre-fork の複数ワーカーが同じファイルに書いてもよい。
+
+
+class RequestLog:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+
+    @staticmethod
+    def read(path: Path | str) -> Iterator[Dict]:
+        with Path(path).open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
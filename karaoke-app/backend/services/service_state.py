@@ -0,0 +1,214 @@
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+from pathlib import Path
+import threading
+import time
+
+from models.snapshot import file_sha256
+from models.song import SongCatalog, normalization_cache_stats
+from services.catalog_loader import load_recommendation_service
+from services.recommendation import RecommendationService
+from services.session import SessionManager, SessionStore
+
+
+@dataclass(frozen=True)
+class ServiceVersion:
+    """
+    ある時点のカタログと学習済みサービスの組（不変）。
+    リクエストは開始時に1つ取得して最後まで使うので、
+    途中で再読み込みが起きても古い版のまま完了する。
+    """
+    version: int
+    song_catalog: SongCatalog
+    recommendation_service: RecommendationService
+    source_sha256: str
+    load_seconds: float
+    loaded_at: float
+
+
+class ServiceState:
+    """
+    カタログと推薦サービスの保持・ウォームアップ・再読み込み。
+    warmup() はサーバがリクエストを受け付ける前（または pre-fork の親プロセス）で呼ぶ。
+    reload() は新しい版を裏で完全に構築してから参照を差し替える。
+    セッション（sessions）は版をまたいで保持する（session_store で保存先を差し替えられる）。
+    """
+
+    def __init__(
+        self,
+        csv_path: Path,
+        snapshot_path: Optional[Path] = None,
+        session_store: Optional[SessionStore] = None,
+    ):
+        self.csv_path = csv_path
+        self.snapshot_path = snapshot_path
+        self.sessions = SessionManager(session_store)
+        self.warmup_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reloading = False
+        self._current: Optional[ServiceVersion] = None
+        self._lock = threading.Lock()          # 参照の差し替え
+        self._build_lock = threading.Lock()    # 構築は同時に1つだけ
+        self._watcher: Optional[threading.Thread] = None
+
+    # ---- 参照 ----
+    @property
+    def current(self) -> Optional[ServiceVersion]:
+        return self._current
+
+    @property
+    def ready(self) -> bool:
+        return self._current is not None
+
+    @property
+    def song_catalog(self) -> Optional[SongCatalog]:
+        current = self._current
+        return current.song_catalog if current else None
+
+    @property
+    def recommendation_service(self) -> Optional[RecommendationService]:
+        current = self._current
+        return current.recommendation_service if current else None
+
+    # ---- 構築 ----
+    def _build(self) -> ServiceVersion:
+        start = time.perf_counter()
+        source_sha256 = file_sha256(self.csv_path)
+        current = self._current
+        # 前の版のモデルを差分更新に使う（曲の追加だけなら再学習しない）
+        song_catalog, service = load_recommendation_service(
+            self.csv_path,
+            self.snapshot_path,
+            previous=current.recommendation_service if current else None,
+        )
+        return ServiceVersion(
+            version=current.version + 1 if current else 1,
+            song_catalog=song_catalog,
+            recommendation_service=service,
+            source_sha256=source_sha256,
+            load_seconds=time.perf_counter() - start,
+            loaded_at=time.time(),
+        )
+
+    def _build_and_swap(self, force: bool) -> bool:
+        with self._build_lock:
+            current = self._current
+            try:
+                if not force and current is not None and current.source_sha256 == file_sha256(self.csv_path):
+                    return False  # 内容が変わっていない
+                new = self._build()
+            except Exception as e:
+                self.error = str(e)
+                print(f"初期化エラー: {e}")
+                import traceback
+                traceback.print_exc()
+                return False
+            with self._lock:
+                self._current = new
+                self.error = None
+            print(f"カタログ読み込み成功: {len(new.song_catalog)} 曲 (version {new.version})")
+            print(f"サービス初期化完了 ({new.load_seconds:.3f}s)")
+            for update in new.recommendation_service.model_store.update_report:
+                action = "再学習" if update.refit else "差分更新"
+                drift = f", drift={update.drift:.3f}" if update.drift is not None else ""
+                print(f"モデル{action} ({update.era}): 追加 {update.added} 曲, {update.reason}{drift}")
+            return True
+
+    def warmup(self) -> bool:
+        """
+        カタログ読み込みとモデル学習を行う。並行して呼ばれても初期化は1回だけ。
+        成功（または初期化済み）なら True。
+        """
+        if self.ready:
+            return True
+        start = time.perf_counter()
+        self._build_and_swap(force=False)
+        if self.ready and self.warmup_seconds is None:
+            self.warmup_seconds = time.perf_counter() - start
+        return self.ready
+
+    def reload(self, background: bool = True, force: bool = False) -> bool:
+        """
+        カタログを再読み込みする（ソースのハッシュが変わっていなければ何もしない。force で強制）。
+        background=True なら別スレッドで構築し、すぐに戻る。
+        既に再読み込み中なら False。
+        """
+        with self._lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+
+        def run():
+            try:
+                self._build_and_swap(force)
+            finally:
+                self.reloading = False
+
+        if background:
+            threading.Thread(target=run, name="catalog-reload", daemon=True).start()
+        else:
+            run()
+        return True
+
+    def start_watcher(self, interval: float = 30.0) -> None:
+        """
+        ソースCSVの更新（mtime / サイズ）を interval 秒ごとに確認し、
+        変わっていれば再読み込みするスレッドを起動する。
+        pre-fork 構成ではワーカーごとに起動する（スレッドは fork 先に引き継がれない）。
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def signature():
+            try:
+                stat = self.csv_path.stat()
+                return stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return None
+
+        def watch():
+            # 初回は必ず確認する（起動〜監視開始の間の更新も取りこぼさない。
+            # 内容が同じなら reload はハッシュ比較だけで終わる）
+            last = None
+            while True:
+                time.sleep(interval)
+                sig = signature()
+                if sig is not None and sig != last:
+                    if last is not None:
+                        print(f"カタログ更新を検知: {self.csv_path}")
+                    # 他の再読み込み（管理 API）の実行中で始められなければ、次の周期で確認し直す
+                    if self.reload(background=False):
+                        last = sig
+
+        self._watcher = threading.Thread(target=watch, name="catalog-watcher", daemon=True)
+        self._watcher.start()
+
+    def status(self) -> Dict:
+        """readiness エンドポイント用の状態。"""
+        current = self._current
+        return {
+            "ready": current is not None,
+            "warmupSeconds": self.warmup_seconds,
+            "songCount": len(current.song_catalog) if current else 0,
+            "version": current.version if current else None,
+            "loadedAt": current.loaded_at if current else None,
+            "reloading": self.reloading,
+            "error": self.error,
+            "models": self._model_status(current),
+            "caches": {
+                **(current.recommendation_service.cache_stats() if current else {}),
+                **normalization_cache_stats(),
+                "sessions": self.sessions.stats(),
+            },
+        }
+
+    @staticmethod
+    def _model_status(current: Optional[ServiceVersion]) -> Dict:
+        """直近の構築で学習したグループと、差分更新時の年代ごとの判断。"""
+        if current is None:
+            return {"builds": [], "updates": []}
+        model_store = current.recommendation_service.model_store
+        return {
+            "builds": [asdict(build) for build in model_store.build_report],
+            "updates": [asdict(update) for update in model_store.update_report],
+        }
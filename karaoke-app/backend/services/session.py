@@ -0,0 +1,226 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+import os
+import threading
+import uuid
+
+from services.cache import LRUCache
+from services.metrics import RECOMMENDATIONS, stage
+from services.recommendation import GENERATION_TO_ERA, RecommendationService, make_rng
+import numpy as np
+
+
+# ========= セッション =========
+#
+# 同じグループが一晩に何度も「次の曲」を求める用途向け。
+# 作成時にメンバー・設定とプロファイル（候補プールのキー）を保存し、
+# 以降は候補プールから再生済みの曲を除いて1曲引くだけにする（再計算しない）。
+# ・再生済みの曲: カタログの行位置のビット集合（カタログ 8 曲あたり 1 バイト）
+# ・歌う人: ローテーション用のキュー（全員が歌うまで同じ人を選ばない）
+# ・有効期限: 最後に使ってから SESSION_TTL 秒。上限 SESSION_MAX 件を超えたら古いものから削除
+#
+# 既定のストアはプロセス内なので、pre-fork 構成ではセッションを作ったワーカーでしか使えない
+# （そのため gunicorn.conf.py の既定は1ワーカー + スレッド）。
+# ワーカー間で共有するには get / put / delete / stats を持つ外部ストアを ServiceState に渡す
+# （Session は pickle できる。同じセッションへの同時リクエストの排他はプロセス内だけ）。
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", str(6 * 60 * 60)))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "10000"))
+
+# 候補プールから未再生の曲を引くときのランダム試行回数（超えたら未再生の曲を走査する）
+DRAW_ATTEMPTS = 8
+# 候補プールをすべて再生した場合に、プロファイル（年・ムード）を引き直す回数
+PROFILE_RETRIES = 3
+
+
+class SessionNotFoundError(Exception):
+    """セッションが存在しない、または期限切れ。"""
+
+
+@dataclass
+class Session:
+    """1グループ分のセッション状態。"""
+    session_id: str
+    members: List[Dict]
+    settings: Dict
+    profile: Tuple                    # RecommendationService.session_profile の結果
+    catalog_fingerprint: int          # played を作ったときのカタログ（変わったら履歴を作り直す）
+    played: bytearray                 # 再生済みの曲（カタログ上の行位置）のビット集合
+    singer_queue: Deque[int]          # 次に歌う人（members の添字）の順
+    rng: np.random.Generator          # セッション専用の乱数（作成時の seed が同じなら同じ順に選ぶ）
+    played_count: int = 0
+
+    def is_played(self, row: int) -> bool:
+        return bool(self.played[row >> 3] & (1 << (row & 7)))
+
+    def mark_played(self, row: int) -> None:
+        self.played[row >> 3] |= 1 << (row & 7)
+        self.played_count += 1
+
+    def unplayed(self, rows: np.ndarray) -> np.ndarray:
+        """rows のうち未再生のもの（候補の大半が再生済みになったときだけ使う）。"""
+        bits = np.unpackbits(np.frombuffer(bytes(self.played), dtype=np.uint8), bitorder="little")
+        return rows[bits[rows] == 0]
+
+
+def _empty_played(song_count: int) -> bytearray:
+    return bytearray((song_count + 7) // 8)
+
+
+class SessionStore:
+    """
+    プロセス内のセッションストア（LRU + TTL）。参照・保存のたびに期限を延ばす。
+    外部ストアに差し替える場合も同じメソッドを実装する。
+    """
+
+    def __init__(self, maxsize: int = SESSION_MAX, ttl: Optional[float] = SESSION_TTL):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        return self._cache.get(session_id)
+
+    def put(self, session: Session) -> None:
+        self._cache.put(session.session_id, session)
+
+    def delete(self, session_id: str) -> bool:
+        return self._cache.delete(session_id)
+
+    def stats(self) -> Dict:
+        return self._cache.stats()
+
+
+class SessionManager:
+    """
+    セッションの作成・次の曲の選択。推薦サービスは呼び出しごとに渡す
+    （カタログの再読み込みでサービスが入れ替わってもセッションは残る）。
+    同じセッションへの同時リクエストはロックで順に処理する。
+    """
+
+    # セッション ID のハッシュで選ぶロックの数
+    LOCK_STRIPES = 64
+
+    def __init__(self, store: Optional[SessionStore] = None):
+        self.store = store or SessionStore()
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def _lock(self, session_id: str) -> threading.Lock:
+        return self._locks[hash(session_id) % self.LOCK_STRIPES]
+
+    def create(
+        self,
+        service: RecommendationService,
+        members: List[Dict],
+        settings: Dict,
+        seed: Optional[int] = None,
+    ) -> Dict:
+        """
+        セッションを作成し、最初の1曲を選ぶ。seed を指定すると以降の選曲も再現できる。
+
+        Returns:
+            {"sessionId": str, "selectedSong": {...}, "selectedSingers": [...], "playedCount": int}
+        """
+        if not members:
+            raise ValueError("Members are required")
+        rng = make_rng(seed)
+        session = Session(
+            session_id=uuid.uuid4().hex,
+            members=members,
+            settings=settings,
+            profile=service.session_profile(members, settings, rng),
+            catalog_fingerprint=service.model_store.fingerprint,
+            played=_empty_played(len(service.song_catalog)),
+            singer_queue=deque(rng.permutation(len(members)).tolist()),
+            rng=rng,
+        )
+        with self._lock(session.session_id):
+            result = self._next(service, session)
+            self.store.put(session)
+        return {"sessionId": session.session_id, **result}
+
+    def next(self, service: RecommendationService, session_id: str) -> Dict:
+        """
+        次の1曲（再生済みを除く）と歌う人（ローテーション順）を選ぶ。
+
+        Returns:
+            {"sessionId": str, "selectedSong": {...}, "selectedSingers": [...], "playedCount": int}
+        """
+        with self._lock(session_id):
+            session = self.store.get(session_id)
+            if session is None:
+                raise SessionNotFoundError(f"unknown or expired session: {session_id}")
+            result = self._next(service, session)
+            self.store.put(session)  # 外部ストアでは書き戻し・プロセス内では期限の延長
+        return {"sessionId": session_id, **result}
+
+    def delete(self, session_id: str) -> bool:
+        return self.store.delete(session_id)
+
+    def stats(self) -> Dict:
+        return self.store.stats()
+
+    # ---- 選曲 ----
+    def _next(self, service: RecommendationService, session: Session) -> Dict:
+        if session.catalog_fingerprint != service.model_store.fingerprint:
+            # 行位置が変わった可能性があるので履歴を作り直す
+            session.catalog_fingerprint = service.model_store.fingerprint
+            session.played = _empty_played(len(service.song_catalog))
+            session.played_count = 0
+
+        with stage("session_draw"):
+            row = self._draw_song(service, session)
+        with stage("select_singers"):
+            singers = self._rotate_singers(session)
+        RECOMMENDATIONS.inc(era=GENERATION_TO_ERA.get(session.profile[0], "all"))
+
+        if row is None:
+            return {"selectedSong": None, "selectedSingers": singers, "playedCount": session.played_count}
+        session.mark_played(row)
+        return {
+            "selectedSong": service.song_at(row),
+            "selectedSingers": singers,
+            "playedCount": session.played_count,
+        }
+
+    def _draw_song(self, service: RecommendationService, session: Session) -> Optional[int]:
+        """
+        候補プールから未再生の曲を1曲選ぶ（通常は数回のランダム試行で済む）。
+        候補をすべて再生済みならプロファイルを引き直し、それでもなければ全曲から選ぶ。
+        全曲再生済みなら履歴を消してやり直す。
+        """
+        row = self._draw_unplayed(session, service.candidate_rows(session.profile))
+        for _ in range(PROFILE_RETRIES):
+            if row is not None:
+                return row
+            session.profile = service.session_profile(session.members, session.settings, session.rng)
+            row = self._draw_unplayed(session, service.candidate_rows(session.profile))
+        if row is None:
+            row = self._draw_unplayed(session, service.all_rows)
+        if row is None and len(service.all_rows):
+            session.played = _empty_played(len(service.song_catalog))
+            row = self._draw_unplayed(session, service.all_rows)
+        return row
+
+    @staticmethod
+    def _draw_unplayed(session: Session, rows: np.ndarray) -> Optional[int]:
+        if len(rows) == 0:
+            return None
+        for _ in range(DRAW_ATTEMPTS):
+            row = int(rows[session.rng.integers(len(rows))])
+            if not session.is_played(row):
+                return row
+        remaining = session.unplayed(rows)
+        if len(remaining) == 0:
+            return None
+        return int(remaining[session.rng.integers(len(remaining))])
+
+    @staticmethod
+    def _rotate_singers(session: Session) -> List[Dict]:
+        """キューの先頭から micCount 人を選び、末尾に回す。"""
+        mic_count = max(0, min(int(session.settings.get("micCount", 1)), len(session.members)))
+        picked = []
+        for _ in range(mic_count):
+            index = session.singer_queue.popleft()
+            session.singer_queue.append(index)
+            picked.append(session.members[index])
+        return picked
@@ -0,0 +1,50 @@
+# tests/conftest.py
+# 使い方（backend ディレクトリで）: python -m pytest -q
+import csv
+import random
+from pathlib import Path
+
+import pytest
+
+from models.song import SongCatalog
+
+GENDERS = ["男性", "女性", "混合"]
+GENRES = ["J-POP", "ロック", "アニソン", "ボカロ", "演歌", "ポップス"]
+MOODS = ["しっとり", "リラックス", "元気", "盛り上がる"]
+SITUATIONS = ["友人と", "恋人と", "家族と", "会社飲み会", "学生飲み会"]
+COLUMNS = ["title", "artist", "gender", "year", "genre", "mood_tags", "situation_tags"]
+
+
+def song_rows(count: int, seed: int = 0, start: int = 0):
+    """テスト用の曲（全年代・全性別・全ムードを含む）。曲名は start からの通し番号。"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(start, start + count):
+        rows.append([
+            f"曲{i}",
+            f"アーティスト{rng.randrange(count)}",
+            rng.choice(GENDERS),
+            rng.randint(1965, 2024),
+            rng.choice(GENRES),
+            rng.choice(MOODS),
+            rng.choice(SITUATIONS),
+        ])
+    return rows
+
+
+def write_songs_csv(path: Path, rows) -> Path:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+    return path
+
+
+@pytest.fixture(scope="session")
+def songs_csv(tmp_path_factory) -> Path:
+    return write_songs_csv(tmp_path_factory.mktemp("catalog") / "songs.csv", song_rows(600))
+
+
+@pytest.fixture(scope="session")
+def catalog(songs_csv) -> SongCatalog:
+    return SongCatalog.from_csv(songs_csv)
@@ -0,0 +1,80 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from app import create_app
+
+BACKEND_DIR = Path(__file__).parents[1]
+
+
+@pytest.fixture(scope="module")
+def client(songs_csv):
+    return create_app(csv_path=songs_csv).test_client()
+
+
+def members(count: int = 2):
+    return [
+        {"id": str(i), "nickname": f"m{i}", "gender": ["male", "female"][i % 2], "age": 20 + 5 * i}
+        for i in range(count)
+    ]
+
+
+def test_import_does_not_build_the_app(tmp_path, songs_csv):
+    # app / asgi を import しただけではカタログの読み込み・スナップショットの書き出しをしない
+    csv_path = tmp_path / "songs.csv"
+    csv_path.write_bytes(songs_csv.read_bytes())
+    subprocess.run(
+        [sys.executable, "-c", "import app, asgi"], cwd=BACKEND_DIR, check=True, env={"SONGS_CSV": str(csv_path)}
+    )
+    assert not csv_path.with_suffix(".snapshot").exists()
+
+
+def test_recommend_songs(client):
+    response = client.post("/api/recommend-songs", json={"members": members(), "settings": {}, "seed": 1})
+    assert response.status_code == 200
+    assert response.get_json()["selectedSong"]["title"]
+
+
+@pytest.mark.parametrize("limit", [True, False, 0, 101, 2.0, "3"])
+def test_ranking_rejects_invalid_limit(client, limit):
+    response = client.post(
+        "/api/recommend-songs/ranking", json={"members": members(), "settings": {}, "limit": limit}
+    )
+    assert response.status_code == 400
+
+
+def test_ranking_pages_with_cursor(client):
+    first = client.post(
+        "/api/recommend-songs/ranking", json={"members": members(), "settings": {}, "limit": 3, "seed": 1}
+    ).get_json()
+    second = client.post("/api/recommend-songs/ranking", json={"cursor": first["nextCursor"], "limit": 3}).get_json()
+    assert len(first["songs"]) == len(second["songs"]) == 3
+    assert not {s["title"] for s in first["songs"]} & {s["title"] for s in second["songs"]}
+
+
+@pytest.fixture
+def admin_client(tmp_path, songs_csv, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    csv_path = tmp_path / "songs.csv"
+    csv_path.write_bytes(songs_csv.read_bytes())
+    app = create_app(csv_path=csv_path)
+    yield app.test_client()
+    # 裏で始まった再読み込みが終わるのを待つ（tmp_path が消える前に）
+    deadline = time.monotonic() + 30
+    while app.extensions["karaoke"].reloading and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}, {"X-Admin-Token": "secre"}])
+def test_admin_reload_rejects_wrong_token(admin_client, headers):
+    assert admin_client.post("/api/admin/reload", headers=headers).status_code == 403
+
+
+@pytest.mark.parametrize("body", [[1], "force", 1, None])
+def test_admin_reload_ignores_non_object_body(admin_client, body):
+    response = admin_client.post("/api/admin/reload", headers={"X-Admin-Token": "secret"}, json=body)
+    assert response.status_code in (202, 409)
+    assert "started" in response.get_json()
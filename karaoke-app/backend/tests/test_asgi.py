@@ -0,0 +1,106 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from flask import Flask, request
+
+from asgi import MAX_BODY_BYTES, AsyncServingApp
+
+
+@pytest.fixture
+def flask_app():
+    app = Flask(__name__)
+    app.config["calls"] = []
+    app.config["release"] = threading.Event()
+
+    @app.route("/echo", methods=["POST"])
+    def echo():
+        app.config["calls"].append(request.get_data())
+        return {"size": len(request.get_data())}
+
+    @app.route("/slow", methods=["POST"])
+    def slow():
+        app.config["release"].wait(5)
+        return {"ok": True}
+
+    yield app
+    app.config["release"].set()
+
+
+def scope(path: str):
+    return {"type": "http", "method": "POST", "path": path, "headers": [(b"content-type", b"application/json")]}
+
+
+def receiver(*messages):
+    queue = list(messages)
+
+    async def receive():
+        return queue.pop(0) if queue else {"type": "http.disconnect"}
+
+    return receive
+
+
+def body_messages(body: bytes, chunk: int = 4096):
+    chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)] or [b""]
+    return [
+        {"type": "http.request", "body": part, "more_body": i < len(chunks) - 1}
+        for i, part in enumerate(chunks)
+    ]
+
+
+async def call(app: AsyncServingApp, path: str, *messages):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope(path), receiver(*messages), send)
+    if not sent:
+        return None
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def test_dispatches_to_flask(flask_app):
+    app = AsyncServingApp(flask_app)
+    assert asyncio.run(call(app, "/echo", *body_messages(b"x" * 10000))) == (200, {"size": 10000})
+
+
+def test_rejects_large_body_with_413(flask_app):
+    app = AsyncServingApp(flask_app)
+    status, _ = asyncio.run(call(app, "/echo", *body_messages(b"x" * (MAX_BODY_BYTES + 1), chunk=65536)))
+    assert status == 413
+    assert flask_app.config["calls"] == []
+
+
+def test_disconnect_before_body_ends_is_not_dispatched(flask_app):
+    app = AsyncServingApp(flask_app)
+    partial = {"type": "http.request", "body": b'{"members": [', "more_body": True}
+    assert asyncio.run(call(app, "/echo", partial, {"type": "http.disconnect"})) is None
+    assert flask_app.config["calls"] == []
+    assert app.in_flight == 0
+
+
+def test_times_out_with_504(flask_app):
+    app = AsyncServingApp(flask_app, timeout=0.1)
+    status, _ = asyncio.run(call(app, "/slow", *body_messages(b"{}")))
+    assert status == 504
+    # 処理はスレッド上で続くので、終わるまで枠を占有する
+    assert app.in_flight == 1
+
+
+def test_rejects_with_429_when_workers_and_queue_are_full(flask_app):
+    app = AsyncServingApp(flask_app, max_workers=1, max_pending=0, timeout=5)
+
+    async def scenario():
+        slow = asyncio.create_task(call(app, "/slow", *body_messages(b"{}")))
+        while app.in_flight == 0:
+            await asyncio.sleep(0.01)
+        busy = await call(app, "/echo", *body_messages(b"{}"))
+        flask_app.config["release"].set()
+        return busy, await slow
+
+    (busy_status, _), (slow_status, _) = asyncio.run(scenario())
+    assert busy_status == 429
+    assert slow_status == 200
+    assert flask_app.config["calls"] == []
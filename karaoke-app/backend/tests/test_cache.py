@@ -0,0 +1,94 @@
+import types
+
+import pytest
+
+from services import cache
+from services.cache import LRUCache
+from services.recommendation import RecommendationService
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1  # a を参照したので b が最も古い
+    lru.put("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    stats = lru.stats()
+    assert (stats["size"], stats["evictions"], stats["hits"], stats["misses"]) == (2, 1, 3, 1)
+
+
+def test_put_existing_key_refreshes_without_eviction():
+    lru = LRUCache(maxsize=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    lru.put("a", 10)
+    lru.put("c", 3)
+    assert lru.get("a") == 10
+    assert lru.get("b") is None
+    assert lru.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    lru = LRUCache(maxsize=4, ttl=10)
+    lru.put("a", 1)
+    clock.value += 10
+    assert lru.get("a") == 1
+    clock.value += 0.5
+    assert lru.get("a") is None
+    assert len(lru) == 0
+    assert lru.stats()["expirations"] == 1
+
+
+def test_put_restarts_ttl(clock):
+    lru = LRUCache(ttl=10)
+    lru.put("a", 1)
+    clock.value += 8
+    lru.put("a", 2)
+    clock.value += 8
+    assert lru.get("a") == 2
+
+
+def test_no_ttl_never_expires(clock):
+    lru = LRUCache()
+    lru.put("a", 1)
+    clock.value += 1e9
+    assert lru.get("a") == 1
+
+
+def test_delete():
+    lru = LRUCache()
+    lru.put("a", 1)
+    assert lru.delete("a")
+    assert not lru.delete("a")
+    assert lru.get("a") is None
+
+
+@pytest.fixture(scope="module")
+def service(catalog):
+    return RecommendationService(catalog, use_table=False)
+
+
+def cached_pools(service, generation, profiles):
+    service.pool_cache = LRUCache()
+    for year, gender, mood in profiles:
+        service._candidate_pool(generation, year, gender, mood)
+    return len(service.pool_cache)
+
+
+def test_pool_cache_key_keeps_only_what_the_pool_depends_on(service):
+    profiles = [(year, gender, mood) for year in (1980, 1985) for gender in range(3) for mood in range(4)]
+    # 昭和歌謡は性別だけ、年代指定なしは全曲で1つ
+    assert cached_pools(service, "演歌・昭和歌謡", profiles) == 3
+    assert cached_pools(service, None, profiles) == 1
+    # 定番・最新は年・性別・ムードごと
+    assert cached_pools(service, "定番曲・懐メロ", profiles) == len(profiles)
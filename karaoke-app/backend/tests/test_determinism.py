@@ -0,0 +1,74 @@
+import pytest
+
+from app import create_app
+from benchmarks.replay import replay
+from services.recommendation import RecommendationService, make_rng
+from services.request_log import RequestLog
+
+MOODS = ["定番曲・懐メロ", "最新ヒット", "演歌・昭和歌謡", None]
+
+
+def group(i: int):
+    members = [
+        {"id": str(j), "nickname": f"m{j}", "gender": ["male", "female", "others"][(i + j) % 3], "age": 19 + 7 * j + i}
+        for j in range(1 + i % 4)
+    ]
+    settings = {"mood": MOODS[i % 4], "situation": ["友人と", "恋人と", "家族と"][i % 3], "micCount": 1 + i % 2}
+    return members, settings
+
+
+@pytest.fixture(scope="module")
+def service(catalog):
+    return RecommendationService(catalog, use_table=False)
+
+
+def test_same_seed_gives_the_same_recommendation(catalog, service):
+    other = RecommendationService(catalog, model_store=service.model_store, use_table=False)
+    for i in range(24):
+        members, settings = group(i)
+        first = service.recommend_songs(members, settings, rng=make_rng(i))
+        assert first == service.recommend_songs(members, settings, rng=make_rng(i))
+        assert first == other.recommend_songs(members, settings, rng=make_rng(i))
+
+
+def test_batch_matches_single_requests_with_the_same_seed(service):
+    requests = [dict(zip(("members", "settings"), group(i)), seed=100 + i) for i in range(24)]
+    batch = service.recommend_batch(requests)
+    single = [service.recommend_songs(r["members"], r["settings"], rng=make_rng(r["seed"])) for r in requests]
+    assert batch == single
+
+
+def test_batch_seed_is_reproducible(service):
+    requests = [dict(zip(("members", "settings"), group(i))) for i in range(12)]
+    assert service.recommend_batch(requests, seed=5) == service.recommend_batch(requests, seed=5)
+
+
+def test_batch_reports_errors_per_item(service):
+    members, settings = group(0)
+    results = service.recommend_batch([{"members": members, "settings": settings}, {"members": []}, "x"], seed=1)
+    assert "selectedSong" in results[0]
+    assert results[1] == {"error": "Members are required"}
+    assert results[2] == {"error": "Invalid request"}
+
+
+def test_request_log_replays_identically(tmp_path, monkeypatch, songs_csv):
+    log_path = tmp_path / "requests.log"
+    monkeypatch.setenv("REQUEST_LOG", str(log_path))
+    client = create_app(csv_path=songs_csv).test_client()
+    for i in range(8):
+        members, settings = group(i)
+        client.post("/api/recommend-songs", json={"members": members, "settings": settings})
+        client.post("/api/recommend-songs/batch", json={"requests": [{"members": members, "settings": settings}] * 3})
+    members, settings = group(1)
+    ranking = client.post("/api/recommend-songs/ranking", json={"members": members, "settings": settings, "limit": 2})
+    client.post("/api/recommend-songs/ranking", json={"cursor": ranking.get_json()["nextCursor"], "limit": 2})
+    session_id = client.post("/api/sessions", json={"members": members, "settings": settings}).get_json()["sessionId"]
+    for _ in range(3):
+        client.post(f"/api/sessions/{session_id}/next")
+    client.delete(f"/api/sessions/{session_id}")
+
+    entries = list(RequestLog.read(log_path))
+    assert len(entries) == 8 * 2 + 2 + 1 + 3 + 1
+    monkeypatch.delenv("REQUEST_LOG")
+    result = replay(entries, create_app(csv_path=songs_csv).test_client())
+    assert result["mismatches"] == []
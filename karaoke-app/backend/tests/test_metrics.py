@@ -0,0 +1,37 @@
+import pytest
+
+from app import create_app
+from services import recommendation
+from services.cluster_model import ModelStore
+from services.recommendation import RecommendationService
+
+MEMBERS = [{"id": "1", "nickname": "a", "gender": "male", "age": 30}]
+
+
+@pytest.fixture(scope="module")
+def model_store(catalog):
+    return ModelStore(catalog)
+
+
+def test_debug_sample_rate_default_follows_the_module_setting(catalog, model_store, monkeypatch):
+    monkeypatch.setattr(recommendation, "DEBUG_SAMPLE_RATE", 1.0)
+    service = RecommendationService(catalog, model_store=model_store, use_table=False)
+    assert service.debug_sample_rate == 1.0
+    assert service._debug_enabled({})
+    assert RecommendationService(catalog, model_store=model_store, debug_sample_rate=0).debug_sample_rate == 0
+
+    monkeypatch.setattr(recommendation, "DEBUG_SAMPLE_RATE", 0.0)
+    service = RecommendationService(catalog, model_store=model_store, use_table=False)
+    assert not service._debug_enabled({})
+    assert service._debug_enabled({"debug": True})
+
+
+def test_metrics_endpoint_reports_stages_latency_and_caches(songs_csv):
+    client = create_app(csv_path=songs_csv).test_client()
+    client.post("/api/recommend-songs", json={"members": MEMBERS, "settings": {"mood": "定番曲・懐メロ"}})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'karaoke_recommend_stage_seconds_count{stage="determine_year"}' in body
+    assert 'karaoke_http_request_seconds_count{endpoint="/api/recommend-songs",status="200"}' in body
+    assert 'karaoke_cache_entries{cache="candidatePool"}' in body
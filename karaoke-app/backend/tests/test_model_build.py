@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from services.model_build import _candidate_ks, build_models, parse_k_candidates
+
+
+def test_parse_k_candidates():
+    assert parse_k_candidates("8") == (8,)
+    assert parse_k_candidates(" 4, 8,12 ,") == (4, 8, 12)
+    for value in ["", ",", "0", "4,-1", "a", "4,x"]:
+        with pytest.raises(ValueError):
+            parse_k_candidates(value)
+
+
+def test_candidate_ks_are_capped_by_group_size_and_never_empty():
+    assert _candidate_ks(5, [4, 8, 12]) == [4, 5]
+    assert _candidate_ks(3, [0, -2]) == [1]
+
+
+def test_build_models_falls_back_to_one_cluster_without_valid_candidates(catalog):
+    groups = {"small": np.arange(3), "large": np.arange(40), "empty": np.arange(0)}
+    models, report = build_models(catalog, groups, k_candidates=[0, -2], processes=1)
+
+    assert models["empty"] is None
+    assert {build.group: build.k for build in report} == {"small": 1, "large": 1}
+    assert models["small"].centers.shape[0] == 1
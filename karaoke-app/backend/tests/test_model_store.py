@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from models.snapshot import file_sha256, load_snapshot, write_snapshot
+from services.cluster_model import ModelStore
+
+
+@pytest.fixture(scope="module")
+def stores(catalog):
+    return {feature_set: ModelStore(catalog, feature_set=feature_set) for feature_set in ("basic", "rich")}
+
+
+def snapshot_arrays(tmp_path, songs_csv, catalog, arrays):
+    path = tmp_path / "songs.snapshot"
+    write_snapshot(catalog, path, file_sha256(songs_csv), arrays)
+    return load_snapshot(path, songs_csv)
+
+
+@pytest.mark.parametrize("feature_set", ["basic", "rich"])
+def test_snapshot_round_trip_restores_models_without_fitting(tmp_path, songs_csv, catalog, stores, feature_set):
+    store = stores[feature_set]
+    snapshot = snapshot_arrays(tmp_path, songs_csv, catalog, store.export_arrays())
+    restored = ModelStore(snapshot.catalog, model_arrays=snapshot.extras, feature_set=feature_set)
+
+    assert restored.build_report == []
+    assert restored.fingerprint == store.fingerprint
+    for era, model in store.models.items():
+        assert np.array_equal(restored.models[era].centers, model.centers)
+        assert np.array_equal(restored.models[era].labels, model.labels)
+        assert restored.models[era].baseline_inertia == model.baseline_inertia
+
+
+@pytest.mark.parametrize("saved, loaded", [("rich", "basic"), ("basic", "rich")])
+def test_snapshot_from_other_feature_set_is_refitted(tmp_path, songs_csv, catalog, stores, saved, loaded):
+    snapshot = snapshot_arrays(tmp_path, songs_csv, catalog, stores[saved].export_arrays())
+    restored = ModelStore(snapshot.catalog, model_arrays=snapshot.extras, feature_set=loaded)
+
+    assert {build.group for build in restored.build_report} == set(restored.groups)
+    for era, model in stores[loaded].models.items():
+        assert restored.models[era].centers.shape == model.centers.shape
+        assert np.array_equal(restored.models[era].labels, model.labels)
+
+
+def test_snapshot_without_feature_set_is_refitted(catalog, stores):
+    arrays = stores["basic"].export_arrays()
+    del arrays["models.feature_set"]
+    restored = ModelStore(catalog, model_arrays=arrays, feature_set="basic")
+    assert {build.group for build in restored.build_report} == set(restored.groups)
+
+
+def test_snapshot_with_mismatched_center_shape_is_refitted(catalog, stores):
+    # 次元の倍数になる大きさでも、(k, 次元) が一致しなければ使わない
+    arrays = stores["basic"].export_arrays()
+    arrays["showa.centers"] = np.zeros((1, arrays["showa.centers"].size))
+    restored = ModelStore(catalog, model_arrays=arrays, feature_set="basic")
+    assert [build.group for build in restored.build_report] == ["showa"]
+    assert restored.models["showa"].centers.shape[1] == 3
@@ -0,0 +1,79 @@
+import math
+
+import numpy as np
+import pytest
+
+from models.song import SongCatalog
+from services.cluster_model import ModelStore
+from services.features import assigned_sq_distances, cluster_sums
+from tests.conftest import song_rows, write_songs_csv
+
+BASE = song_rows(600)
+ADDED = song_rows(80, seed=1, start=600)
+
+
+@pytest.fixture(scope="module")
+def catalogs(tmp_path_factory):
+    path = tmp_path_factory.mktemp("update")
+    return {
+        name: SongCatalog.from_csv(write_songs_csv(path / f"{name}.csv", rows))
+        for name, rows in {"base": BASE, "appended": BASE + ADDED, "removed": BASE[1:] + ADDED}.items()
+    }
+
+
+@pytest.fixture(scope="module", params=["basic", "rich"])
+def store(request, catalogs):
+    return ModelStore(catalogs["base"], feature_set=request.param)
+
+
+def test_same_catalog_returns_the_same_store(store, catalogs):
+    assert store.updated(catalogs["base"]) is store
+
+
+def test_appended_songs_are_merged_incrementally(store, catalogs):
+    updated = store.updated(catalogs["appended"], drift_threshold=math.inf)
+    # 差分更新できない年代（追加曲に学習時になかったムードがある等）だけ再学習される
+    refit = {build.group for build in updated.build_report}
+    assert refit == {update.era for update in updated.update_report if update.refit}
+    assert updated.size == len(catalogs["appended"])
+    assert updated.fingerprint == ModelStore(catalogs["appended"], feature_set=store.feature_set).fingerprint
+
+    extended = 0
+    for era, model in updated.models.items():
+        assert np.array_equal(np.sort(model.catalog_rows), np.sort(updated.groups[era]))
+        if len(model) == len(store.models[era]):
+            assert model is store.models[era]
+            continue
+        if era in refit:
+            continue
+        assert model.kmeans is None
+        extended += 1
+        update = next(update for update in updated.update_report if update.era == era)
+        assert (update.reason, update.added, update.drift) == ("incremental", len(model) - len(store.models[era]), model.drift)
+        k = len(model.centers)
+        # 重心は所属曲の平均、inertia は全曲から計算し直した値と一致する
+        means = cluster_sums(model.features, model.labels, k) / np.bincount(model.labels, minlength=k)[:, None]
+        assert np.allclose(means, model.centers)
+        exact = float(assigned_sq_distances(model.features, model.centers, model.labels).sum())
+        assert model.inertia == pytest.approx(exact, rel=1e-9)
+        assert model.drift == pytest.approx(exact / len(model) / model.baseline_inertia - 1.0)
+        for c, rows in enumerate(model.cluster_rows):
+            assert np.array_equal(rows, model.catalog_rows[model.labels == c])
+    assert extended > 0
+
+
+def test_drift_over_threshold_refits(store, catalogs):
+    updated = store.updated(catalogs["appended"], drift_threshold=-1.0)
+    refit = {era for era, model in updated.models.items() if len(model) != len(store.models[era])}
+    assert refit
+    assert {build.group for build in updated.build_report} == refit
+    assert {update.era for update in updated.update_report if update.refit} == refit
+    for era in refit:
+        assert updated.models[era].drift == pytest.approx(0.0)
+
+
+def test_removed_songs_refit_everything(store, catalogs):
+    updated = store.updated(catalogs["removed"])
+    assert updated.size == len(catalogs["removed"])
+    assert {build.group for build in updated.build_report} == set(store.models)
+    assert updated.update_report == []
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from services.cluster_model import ModelStore
+
+
+@pytest.fixture(scope="module", params=["basic", "rich"])
+def store(request, catalog):
+    return ModelStore(catalog, feature_set=request.param)
+
+
+def dense(features):
+    return features.toarray() if hasattr(features, "toarray") else np.asarray(features)
+
+
+def query_vectors(model, count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vecs = np.array([
+        model.query_vector(int(g), int(m), float(y))
+        for g, m, y in zip(
+            rng.integers(0, 3, count),
+            rng.integers(0, len(model.mood_classes), count),
+            rng.uniform(model.year_min, model.year_max, count),
+        )
+    ])
+    if model.scaler is not None:
+        vecs = model.scaler.transform(vecs)
+    return vecs, rng.integers(0, 3, count)
+
+
+@pytest.mark.parametrize("k", [1, 7, 50, 10_000])
+def test_nearest_rows_match_brute_force(store, k):
+    for era, model in store.models.items():
+        features = dense(model.features)
+        position = {row: i for i, row in enumerate(model.catalog_rows.tolist())}
+        vecs, genders = query_vectors(model, 40)
+        results = model.neighbors.nearest_rows_batch(vecs, genders, k)
+        for vec, gender, rows in zip(vecs, genders, results):
+            # 男性/女性希望ならその性別の曲だけ（いなければグループ全体）から探す
+            candidates = np.arange(len(model))
+            if gender in (0, 2) and (model.gender_codes == gender).any():
+                candidates = np.flatnonzero(model.gender_codes == gender)
+            expected = np.sort(np.linalg.norm(features[candidates] - vec, axis=1))[:k]
+
+            local = np.array([position[row] for row in rows.tolist()], dtype=np.int64)
+            assert len(set(local.tolist())) == len(local)
+            assert set(local.tolist()) <= set(candidates.tolist())
+            actual = np.linalg.norm(features[local] - vec, axis=1)
+            # 近い順で、距離の列は全探索と一致する（同じ距離の曲の選び方は問わない）
+            assert np.all(np.diff(actual) >= -1e-9)
+            assert np.allclose(actual, expected)
+
+
+def test_single_query_matches_batch(store):
+    for era, model in store.models.items():
+        vecs, genders = query_vectors(model, 10, seed=1)
+        batch = model.neighbors.nearest_rows_batch(vecs, genders, 20)
+        for vec, gender, rows in zip(vecs, genders, batch):
+            assert np.array_equal(model.nearest_rows(vec, int(gender), 20), rows)
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from services import recommendation
+from services.catalog_loader import load_recommendation_service
+from services.cluster_model import ModelStore
+from services.recommendation import GENERATION_TO_ERA, RecommendationService, make_rng, table_years
+from tests.conftest import song_rows, write_songs_csv
+
+MOODS = ["定番曲・懐メロ", "最新ヒット", "演歌・昭和歌謡", None]
+
+
+@pytest.fixture(scope="module")
+def model_store(catalog):
+    return ModelStore(catalog)
+
+
+@pytest.fixture(scope="module")
+def table_service(catalog, model_store):
+    return RecommendationService(catalog, model_store=model_store, use_table=True)
+
+
+@pytest.fixture(scope="module")
+def plain_service(catalog, model_store):
+    return RecommendationService(catalog, model_store=model_store, use_table=False)
+
+
+def random_group(rng: np.random.Generator, members: int, integer_ages: bool = True):
+    ages = rng.integers(0, 101, members) if integer_ages else rng.uniform(0, 100, members)
+    return [
+        {"id": str(j), "nickname": f"m{j}", "gender": ["male", "female", "others"][int(g)], "age": age.item()}
+        for j, (g, age) in enumerate(zip(rng.integers(0, 3, members), ages))
+    ]
+
+
+def test_use_table_default_follows_the_module_setting(catalog, model_store, monkeypatch):
+    monkeypatch.setattr(recommendation, "USE_TABLE", True)
+    assert RecommendationService(catalog, model_store=model_store).table is not None
+    assert RecommendationService(catalog, model_store=model_store, use_table=False).table is None
+
+    monkeypatch.setattr(recommendation, "USE_TABLE", False)
+    assert RecommendationService(catalog, model_store=model_store).table is None
+    assert RecommendationService(catalog, model_store=model_store, use_table=True).table is not None
+
+
+def test_every_slot_matches_the_online_candidate_pool(table_service, plain_service):
+    table = table_service.table
+    era_generation = {era: generation for generation, era in GENERATION_TO_ERA.items()}
+    assert set(table.years) == {"showa", "classic", "latest"}
+    for era, years in table.years.items():
+        for year in years.tolist():
+            for gender in range(3):
+                for mood in range(4):
+                    expected = plain_service._build_candidate_pool(era_generation[era], year, gender, mood)
+                    assert np.array_equal(table.lookup(era, year, gender, mood), expected)
+
+
+def test_years_of_integer_age_groups_are_in_the_table(table_service):
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        members = random_group(rng, int(rng.integers(1, recommendation.TABLE_MAX_MEMBERS + 1)))
+        year = table_service._determine_year(members, {"mood": "定番曲・懐メロ"}, rng)
+        assert table_service.table.lookup("classic", year, 0, 0) is not None
+    # 表にない年（7人以上・小数の年齢）は None（呼び出し側が計算する）
+    assert table_service.table.lookup("classic", recommendation.classic_year(20 + 1 / 7), 0, 0) is None
+    assert table_service.table.lookup("showa", 1979, 0, 0) is None
+
+
+@pytest.mark.parametrize("members,integer_ages", [(1, True), (3, True), (6, True), (3, False), (8, True)])
+def test_results_match_the_service_without_table(table_service, plain_service, members, integer_ages):
+    rng = np.random.default_rng(members)
+    for i in range(60):
+        group = random_group(rng, members, integer_ages)
+        settings = {"mood": MOODS[i % 4], "situation": ["友人と", "恋人と", "家族と"][i % 3], "micCount": 1}
+        assert (
+            table_service.recommend_songs(group, settings, rng=make_rng(i))
+            == plain_service.recommend_songs(group, settings, rng=make_rng(i))
+        )
+
+
+def test_batch_results_match_the_service_without_table(table_service, plain_service):
+    rng = np.random.default_rng(9)
+    requests = [
+        {"members": random_group(rng, 1 + i % 5, integer_ages=i % 3 > 0), "settings": {"mood": MOODS[i % 4]}, "seed": i}
+        for i in range(40)
+    ]
+    assert table_service.recommend_batch(requests) == plain_service.recommend_batch(requests)
+
+
+def test_table_round_trips_through_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(recommendation, "USE_TABLE", True)
+    csv_path = write_songs_csv(tmp_path / "songs.csv", song_rows(200, seed=3))
+    snapshot_path = tmp_path / "songs.snapshot"
+    _, built = load_recommendation_service(csv_path, snapshot_path)
+    _, loaded = load_recommendation_service(csv_path, snapshot_path)
+
+    assert loaded.table.signature == built.table.signature
+    assert np.array_equal(loaded.table.rows, built.table.rows)
+    assert not loaded.table.rows.flags.writeable
+    for era, years in built.table.years.items():
+        assert np.array_equal(loaded.table.years[era], years)
+        assert np.array_equal(loaded.table.slots[era], built.table.slots[era])
+
+
+def test_table_is_rebuilt_when_the_years_change(monkeypatch, catalog, table_service):
+    arrays = table_service.export_arrays()
+    monkeypatch.setattr(recommendation, "TABLE_MAX_MEMBERS", 2)
+    service = RecommendationService(catalog, model_arrays=arrays, use_table=True)
+    assert service.table.signature != table_service.table.signature
+    assert np.array_equal(service.table.years["classic"], table_years(2)["classic"])
@@ -0,0 +1,80 @@
+import runpy
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+from app import create_app
+from services.service_state import ServiceState
+from tests.conftest import song_rows, write_songs_csv
+
+BACKEND_DIR = Path(__file__).parents[1]
+
+
+def wait_until(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = ServiceState(write_songs_csv(tmp_path / "songs.csv", song_rows(300)))
+    assert state.warmup()
+    return state
+
+
+def test_reload_swaps_in_a_new_version(state):
+    old = state.current
+    state.reload(background=False)
+    assert state.current is old  # 内容が同じなら差し替えない
+
+    write_songs_csv(state.csv_path, song_rows(300) + song_rows(20, seed=1, start=300))
+    assert state.reload(background=False)
+
+    assert state.current.version == old.version + 1
+    assert len(state.song_catalog) == 320
+    # 取得済みの版は変わらない
+    assert len(old.song_catalog) == 300
+    assert len(old.recommendation_service.all_rows) == 300
+    # 追加曲の取り込み方（差分更新か再学習か）は状態に出る
+    updates = state.status()["models"]["updates"]
+    assert sum(update["added"] for update in updates) == 20
+    assert {update["era"] for update in updates if update["refit"]} == {
+        build["group"] for build in state.status()["models"]["builds"]
+    }
+
+
+def test_watcher_retries_while_another_reload_is_running(state):
+    state.reloading = True  # 管理 API の再読み込みが実行中
+    state.start_watcher(0.05)
+    time.sleep(0.2)  # 監視の初回確認（内容は同じ）を済ませる
+    write_songs_csv(state.csv_path, song_rows(300) + song_rows(20, seed=1, start=300))
+    time.sleep(0.3)
+    assert state.current.version == 1
+
+    state.reloading = False
+    assert wait_until(lambda: state.current.version == 2)
+    assert len(state.song_catalog) == 320
+
+
+def test_gunicorn_starts_the_watcher_only_in_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv("CATALOG_WATCH_INTERVAL", "3600")
+    monkeypatch.setenv("CATALOG_WATCH_POST_FORK", "0")
+    csv_path = write_songs_csv(tmp_path / "songs.csv", song_rows(50))
+    # 直接起動（python app.py / uvicorn）なら create_app が監視を始める
+    assert create_app(csv_path=csv_path).extensions["karaoke"]._watcher.is_alive()
+
+    # gunicorn: 設定ファイル（アプリの読み込み前に実行される）で親プロセスでは監視しない
+    config = runpy.run_path(str(BACKEND_DIR / "gunicorn.conf.py"))
+    app = create_app(csv_path=csv_path)
+    state = app.extensions["karaoke"]
+    assert state._watcher is None
+
+    server = types.SimpleNamespace(app=types.SimpleNamespace(wsgi=lambda: app))
+    config["post_fork"](server, None)
+    assert state._watcher.is_alive()
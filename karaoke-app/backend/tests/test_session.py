@@ -0,0 +1,84 @@
+import pickle
+
+import pytest
+
+from models.song import SongCatalog
+from services.recommendation import RecommendationService
+from services.session import SessionManager, SessionNotFoundError
+from tests.conftest import song_rows, write_songs_csv
+
+MEMBERS = [
+    {"id": "1", "nickname": "a", "gender": "male", "age": 25},
+    {"id": "2", "nickname": "b", "gender": "female", "age": 31},
+    {"id": "3", "nickname": "c", "gender": "others", "age": 44},
+]
+SETTINGS = {"mood": "定番曲・懐メロ", "situation": "友人と", "micCount": 1}
+
+
+@pytest.fixture(scope="module")
+def service(catalog):
+    return RecommendationService(catalog, use_table=False)
+
+
+def draws(manager, service, count, seed=0, members=MEMBERS, settings=SETTINGS):
+    first = manager.create(service, members, settings, seed=seed)
+    return [first] + [manager.next(service, first["sessionId"]) for _ in range(count - 1)]
+
+
+def title(result):
+    return result["selectedSong"]["title"]
+
+
+def test_songs_do_not_repeat(service):
+    results = draws(SessionManager(), service, 200)
+    titles = [title(r) for r in results]
+    assert len(set(titles)) == len(titles)
+    assert [r["playedCount"] for r in results] == list(range(1, 201))
+
+
+def test_history_restarts_after_the_whole_catalog_is_played(tmp_path):
+    small = RecommendationService(SongCatalog.from_csv(write_songs_csv(tmp_path / "s.csv", song_rows(12))))
+    titles = [title(r) for r in draws(SessionManager(), small, 14)]
+    assert len(set(titles[:12])) == 12
+    assert all(titles)
+
+
+def test_singers_rotate(service):
+    results = draws(SessionManager(), service, 9)
+    singers = [r["selectedSingers"][0]["id"] for r in results]
+    # 全員が歌うまで同じ人は選ばれず、同じ順で回る
+    for start in range(0, 9, 3):
+        assert sorted(singers[start:start + 3]) == ["1", "2", "3"]
+    assert singers[:3] == singers[3:6] == singers[6:9]
+
+
+def test_mic_count_picks_distinct_singers(service):
+    results = draws(SessionManager(), service, 3, settings=dict(SETTINGS, micCount=2))
+    for result in results:
+        ids = [s["id"] for s in result["selectedSingers"]]
+        assert len(ids) == len(set(ids)) == 2
+
+
+def test_same_seed_gives_the_same_session(service):
+    first = [(title(r), r["selectedSingers"]) for r in draws(SessionManager(), service, 20, seed=7)]
+    second = [(title(r), r["selectedSingers"]) for r in draws(SessionManager(), service, 20, seed=7)]
+    assert first == second
+
+
+def test_unknown_and_deleted_sessions(service):
+    manager = SessionManager()
+    with pytest.raises(SessionNotFoundError):
+        manager.next(service, "missing")
+    session_id = manager.create(service, MEMBERS, SETTINGS, seed=1)["sessionId"]
+    assert manager.delete(session_id)
+    with pytest.raises(SessionNotFoundError):
+        manager.next(service, session_id)
+
+
+def test_session_can_be_pickled_for_external_stores(service):
+    manager = SessionManager()
+    session_id = manager.create(service, MEMBERS, SETTINGS, seed=3)["sessionId"]
+    session = manager.store.get(session_id)
+    restored = pickle.loads(pickle.dumps(session))
+    assert restored.played == session.played
+    assert list(restored.singer_queue) == list(session.singer_queue)
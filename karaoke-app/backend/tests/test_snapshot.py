@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from models.snapshot import _ALIGN, _PREFIX, file_sha256, load_snapshot, write_snapshot
+from models.song import SongCatalog
+from services.catalog_loader import load_recommendation_service
+from tests.conftest import song_rows, write_songs_csv
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    csv_path = write_songs_csv(tmp_path / "songs.csv", song_rows(120, seed=4))
+    path = tmp_path / "songs.snapshot"
+    write_snapshot(SongCatalog.from_csv(csv_path), path, file_sha256(csv_path), {"extra": bytearray(b"abc")})
+    return csv_path, path
+
+
+def rewrite_header(path, edit):
+    """ヘッダ JSON を edit で書き換え、データ領域はそのままにしてファイルを作り直す。"""
+    raw = path.read_bytes()
+    magic, version, header_len = _PREFIX.unpack_from(raw, 0)
+    header_end = _PREFIX.size + header_len
+    data = raw[header_end + (-header_end % _ALIGN):]
+    header = json.loads(raw[_PREFIX.size:header_end])
+    edit(header)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix = _PREFIX.pack(magic, version, len(header_bytes))
+    pad = -(len(prefix) + len(header_bytes)) % _ALIGN
+    path.write_bytes(prefix + header_bytes + b"\0" * pad + data)
+
+
+def test_round_trip(snapshot):
+    csv_path, path = snapshot
+    loaded = load_snapshot(path, csv_path)
+    catalog = SongCatalog.from_csv(csv_path)
+    assert [s.title for s in loaded.catalog.all()] == [s.title for s in catalog.all()]
+    assert bytes(loaded.extras["extra"]) == b"abc"
+
+
+def test_truncated_files_are_ignored(snapshot):
+    csv_path, path = snapshot
+    raw = path.read_bytes()
+    for size in sorted({0, 3, _PREFIX.size, _PREFIX.size + 10, len(raw) // 4, len(raw) // 2, len(raw) - 1}):
+        path.write_bytes(raw[:size])
+        assert load_snapshot(path, csv_path) is None, size
+
+
+def test_header_without_required_keys_is_ignored(snapshot):
+    csv_path, path = snapshot
+    rewrite_header(path, lambda header: header.pop("source_sha256"))
+    assert load_snapshot(path) is None
+    assert load_snapshot(path, csv_path) is None
+
+
+def test_block_outside_the_file_is_ignored(snapshot):
+    csv_path, path = snapshot
+    rewrite_header(path, lambda header: header["columns"]["year"].update(offset=1 << 40))
+    assert load_snapshot(path, csv_path) is None
+
+
+def test_column_length_mismatch_is_ignored(snapshot):
+    csv_path, path = snapshot
+    rewrite_header(path, lambda header: header.update(count=header["count"] + 1))
+    assert load_snapshot(path, csv_path) is None
+
+
+def test_service_falls_back_to_csv_and_rewrites_a_corrupt_snapshot(snapshot):
+    csv_path, path = snapshot
+    raw = path.read_bytes()
+    path.write_bytes(raw[:len(raw) // 2])
+
+    catalog, service = load_recommendation_service(csv_path, path)
+    assert len(catalog) == 120
+    assert service.recommend_songs([{"id": "1", "nickname": "a", "gender": "male", "age": 30}], {})["selectedSong"]
+    # 読み直した内容で書き直されるので、次回はスナップショットから読める
+    assert load_snapshot(path, csv_path) is not None
@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+
+from models.snapshot import file_sha256, load_snapshot, write_snapshot
+from models.song import SongCatalog, normalize_tag, parse_tags
+from tests.conftest import GENDERS, GENRES, MOODS, SITUATIONS, song_rows, write_songs_csv
+
+
+@pytest.fixture(scope="module", params=["csv", "snapshot"])
+def songs(request, catalog, songs_csv, tmp_path_factory):
+    if request.param == "csv":
+        return catalog
+    path = tmp_path_factory.mktemp("snapshot") / "songs.snapshot"
+    write_snapshot(catalog, path, file_sha256(songs_csv))
+    return load_snapshot(path, songs_csv).catalog
+
+
+def matches(song, decade, mood, situation, genre, gender) -> bool:
+    return (
+        (decade is None or song.decade == decade)
+        and (mood is None or mood in song.mood_tags)
+        and (situation is None or situation in song.situation_tags)
+        and (genre is None or normalize_tag(song.genre) == normalize_tag(genre))
+        and (gender is None or song.gender == gender)
+    )
+
+
+def test_filter_ids_matches_a_full_scan(songs):
+    all_songs = songs.all()
+    options = [
+        [None, "1970s", "1990s", "2020s", "1890s"],
+        [None, *MOODS[:2], "存在しない"],
+        [None, *SITUATIONS[:2]],
+        [None, GENRES[0], GENRES[0].lower()],
+        [None, *GENDERS],
+    ]
+    for criteria in itertools.product(*options):
+        expected = [i for i, song in enumerate(all_songs) if matches(song, *criteria)]
+        assert songs.filter_ids(*criteria) == expected, criteria
+
+
+def test_filter_ids_without_fixed_width_tag_masks(tmp_path):
+    # タグが64種類を超えるとビットマスク列は int のリストになり、ポスティングリストで判定する
+    rows = song_rows(300, seed=2)
+    for i, row in enumerate(rows):
+        row[5] = f"タグ{i % 70}"
+    catalog = SongCatalog.from_csv(write_songs_csv(tmp_path / "songs.csv", rows))
+    assert isinstance(catalog._mood_mask, list)
+    all_songs = catalog.all()
+    for criteria in itertools.product([None, "1980s"], ["タグ3", "タグ69"], [None, SITUATIONS[0]], [None], [None, "女性"]):
+        expected = [i for i, song in enumerate(all_songs) if matches(song, *criteria)]
+        assert catalog.filter_ids(*criteria) == expected, criteria
+
+
+def test_all_returns_the_cached_tuple(songs):
+    all_songs = songs.all()
+    assert songs.all() is all_songs
+    assert len(all_songs) == len(songs)
+    assert all_songs[7] == songs.song(7)
+
+
+def test_parse_tags_returns_a_fresh_set():
+    tags = parse_tags("元気, 盛り上がる／Ｊ-POP")
+    assert tags == {"元気", "盛り上がる", "j-pop"} and type(tags) is set
+    tags.add("追加")
+    assert parse_tags("元気, 盛り上がる／Ｊ-POP") == {"元気", "盛り上がる", "j-pop"}
+    assert parse_tags(None) == set()
@@ -0,0 +1,7 @@
+# wsgi.py
+# 本番用エントリポイント: gunicorn -c gunicorn.conf.py wsgi:app
+# アプリを作る（= カタログ読み込み・モデル学習）のはこのモジュールを読み込んだときだけ。
+# preload_app なら gunicorn の親プロセスで1回だけ行う
+from app import create_app
+
+app = create_app()